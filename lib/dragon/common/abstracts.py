@@ -12,7 +12,7 @@ from lib.dragon.common.exceptions import CuckooMachineError
 from lib.dragon.common.exceptions import CuckooOperationalError
 from lib.dragon.common.exceptions import CuckooReportError
 from lib.dragon.common.exceptions import CuckooDependencyError
-from lib.dragon.common.objects import Dictionary
+from lib.dragon.common.objects import Dictionary, UniqueList
 from lib.dragon.common.utils import create_folder
 from lib.dragon.common.config import Config
 from lib.dragon.common.constants import CUCKOO_ROOT
@@ -429,9 +429,14 @@ class Processing(object):
     """Base abstract class for processing module."""
     order = 1
     enabled = True
+    # Results key the module stores its output in.
+    key = None
+    # Results keys of other modules which have to be completed first.
+    requires = []
 
     def __init__(self):
         self.task = None
+        self.results = {}
         self.analysis_path = ""
         self.logs_path = ""
 
@@ -441,6 +446,12 @@ class Processing(object):
         """
         self.task = task
 
+    def set_results(self, results):
+        """Set the results of the required modules.
+        @param results: results dict.
+        """
+        self.results = results
+
     def set_path(self, analysis_path):
         """Set paths.
         @param analysis_path: analysis folder path.
@@ -463,7 +474,12 @@ class Processing(object):
         raise NotImplementedError
 
 class Signature(object):
-    """Base class for Cuckoo signatures."""
+    """Base class for Cuckoo signatures.
+
+    Signatures either implement run(), or are evented: they receive the API
+    calls they are interested in through on_call(), during a single pass over
+    the behavior logs shared by all the evented signatures.
+    """
 
     name = ""
     description = ""
@@ -477,10 +493,30 @@ class Signature(object):
     minimum = None
     maximum = None
 
+    # Evented signatures receive the calls matching all the given filters.
+    # Empty filters don't filter anything.
+    evented = False
+    filter_processnames = set()
+    filter_apinames = set()
+    filter_categories = set()
+
+    # Compiled regular expressions, shared by all the signatures.
+    _patterns = {}
+
     def __init__(self, results=None):
         self.data = []
         self.results = results
 
+    def _compile(self, pattern):
+        """Compile a regular expression, once.
+        @param pattern: regular expression.
+        @return: compiled expression.
+        """
+        exp = self._patterns.get(pattern)
+        if exp is None:
+            exp = self._patterns[pattern] = re.compile(pattern, re.IGNORECASE)
+        return exp
+
     def _check_value(self, pattern, subject, regex=False):
         """Checks a pattern against a given subject.
         @param pattern: string or expression to check for.
@@ -490,7 +526,7 @@ class Signature(object):
         @return: boolean with the result of the check.
         """
         if regex:
-            exp = re.compile(pattern, re.IGNORECASE)
+            exp = self._compile(pattern)
             if isinstance(subject, list):
                 for item in subject:
                     if exp.match(item):
@@ -499,7 +535,10 @@ class Signature(object):
                 if exp.match(subject):
                     return subject
         else:
-            if isinstance(subject, list):
+            if isinstance(subject, UniqueList):
+                if pattern in subject:
+                    return pattern
+            elif isinstance(subject, list):
                 for item in subject:
                     if item == pattern:
                         return item
@@ -509,6 +548,54 @@ class Signature(object):
 
         return None
 
+    def _first_match(self, pattern, offsets, regex=False):
+        """Find the earliest item matching a pattern.
+        @param pattern: string or expression to check for.
+        @param offsets: dict of items to the offset they appear first at.
+        @param regex: boolean representing if the pattern is a regular
+                      expression or not and therefore should be compiled.
+        @return: tuple of matched item and its offset, or None.
+        """
+        if not regex:
+            if pattern in offsets:
+                return pattern, offsets[pattern]
+            return None
+
+        exp = self._compile(pattern)
+        first = None
+        for item, offset in offsets.iteritems():
+            if (first is None or offset < first[1]) and exp.match(item):
+                first = item, offset
+        return first
+
+    def _scan_arguments(self, pattern, calls, names, limit=None, regex=False):
+        """Find the earliest argument value matching a pattern among the
+        values left out of the calls index.
+        @param pattern: string or expression to check for.
+        @param calls: calls of a process.
+        @param names: dict of API names to the argument names to check.
+        @param limit: offset of the calls to stop at.
+        @param regex: boolean representing if the pattern is a regular
+                      expression or not and therefore should be compiled.
+        @return: tuple of matched value and its offset, or None.
+        """
+        for offset, call in enumerate(calls):
+            if limit is not None and offset >= limit:
+                break
+
+            argnames = names.get(call["api"])
+            if not argnames:
+                continue
+
+            for argument in call["arguments"]:
+                if argument["name"] in argnames and \
+                   self._check_value(pattern=pattern,
+                                     subject=argument["value"],
+                                     regex=regex):
+                    return argument["value"], offset
+
+        return None
+
     def check_file(self, pattern, regex=False):
         """Checks for a file being opened.
         @param pattern: string or expression to check for.
@@ -557,6 +644,20 @@ class Signature(object):
                 if item["process_name"] != process:
                     continue
 
+            # Look the API up in the calls index, if available.
+            index = getattr(item["calls"], "calls_index", None)
+            if index:
+                if not regex:
+                    if pattern in index.calls:
+                        return pattern
+                    continue
+
+                offsets = dict((api, index.calls[api][0]) for api in index.calls)
+                match = self._first_match(pattern, offsets, regex)
+                if match:
+                    return match[0]
+                continue
+
             # Loop through API calls.
             for call in item["calls"]:
                 # Check if the name matches.
@@ -591,6 +692,42 @@ class Signature(object):
                 if item["process_name"] != process:
                     continue
 
+            # Look the values up in the calls index, if available.
+            index = getattr(item["calls"], "calls_index", None)
+            if index:
+                first = None
+                unindexed = {}
+                for apiname, arguments in index.arguments.iteritems():
+                    if api and apiname != api:
+                        continue
+                    if category and index.categories[apiname] != category:
+                        continue
+
+                    for argname, values in arguments.iteritems():
+                        if name and argname != name:
+                            continue
+
+                        match = self._first_match(pattern, values, regex)
+                        if match and (first is None or match[1] < first[1]):
+                            first = match
+
+                    argnames = [argname for argname in index.long_arguments.get(apiname, ())
+                                if not name or argname == name]
+                    if argnames:
+                        unindexed[apiname] = argnames
+
+                # The long values are only looked for in the calls before
+                # the first indexed match.
+                if unindexed:
+                    match = self._scan_arguments(pattern, item["calls"], unindexed,
+                                                 first[1] if first else None, regex)
+                    if match:
+                        first = match
+
+                if first:
+                    return first[0]
+                continue
+
             # Loop through API calls.
             for call in item["calls"]:
                 # Check if there's an API name filter.
@@ -666,6 +803,21 @@ class Signature(object):
         """
         raise NotImplementedError
 
+    def on_call(self, call, process):
+        """Notify a call to an evented signature.
+        @param call: API call.
+        @param process: process which invoked the call.
+        @return: True if matched, False to stop receiving calls, None to
+                 keep receiving them.
+        """
+        return None
+
+    def on_complete(self):
+        """Notify an evented signature all the calls have been checked.
+        @return: True if matched.
+        """
+        return False
+
 class Report(object):
     """Base abstract class for reporting module."""
     order = 1
@@ -0,0 +1,340 @@
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+"""Binary report format.
+
+The report is made of sections, each one loadable on its own:
+    - header: magic, version, offset of the section table.
+    - sections, one after the other.
+    - section table: for every section its kind, offset, length, number of
+      items and name.
+
+Object sections hold a single pickled value. Array sections hold a list
+split in chunks, every chunk being a length-prefixed pickled list, followed
+by the chunk offsets, the number of chunks and the chunk size. The values
+are plain dicts and lists, so that reading doesn't depend on the classes
+used by the processing modules.
+
+Large lists, such as the calls of every process and the network lists, are
+stored in their own array sections and replaced in their parent section by
+a reference: {"$section": name}.
+"""
+
+import os
+import mmap
+import struct
+import cPickle
+
+from lib.dragon.common.exceptions import CuckooOperationalError
+from lib.dragon.common.objects import Record
+
+MAGIC = "DRBR"
+VERSION = 1
+
+HEADER = struct.Struct("=4sHQ")
+ENTRY = struct.Struct("=BQQIH")
+LENGTH = struct.Struct("=I")
+OFFSET = struct.Struct("=Q")
+TRAILER = struct.Struct("=II")
+
+OBJECT = 0
+ARRAY = 1
+
+CHUNK_SIZE = 256
+REFERENCE = "$section"
+
+def plain(value):
+    """Convert records and tuples to plain dicts and lists.
+    @param value: value.
+    @return: plain value.
+    """
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, dict):
+        return dict((key, plain(item)) for key, item in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    return value
+
+class BinaryReportWriter(object):
+    """Writes a binary report, section by section. The report is written
+    to a temporary file, only moved to its path once complete."""
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        """@param path: report path.
+        @param chunk_size: number of items per array chunk.
+        """
+        self.path = path
+        self.temp_path = path + ".tmp"
+        self.fd = open(self.temp_path, "wb")
+        self.chunk_size = chunk_size
+        self.entries = []
+        self.fd.write(HEADER.pack(MAGIC, VERSION, 0))
+
+    def _dump(self, value):
+        data = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+        self.fd.write(LENGTH.pack(len(data)))
+        self.fd.write(data)
+
+    def add_object(self, name, value):
+        """Write an object section.
+        @param name: section name.
+        @param value: plain value.
+        """
+        offset = self.fd.tell()
+        self._dump(value)
+        self.entries.append((OBJECT, offset, self.fd.tell() - offset, 1, name))
+
+    def add_array(self, name, items):
+        """Write an array section.
+        @param name: section name.
+        @param items: iterable, consumed as the chunks are written.
+        """
+        offset = self.fd.tell()
+        offsets = []
+        count = 0
+        chunk = []
+        for item in items:
+            chunk.append(plain(item))
+            if len(chunk) == self.chunk_size:
+                offsets.append(self.fd.tell() - offset)
+                self._dump(chunk)
+                count += len(chunk)
+                chunk = []
+
+        if chunk:
+            offsets.append(self.fd.tell() - offset)
+            self._dump(chunk)
+            count += len(chunk)
+
+        for chunk_offset in offsets:
+            self.fd.write(OFFSET.pack(chunk_offset))
+        self.fd.write(TRAILER.pack(len(offsets), self.chunk_size))
+        self.entries.append((ARRAY, offset, self.fd.tell() - offset, count, name))
+
+    def write(self, results):
+        """Write the sections of analysis results.
+        @param results: analysis results dict.
+        """
+        for key, value in results.iteritems():
+            if key == "behavior" and isinstance(value, dict):
+                value = dict(value)
+                processes = []
+                for index, process in enumerate(value.get("processes") or []):
+                    process = dict(process)
+                    name = "behavior/processes/%d/calls" % index
+                    self.add_array(name, process["calls"])
+                    process["calls"] = {REFERENCE: name}
+                    processes.append(process)
+                value["processes"] = processes
+            elif key == "network" and isinstance(value, dict):
+                value = dict(value)
+                for network_key, items in value.items():
+                    if isinstance(items, list):
+                        name = "network/%s" % network_key
+                        self.add_array(name, items)
+                        value[network_key] = {REFERENCE: name}
+
+            self.add_object(key, plain(value))
+
+    def close(self):
+        """Write the section table, complete the header and move the report
+        to its path. To be called only once every section was written."""
+        try:
+            table_offset = self.fd.tell()
+            for kind, offset, length, items, name in self.entries:
+                name = name.encode("utf-8")
+                self.fd.write(ENTRY.pack(kind, offset, length, items, len(name)))
+                self.fd.write(name)
+
+            self.fd.seek(0)
+            self.fd.write(HEADER.pack(MAGIC, VERSION, table_offset))
+            self.fd.close()
+        except:
+            self.abort()
+            raise
+        os.rename(self.temp_path, self.path)
+
+    def abort(self):
+        """Drop the report being written, after a failed write."""
+        self.fd.close()
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+
+class Section(object):
+    """Entry of the section table."""
+
+    def __init__(self, name, kind, offset, length, items):
+        self.name = name
+        self.kind = kind
+        self.offset = offset
+        self.length = length
+        self.items = items
+
+class ArraySection(object):
+    """Lazy list over the chunks of an array section."""
+
+    def __init__(self, report, section):
+        """@param report: BinaryReportReader.
+        @param section: Section.
+        """
+        self.report = report
+        self.section = section
+
+        end = section.offset + section.length
+        chunks, self.chunk_size = TRAILER.unpack_from(report.data, end - TRAILER.size)
+        start = end - TRAILER.size - chunks * OFFSET.size
+        self.offsets = struct.unpack_from("=%dQ" % chunks, report.data, start)
+
+    def __len__(self):
+        return self.section.items
+
+    def chunk(self, index):
+        """Load a chunk.
+        @param index: chunk index.
+        @return: list of items.
+        """
+        return self.report.load_at(self.section.offset + self.offsets[index])
+
+    def slice(self, start, count):
+        """Load a range of items, only reading the chunks holding them.
+        @param start: first item.
+        @param count: number of items.
+        @return: list of items.
+        """
+        items = []
+        start = max(start, 0)
+        end = min(start + count, len(self))
+        index = start // self.chunk_size
+        while start < end:
+            chunk = self.chunk(index)
+            position = start - index * self.chunk_size
+            taken = chunk[position:position + end - start]
+            items.extend(taken)
+            start += len(taken)
+            index += 1
+        return items
+
+    def __iter__(self):
+        for index in xrange(len(self.offsets)):
+            for item in self.chunk(index):
+                yield item
+
+class BinaryReportReader(object):
+    """Reads a binary report lazily, through a memory map."""
+
+    def __init__(self, path):
+        """@param path: report path.
+        @raise CuckooOperationalError: if the report is invalid.
+        """
+        self.fd = open(path, "rb")
+        self.sections = {}
+        try:
+            self.data = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError) as e:
+            self.fd.close()
+            raise CuckooOperationalError("Invalid binary report %s: %s" % (path, e))
+
+        try:
+            self._read_table()
+        except (struct.error, CuckooOperationalError) as e:
+            self.close()
+            raise CuckooOperationalError("Invalid binary report %s: %s" % (path, e))
+
+    def _read_table(self):
+        magic, version, offset = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise CuckooOperationalError("bad magic")
+        if version != VERSION:
+            raise CuckooOperationalError("unsupported version %d" % version)
+        if not offset:
+            raise CuckooOperationalError("incomplete report")
+
+        while offset < len(self.data):
+            kind, section_offset, length, items, name_length = ENTRY.unpack_from(self.data, offset)
+            offset += ENTRY.size
+            name = self.data[offset:offset + name_length].decode("utf-8")
+            offset += name_length
+            self.sections[name] = Section(name, kind, section_offset, length, items)
+
+    def close(self):
+        self.data.close()
+        self.fd.close()
+
+    def load_at(self, offset):
+        """Load the pickled value at an offset.
+        @param offset: offset of its length prefix.
+        @return: value.
+        """
+        length, = LENGTH.unpack_from(self.data, offset)
+        start = offset + LENGTH.size
+        return cPickle.loads(self.data[start:start + length])
+
+    def array(self, name):
+        """Get an array section.
+        @param name: section name.
+        @return: ArraySection.
+        @raise KeyError: if there is no such array section.
+        """
+        section = self.sections[name]
+        if section.kind != ARRAY:
+            raise KeyError(name)
+        return ArraySection(self, section)
+
+    def load(self, name, lazy=True):
+        """Load a section.
+        @param name: section name, e.g. "info" or "signatures".
+        @param lazy: keep the referenced array sections lazy, or load them
+                     as lists.
+        @return: section value.
+        @raise KeyError: if there is no such section.
+        """
+        section = self.sections[name]
+        if section.kind == ARRAY:
+            value = ArraySection(self, section)
+        else:
+            value = self._resolve(self.load_at(section.offset))
+
+        if not lazy:
+            value = self._materialize(value)
+        return value
+
+    def _resolve(self, value):
+        if isinstance(value, dict):
+            if len(value) == 1 and REFERENCE in value:
+                return self.array(value[REFERENCE])
+            for key, item in value.iteritems():
+                value[key] = self._resolve(item)
+        elif isinstance(value, list):
+            for index, item in enumerate(value):
+                value[index] = self._resolve(item)
+        return value
+
+    def top_sections(self):
+        """Get the names of the top level sections, the results keys.
+        @return: list of names.
+        """
+        return [name for name, section in self.sections.iteritems()
+                if "/" not in name]
+
+    def load_all(self, lazy=True):
+        """Load the whole results.
+        @param lazy: keep the array sections lazy, or load them as lists.
+        @return: results dict.
+        """
+        results = {}
+        for name in self.top_sections():
+            results[name] = self.load(name, lazy)
+        return results
+
+    def _materialize(self, value):
+        if isinstance(value, ArraySection):
+            return list(value)
+        if isinstance(value, dict):
+            return dict((key, self._materialize(item)) for key, item in value.iteritems())
+        if isinstance(value, list):
+            return [self._materialize(item) for item in value]
+        return value
@@ -0,0 +1,235 @@
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+"""Columnar store of the API calls logged by a process.
+
+The result server writes one store per process next to its netlog raw log,
+so that processing can walk the calls without decoding the netlog again.
+
+Layout (native byte order, the store never leaves the host):
+
+    header:  magic, version, pid, ppid, first seen time
+             module path (length prefixed)
+    blocks:  tag "CALL", calls count, values count, heap size
+             timediff, tid, return value, first value index (uint32 columns)
+             apiindex, status (uint8 columns)
+             value offsets into the heap (uint32 column)
+             heap of the argument values
+    end:     tag "DONE" block, written when the connection is closed
+
+Argument names are not stored, they come from the LOGTBL entry of the
+apiindex. A store without its end block is incomplete and gets ignored.
+"""
+
+import os
+import mmap
+import array
+import struct
+import datetime
+
+from lib.dragon.common.exceptions import CuckooOperationalError
+from lib.dragon.common.netlog import DECODERS
+from lib.dragon.common.utils import get_filename_from_path
+
+MAGIC = "DRCS"
+VERSION = 1
+
+HEADER = struct.Struct("=4sHIIHBBBBBII")
+BLOCK = struct.Struct("=4sIII")
+BLOCK_CALLS = "CALL"
+BLOCK_END = "DONE"
+
+# Calls buffered by the writer before a block is written out.
+BLOCK_SIZE = 4096
+
+def store_path(log_path):
+    """Get the call store path for a netlog raw log.
+    @param log_path: raw log path.
+    @return: call store path.
+    """
+    return os.path.splitext(log_path)[0] + ".calls"
+
+class CallStoreWriter(object):
+    """Appends the calls of a process to its call store."""
+
+    def __init__(self, path, vmtime, pid, ppid, modulepath):
+        """@param path: call store path.
+        @param vmtime: process first seen time.
+        @param pid: process identifier.
+        @param ppid: parent process identifier.
+        @param modulepath: process module path.
+        """
+        self.fd = open(path, "wb")
+        self.fd.write(HEADER.pack(MAGIC, VERSION, pid, ppid,
+                                  vmtime.year, vmtime.month, vmtime.day,
+                                  vmtime.hour, vmtime.minute, vmtime.second,
+                                  vmtime.microsecond, len(modulepath)))
+        self.fd.write(modulepath)
+        self._reset()
+
+    def _reset(self):
+        self.timediffs = array.array("I")
+        self.tids = array.array("I")
+        self.returnvals = array.array("I")
+        self.firstvalues = array.array("I")
+        self.apiindexes = array.array("B")
+        self.statuses = array.array("B")
+        self.offsets = array.array("I", [0])
+        self.heap = []
+        self.heapsize = 0
+
+    def add(self, context, arguments):
+        """Add a call.
+        @param context: netlog call context.
+        @param arguments: list of (argument name, value) tuples.
+        """
+        apiindex, status, returnval, tid, timediff = context
+
+        self.timediffs.append(timediff)
+        self.tids.append(tid)
+        self.returnvals.append(returnval)
+        self.firstvalues.append(len(self.offsets) - 1)
+        self.apiindexes.append(apiindex)
+        self.statuses.append(status)
+
+        for argname, value in arguments:
+            value = str(value)
+            self.heap.append(value)
+            self.heapsize += len(value)
+            self.offsets.append(self.heapsize)
+
+        if len(self.timediffs) >= BLOCK_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Write out the buffered calls as a block."""
+        if not self.timediffs:
+            return
+
+        # The value indexes of the last call end where the offsets end.
+        self.firstvalues.append(len(self.offsets) - 1)
+
+        self.fd.write("".join([BLOCK.pack(BLOCK_CALLS, len(self.timediffs),
+                                          len(self.offsets) - 1, self.heapsize),
+                               self.timediffs.tostring(),
+                               self.tids.tostring(),
+                               self.returnvals.tostring(),
+                               self.firstvalues.tostring(),
+                               self.apiindexes.tostring(),
+                               self.statuses.tostring(),
+                               self.offsets.tostring()] + self.heap))
+        self._reset()
+
+    def close(self):
+        """Write out the remaining calls and mark the store as complete."""
+        self.flush()
+        self.fd.write(BLOCK.pack(BLOCK_END, 0, 0, 0))
+        self.fd.close()
+
+class CallStoreReader(object):
+    """Memory maps a call store and replays it as a NetlogParser would."""
+
+    def __init__(self, path, handler):
+        """@param path: call store path.
+        @param handler: object receiving log_process() and log_call().
+        @raise CuckooOperationalError: if the store is invalid or incomplete.
+        """
+        self.handler = handler
+
+        try:
+            with open(path, "rb") as fd:
+                self.map = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError) as e:
+            raise CuckooOperationalError("Unable to map call store {0}: {1}".format(path, e))
+
+        try:
+            self._read_header()
+            self.blocks = self._read_blocks()
+        except CuckooOperationalError as e:
+            self.close()
+            raise CuckooOperationalError("Invalid call store {0}: {1}".format(path, e))
+
+        self.reset()
+
+    def _read_header(self):
+        if len(self.map) < HEADER.size:
+            raise CuckooOperationalError("truncated header")
+
+        header = HEADER.unpack_from(self.map)
+        magic, version, self.pid, self.ppid = header[:4]
+        if magic != MAGIC or version != VERSION:
+            raise CuckooOperationalError("unsupported format")
+
+        self.vmtime = datetime.datetime(*header[4:11])
+        self.data = HEADER.size + header[11]
+        self.modulepath = self.map[HEADER.size:self.data]
+
+    def _read_blocks(self):
+        """Index the blocks.
+        @return: list of (offset, calls, values, heap size) tuples.
+        """
+        blocks = []
+        offset = self.data
+
+        while offset + BLOCK.size <= len(self.map):
+            tag, calls, values, heapsize = BLOCK.unpack_from(self.map, offset)
+            if tag == BLOCK_END:
+                return blocks
+            if tag != BLOCK_CALLS:
+                raise CuckooOperationalError("corrupted block at {0}".format(offset))
+
+            blocks.append((offset + BLOCK.size, calls, values, heapsize))
+            offset += BLOCK.size + calls * 18 + 4 + (values + 1) * 4 + heapsize
+
+        raise CuckooOperationalError("incomplete")
+
+    def reset(self):
+        """Rewind to the process message."""
+        self.calls = None
+
+    def close(self):
+        self.map.close()
+
+    def iter_calls(self):
+        """Iterate the calls.
+        @return: iterator of (context, values) tuples.
+        """
+        for offset, calls, values, heapsize in self.blocks:
+            column = struct.Struct("=%dI" % calls)
+            timediffs = column.unpack_from(self.map, offset)
+            tids = column.unpack_from(self.map, offset + calls * 4)
+            returnvals = column.unpack_from(self.map, offset + calls * 8)
+            offset += calls * 12
+            firstvalues = struct.unpack_from("=%dI" % (calls + 1), self.map, offset)
+            offset += (calls + 1) * 4
+            apiindexes = struct.unpack_from("=%dB" % calls, self.map, offset)
+            statuses = struct.unpack_from("=%dB" % calls, self.map, offset + calls)
+            offset += calls * 2
+            offsets = struct.unpack_from("=%dI" % (values + 1), self.map, offset)
+            heap = offset + (values + 1) * 4
+
+            for i in xrange(calls):
+                context = (apiindexes[i], statuses[i], returnvals[i], tids[i], timediffs[i])
+                yield context, [self.map[heap + offsets[j]:heap + offsets[j + 1]]
+                                for j in xrange(firstvalues[i], firstvalues[i + 1])]
+
+    def read_next_message(self):
+        """Replay the next message to the handler.
+        @raise EOFError: when all the calls have been replayed.
+        """
+        if self.calls is None:
+            self.calls = self.iter_calls()
+            self.handler.log_process((0, 0, 0, 0, 0), self.vmtime, self.pid, self.ppid,
+                                     self.modulepath, get_filename_from_path(self.modulepath))
+            return True
+
+        try:
+            context, values = self.calls.next()
+        except StopIteration:
+            raise EOFError()
+
+        decoder = DECODERS[context[0]]
+        self.handler.log_call(context, decoder.apiname, decoder.modulename,
+                              zip(decoder.argnames, values))
+        return True
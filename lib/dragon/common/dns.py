@@ -2,9 +2,13 @@
 # This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
 # See the file 'docs/LICENSE' for copying permission.
 
+import time
+import random
 import select
 import socket
+import struct
 import threading
+from multiprocessing.pool import ThreadPool
 
 try:
     import pycares
@@ -125,3 +129,282 @@ def resolve(name):
 
 # another alias
 resolve_best = resolve
+
+
+# batched resolution with a shared cache
+DNS_CONCURRENCY = 16
+DNS_CACHE_TTL = 300
+DNS_CACHE_SIZE = 10000
+
+DNS_HEADER = struct.Struct(">HHHHHH")
+DNS_QUESTION = struct.Struct(">HH")
+DNS_ANSWER = struct.Struct(">HHIH")
+DNS_TYPE_A = 1
+DNS_CLASS_IN = 1
+DNS_FLAG_RD = 0x0100
+DNS_RCODE_NXDOMAIN = 3
+DNS_MAX_LABEL = 63
+DNS_MAX_NAME = 255
+
+def encode_name(name):
+    """Encode a domain name in the DNS wire format.
+    @param name: domain name.
+    @return: encoded name.
+    @raise ValueError: if the name isn't a valid domain name.
+    """
+    if isinstance(name, unicode):
+        name = name.encode("idna")
+
+    labels = name.strip(".").split(".")
+    encoded = ""
+    for label in labels:
+        if not label or len(label) > DNS_MAX_LABEL:
+            raise ValueError("Invalid label length in %r" % name)
+        encoded += chr(len(label)) + label
+    encoded += "\0"
+
+    if len(encoded) > DNS_MAX_NAME:
+        raise ValueError("Name too long: %r" % name)
+    return encoded
+
+def build_query(query_id, name):
+    """Build a DNS query for the A records of a name.
+    @param query_id: query ID.
+    @param name: domain name.
+    @return: query packet.
+    @raise ValueError: if the name isn't a valid domain name.
+    """
+    return DNS_HEADER.pack(query_id, DNS_FLAG_RD, 1, 0, 0, 0) + \
+           encode_name(name) + DNS_QUESTION.pack(DNS_TYPE_A, DNS_CLASS_IN)
+
+def _skip_name(data, offset):
+    # Names end with an empty label or a compression pointer.
+    while True:
+        length = ord(data[offset])
+        if length >= 0xc0:
+            return offset + 2
+        offset += length + 1
+        if not length:
+            return offset
+
+def parse_response(data):
+    """Parse the first A record of a DNS response.
+    @param data: response packet.
+    @return: tuple of query ID, encoded name of the first question, IP
+             address or "" and TTL, None if the response tells nothing
+             about the name.
+    @raise ValueError: if the packet is malformed.
+    """
+    try:
+        query_id, flags, questions, answers, _, _ = DNS_HEADER.unpack_from(data)
+        offset = DNS_HEADER.size
+        question = None
+        for i in xrange(questions):
+            end = _skip_name(data, offset)
+            if question is None:
+                question = data[offset:end]
+            offset = end + DNS_QUESTION.size
+
+        for i in xrange(answers):
+            offset = _skip_name(data, offset)
+            rtype, rclass, ttl, length = DNS_ANSWER.unpack_from(data, offset)
+            offset += DNS_ANSWER.size
+            if rtype == DNS_TYPE_A and rclass == DNS_CLASS_IN and length == 4:
+                return query_id, question, socket.inet_ntoa(data[offset:offset + 4]), ttl
+            offset += length
+    except (struct.error, IndexError) as e:
+        raise ValueError("Malformed DNS response: %s" % e)
+
+    if flags & 0xf == DNS_RCODE_NXDOMAIN or answers:
+        return query_id, question, "", None
+    return query_id, question, None, None
+
+class Resolver(object):
+    """Resolves batches of names concurrently, caching the results.
+
+    Names are sent to a DNS server from a single socket, or looked up with
+    resolve() on a pool of threads when no server is given. In both cases
+    the number of lookups in flight is limited, across all the threads
+    sharing the resolver.
+    """
+
+    def __init__(self, server=None, port=53, timeout=DNS_TIMEOUT,
+                 concurrency=DNS_CONCURRENCY, ttl=DNS_CACHE_TTL,
+                 cache_size=DNS_CACHE_SIZE):
+        """@param server: DNS server address, None for the system resolver.
+        @param port: DNS server port.
+        @param timeout: lookup timeout in seconds.
+        @param concurrency: maximum number of lookups in flight.
+        @param ttl: cache time to live in seconds, the maximum one when the
+                    server gives the TTL of its records.
+        @param cache_size: maximum number of cached names.
+        """
+        self.server = server
+        self.port = port
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.slots = threading.BoundedSemaphore(concurrency)
+        # Name to (IP address, expiration time).
+        self.cache = {}
+        self.cache_lock = threading.Lock()
+
+    def _cached(self, name, now):
+        entry = self.cache.get(name)
+        if entry and entry[1] > now:
+            return entry[0]
+        return None
+
+    def _store(self, name, ip, ttl, now):
+        if len(self.cache) >= self.cache_size:
+            for key, entry in self.cache.items():
+                if entry[1] <= now:
+                    del self.cache[key]
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+        if ttl is None or ttl > self.ttl:
+            ttl = self.ttl
+        self.cache[name] = (ip, now + ttl)
+
+    def resolve(self, name):
+        """Resolve a name.
+        @param name: domain name.
+        @return: IP address, "" if unknown, DNS_TIMEOUT_VALUE on timeout.
+        """
+        return self.resolve_many([name])[name]
+
+    def resolve_many(self, names):
+        """Resolve names concurrently.
+        @param names: domain names.
+        @return: dict of name to IP address, "" if unknown,
+                 DNS_TIMEOUT_VALUE on timeout.
+        """
+        results = {}
+        missing = []
+        now = time.time()
+        with self.cache_lock:
+            for name in names:
+                if name in results:
+                    continue
+                ip = self._cached(name, now)
+                if ip is None:
+                    results[name] = None
+                    missing.append(name)
+                else:
+                    results[name] = ip
+
+        if not missing:
+            return results
+
+        if self.server:
+            resolved = self._query_server(missing)
+        else:
+            resolved = self._query_system(missing)
+
+        now = time.time()
+        with self.cache_lock:
+            for name, (ip, ttl) in resolved.iteritems():
+                # A timeout isn't an answer.
+                if ip is not None:
+                    self._store(name, ip, ttl, now)
+                    results[name] = ip
+                else:
+                    results[name] = DNS_TIMEOUT_VALUE
+
+        return results
+
+    def _lookup(self, name):
+        with self.slots:
+            ip = resolve(name)
+        # With the default timeout value, timeouts can't be told apart from
+        # unknown names and are cached as well.
+        if ip == DNS_TIMEOUT_VALUE and DNS_TIMEOUT_VALUE != "":
+            return name, (None, None)
+        return name, (ip, None)
+
+    def _query_system(self, names):
+        pool = ThreadPool(min(len(names), self.concurrency))
+        try:
+            return dict(pool.map(self._lookup, names))
+        finally:
+            pool.close()
+            pool.join()
+
+    def _query_server(self, names):
+        # Every lookup holds a slot until answered or timed out. Slots are
+        # only waited for with no query of this batch in flight, so that
+        # batches sharing the resolver can't hold each other.
+        resolved = {}
+        pending = list(reversed(names))
+        inflight = {}
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            while pending or inflight:
+                while pending and self.slots.acquire(not inflight):
+                    name = pending.pop()
+                    query_id = random.randint(0, 0xffff)
+                    while query_id in inflight:
+                        query_id = random.randint(0, 0xffff)
+                    # Invalid names are left unresolved.
+                    try:
+                        query = build_query(query_id, name)
+                        sock.sendto(query, (self.server, self.port))
+                    except (socket.error, ValueError):
+                        self.slots.release()
+                        resolved[name] = ("", None)
+                        continue
+                    question = query[DNS_HEADER.size:-DNS_QUESTION.size].lower()
+                    inflight[query_id] = (name, time.time() + self.timeout, question)
+
+                if not inflight:
+                    continue
+
+                wait = min(entry[1] for entry in inflight.itervalues()) - time.time()
+                readable, _, _ = select.select([sock], [], [], max(wait, 0))
+                if readable:
+                    try:
+                        data, address = sock.recvfrom(4096)
+                        answer = parse_response(data)
+                    except (socket.error, ValueError):
+                        answer = None
+                    # Answers to another question, spoofed or late ones
+                    # whose ID got reused, are ignored.
+                    if answer and answer[0] in inflight and \
+                       (answer[1] or "").lower() == inflight[answer[0]][2]:
+                        query_id, question, ip, ttl = answer
+                        name = inflight.pop(query_id)[0]
+                        self.slots.release()
+                        resolved[name] = ("" if ip is None else ip, ttl)
+
+                now = time.time()
+                for query_id, (name, deadline, question) in inflight.items():
+                    if deadline <= now:
+                        del inflight[query_id]
+                        self.slots.release()
+                        resolved[name] = (None, None)
+        finally:
+            for query_id in inflight:
+                self.slots.release()
+            sock.close()
+
+        return resolved
+
+# resolver shared by the analyses, see get_resolver()
+_resolver = None
+_resolver_lock = threading.Lock()
+
+def get_resolver(server=None, port=53, concurrency=DNS_CONCURRENCY, ttl=DNS_CACHE_TTL):
+    """Get the shared resolver, created with the given options on first use.
+    @param server: DNS server address, None for the system resolver.
+    @param port: DNS server port.
+    @param concurrency: maximum number of lookups in flight.
+    @param ttl: cache time to live in seconds.
+    @return: Resolver.
+    """
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            _resolver = Resolver(server=server, port=port, timeout=DNS_TIMEOUT,
+                                 concurrency=concurrency, ttl=ttl)
+        return _resolver
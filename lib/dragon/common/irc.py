@@ -5,82 +5,121 @@
 
 """IRC Protocol"""
 
-import cStringIO
 import re
-import logging
 
 from lib.dragon.common.utils import convert_to_printable
 
+# client commands
+CLIENT_COMMANDS = frozenset(( 'PASS','JOIN','USER','OPER','MODE','SERVICE','QUIT','SQUIT',
+    'PART','TOPIC','NAMES','LIST','INVITE',
+    'KICK','PRIVMSG','NOTICE','MOTD','LUSERS','VERSION','STATS','LINKS','TIME','CONNECT',
+    'TRACE','ADMIN','INFO','SERVLIST',
+    'SQUERY','WHO','WHOIS','WHOWAS','KILL','PING','PONG','ERROR','AWAY','REHASH','DIE','RESTART',
+    'SUMMON','USERS','WALLOPS',
+    'USERHOST','NICK','ISON'
+))
+
+# Server messages: prefix - command - params
+SERVER_MESSAGE = re.compile(r"^(:[\w+.{}!@|()]+\x20)([a-zA-Z]+|[0-9]{3})(\x20.+)")
+# Client messages: command - params
+CLIENT_MESSAGE = re.compile(r"^([a-zA-Z]+)\x20(.+)")
+
+# Longer lines aren't IRC, the protocol limits them to 512 bytes.
+MAX_LINE_SIZE = 8192
+
+class IRCParser(object):
+    """Incremental parser of the IRC messages sent by one side of a TCP
+    stream. Data is fed as it comes, lines split across segments are
+    buffered until complete."""
+
+    def __init__(self, server=False, filters=()):
+        """@param server: parse the messages of the server, instead of the
+                          client ones.
+        @param filters: commands left out.
+        """
+        self.server = server
+        self.filters = frozenset(filters)
+        self.messages = []
+        self._buffer = []
+        self._size = 0
+        # Within a line too long to be IRC.
+        self._skipping = False
+
+    def feed(self, data):
+        """Parse the complete lines of some more data.
+        @param data: stream data.
+        """
+        lines = data.split("\n")
+        if len(lines) == 1:
+            self._bufferize(data)
+            return
+
+        self._bufferize(lines[0])
+        if not self._skipping:
+            self._parse_line("".join(self._buffer))
+        self._buffer = []
+        self._size = 0
+        self._skipping = False
+
+        for line in lines[1:-1]:
+            self._parse_line(line)
+        self._bufferize(lines[-1])
+
+    def close(self):
+        """Parse the last line, not terminated.
+        @return: list of messages.
+        """
+        if self._buffer and not self._skipping:
+            self._parse_line("".join(self._buffer))
+        self._buffer = []
+        self._size = 0
+        return self.messages
+
+    def _bufferize(self, data):
+        if self._skipping or not data:
+            return
+        self._size += len(data)
+        if self._size > MAX_LINE_SIZE:
+            self._buffer = []
+            self._skipping = True
+        else:
+            self._buffer.append(data)
+
+    def _parse_line(self, line):
+        if len(line) > MAX_LINE_SIZE:
+            return
+
+        if self.server:
+            match = SERVER_MESSAGE.match(line)
+            if match and match.group(2) not in self.filters:
+                self.messages.append({"prefix" : convert_to_printable(match.group(1).strip()),
+                                      "command" : convert_to_printable(match.group(2)),
+                                      "params" : convert_to_printable(match.group(3).strip()),
+                                      "type" : "server"})
+        else:
+            match = CLIENT_MESSAGE.match(line)
+            if match and match.group(1) in CLIENT_COMMANDS and match.group(1) not in self.filters:
+                params = match.group(2).strip()
+                if params:
+                    self.messages.append({"command" : convert_to_printable(match.group(1)),
+                                          "params" : convert_to_printable(params),
+                                          "type" : "client"})
+
 class ircMessage(object):
     """IRC Protocol Request."""
 
-    # client commands
-    __methods_client = dict.fromkeys(( 'PASS','JOIN','USER','OPER','MODE','SERVICE','QUIT','SQUIT',
-        'PART','TOPIC','NAMES','LIST','INVITE',
-        'KICK','PRIVMSG','NOTICE','MOTD','LUSERS','VERSION','STATS','LINKS','TIME','CONNECT',
-        'TRACE','ADMIN','INFO','SERVLIST',
-        'SQUERY','WHO','WHOIS','WHOWAS','KILL','PING','PONG','ERROR','AWAY','REHASH','DIE','RESTART',
-        'SUMMON','USERS','WALLOPS',
-        'USERHOST','NICK','ISON'
-    ))
-   
-    def __init__(self):
-        self._messages = []
-        # Server commandis : prefix - command - params 
-        self._sc = {}
-        # Client commands : command - params 
-        self._cc = {}
-        log = logging.getLogger("Processing.Pcap.irc.protocol")
-
-    def _unpack(self, buf):
-        """ 
-        Extract into a list irc messages of a tcp streams
-        @buf: tcp stream data
-        """
-        try:
-            f = cStringIO.StringIO(buf)
-            lines = f.readlines()
-        except Exception, why:
-            log.error("Failed reading tcp stream buffer")
-            return False
-
-        for element in lines:
-            if re.match('^:',element) != None:
-                command = '([a-zA-Z]+|[0-9]{3})'
-                params = '(\x20.+)'
-                irc_server_msg = re.findall('(^:[\w+.{}!@|()]+\x20)'+command+params,element)
-                if irc_server_msg:
-                    self._sc['prefix'] = convert_to_printable(irc_server_msg[0][0].strip())
-                    self._sc['command'] = convert_to_printable(irc_server_msg[0][1].strip())
-                    self._sc['params'] = convert_to_printable(irc_server_msg[0][2].strip())
-                    self._sc['type'] = 'server'
-                self._messages.append(dict(self._sc))
-            else:
-                irc_client_msg = re.findall('([a-zA-Z]+\x20)(.+[\x0a\0x0d])',element)
-                if irc_client_msg and irc_client_msg[0][0].strip() in self.__methods_client:
-                    self._cc['command'] = convert_to_printable(irc_client_msg[0][0].strip())
-                    self._cc['params'] = convert_to_printable(irc_client_msg[0][1].strip())
-                    self._cc['type'] = 'client'
-                self._messages.append(dict(self._cc))
-    
+    def _parse(self, buf, server, filters=()):
+        parser = IRCParser(server, filters)
+        parser.feed(buf)
+        return parser.close()
+
     def getClientMessages(self,buf):
         """
         Get irc client commands of tcp streams
         @buf: list of messages
         @return: dictionary of the client messages
         """
-
-        try:
-            self._unpack(buf)
-        except Exception:
-            return None
-
-        entry_cc = []
-        for msg in self._messages:
-            if msg['type'] == 'client':
-                entry_cc.append(msg)     
-
-        return entry_cc
+        return self._parse(buf, False)
 
     def getClientMessagesFilter(self,buf,filters):
         """
@@ -88,18 +127,7 @@ class ircMessage(object):
         @buf: list of messages
         @return: dictionary of the client messages filtered
         """
-        try:
-            self._unpack(buf)
-        except Exception:
-            return None
-
-        entry_cc = []
-
-        for msg in self._messages:
-            if msg['type'] == 'client' and msg['command'] not in filters:
-                entry_cc.append(msg)
-
-        return entry_cc
+        return self._parse(buf, False, filters)
 
     def getServerMessages(self,buf):
         """
@@ -107,19 +135,7 @@ class ircMessage(object):
         @buf: list of messages
         @return: dictionary of server messages
         """
-
-        try:
-            self._unpack(buf)
-        except Exception:
-            return None
-
-        entry_sc = []
-
-        for msg in self._messages:
-            if msg['type'] == 'server':
-                entry_sc.append(msg)
-
-        return entry_sc
+        return self._parse(buf, True)
 
     def getServerMessagesFilter(self,buf,filters):
         """
@@ -127,17 +143,7 @@ class ircMessage(object):
         @buf: list of messages
         @return: dictionary of server messages filtered
         """
-        try:
-            self._unpack(buf)
-        except Exception:
-            return None
-
-        entry_sc = []
-        for msg in self._messages:
-            if msg['type'] == 'server' and msg['command'] not in filters:
-                entry_sc.append(msg)
-        
-        return entry_sc
+        return self._parse(buf, True, filters)
 
     def isthereIRC(self,buf):
         """
@@ -145,12 +151,4 @@ class ircMessage(object):
         @buf: stream data
         @return: boolean result
         """
-
-        try:
-            self._unpack(buf)
-            if self._messages:
-                return True
-            else:
-                return False
-        except Exception:
-            return False
+        return bool(self.getClientMessages(buf) or self.getServerMessages(buf))
@@ -0,0 +1,122 @@
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import json
+
+from lib.dragon.common.objects import json_default
+
+# Output buffered before being written to the file.
+BUFFER_SIZE = 64 * 1024
+
+class JsonWriter(object):
+    """Writes a JSON document incrementally.
+
+    Dicts and lists are walked, so that lazy lists such as the process calls
+    are consumed while being written instead of being encoded at once. The
+    other values are encoded by the json module.
+    """
+
+    def __init__(self, fd, indent=None):
+        """@param fd: file object to write to.
+        @param indent: indentation level, None for the compact output.
+        """
+        self.fd = fd
+        self.indent = indent
+        self._buffer = []
+        self._size = 0
+        # Bytes written before the buffered output.
+        self._flushed = 0
+        # Top level key to (offset, length) of its value in the document.
+        self.sections = {}
+
+        if indent is None:
+            self.separators = (",", ":")
+        else:
+            self.separators = (",", ": ")
+
+    def write(self, obj):
+        """Write a JSON document.
+        @param obj: document.
+        """
+        self._write_value(obj, 0)
+        self.flush()
+
+    def flush(self):
+        """Write the buffered output to the file."""
+        self.fd.write("".join(self._buffer))
+        self._flushed += self._size
+        self._buffer = []
+        self._size = 0
+
+    def tell(self):
+        """Get the current offset in the document.
+        @return: offset in bytes.
+        """
+        return self._flushed + self._size
+
+    def _emit(self, data):
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= BUFFER_SIZE:
+            self.flush()
+
+    def _newline(self, level):
+        if self.indent is None:
+            return ""
+        return "\n" + " " * (self.indent * level)
+
+    def _encode(self, value, level):
+        data = json.dumps(value, indent=self.indent, separators=self.separators,
+                          default=json_default)
+        if self.indent is not None and level:
+            data = data.replace("\n", self._newline(level))
+        return data
+
+    def _write_value(self, value, level):
+        if isinstance(value, dict):
+            self._write_dict(value, level)
+        elif isinstance(value, (list, tuple)):
+            self._write_list(value, level)
+        else:
+            self._emit(self._encode(value, level))
+
+    def _write_dict(self, value, level):
+        if not value:
+            self._emit("{}")
+            return
+
+        first = True
+        for key, item in value.iteritems():
+            if first:
+                self._emit("{")
+                first = False
+            else:
+                self._emit(self.separators[0])
+            # Like the json module, non string keys are converted.
+            if not isinstance(key, basestring):
+                key = json.dumps(key)
+            self._emit(self._newline(level + 1))
+            self._emit(json.dumps(key) + self.separators[1])
+            offset = self.tell()
+            self._write_value(item, level + 1)
+            if not level:
+                self.sections[key] = (offset, self.tell() - offset)
+        self._emit(self._newline(level) + "}")
+
+    def _write_list(self, value, level):
+        first = True
+        # Lists are iterated, lazy lists don't know their length beforehand.
+        for item in value:
+            if first:
+                self._emit("[")
+                first = False
+            else:
+                self._emit(self.separators[0])
+            self._emit(self._newline(level + 1))
+            self._write_value(item, level + 1)
+
+        if first:
+            self._emit("[]")
+        else:
+            self._emit(self._newline(level) + "]")
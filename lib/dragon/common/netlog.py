@@ -7,6 +7,7 @@ import struct
 import datetime
 import string
 
+from lib.dragon.common.exceptions import CuckooResultError
 from lib.dragon.common.logtbl import table as LOGTBL
 from lib.dragon.common.utils import get_filename_from_path, time_from_cuckoomon
 
@@ -20,6 +21,14 @@ REG_DWORD_LITTLE_ENDIAN = 4
 REG_DWORD               = 4
 REG_DWORD_BIG_ENDIAN    = 5
 
+# Message header: apiindex, status, returnval, tid, timediff.
+HEADER = struct.Struct("=BBIII")
+UINT32 = struct.Struct("=I")
+# Process message: FILETIME low and high parts, pid, ppid.
+PROCESS = struct.Struct("=IIII")
+# Length and original length of strings and buffers.
+LENGTHS = struct.Struct("=II")
+
 # should probably prettify this
 def expand_format(fs):
     out = ''
@@ -34,45 +43,142 @@ def expand_format(fs):
         i += 1
     return out
 
+# Argument kinds, by format specifier.
+ARG_INT = 0
+ARG_PTR = 1
+ARG_STRING = 2
+ARG_BUFFER = 3
+ARG_REGISTRY = 4
+ARG_ARGV = 5
+
+ARG_KINDS = {
+    's': ARG_STRING,
+    'S': ARG_STRING,
+    'u': ARG_STRING,
+    'U': ARG_STRING,
+    'o': ARG_STRING,
+    'O': ARG_STRING,
+    'b': ARG_BUFFER,
+    'B': ARG_BUFFER,
+    'i': ARG_INT,
+    'l': ARG_INT,
+    'L': ARG_INT,
+    'p': ARG_PTR,
+    'P': ARG_PTR,
+    'a': ARG_ARGV,
+    'A': ARG_ARGV,
+    'r': ARG_REGISTRY,
+    'R': ARG_REGISTRY,
+}
+
+# How many 32bit words of each argument kind are fixed width.
+ARG_WORDS = {
+    ARG_INT: 1,
+    ARG_PTR: 1,
+    ARG_STRING: 2,
+    ARG_BUFFER: 2,
+    ARG_REGISTRY: 1,
+    ARG_ARGV: 1,
+}
+
+class ApiDecoder(object):
+    """Precompiled decoder for the arguments of a LOGTBL entry.
+
+    Arguments are split in runs made of fixed width fields optionally
+    terminated by a variable length one. Each run is read with a single
+    precomputed struct which also covers the length (or type, or count)
+    words of its variable length field, followed by at most one read for
+    the variable part.
+    """
+
+    def __init__(self, apiname, modulename, parseinfo):
+        """@param apiname: API name.
+        @param modulename: module name.
+        @param parseinfo: format string followed by the argument names.
+        @raise CuckooResultError: if the argument names don't match the
+                                  format string.
+        """
+        self.apiname = apiname
+        self.modulename = modulename
+        self.argnames = []
+        self.runs = []
+
+        formats = expand_format(parseinfo[0])
+        if len(formats) != len(parseinfo) - 1:
+            raise CuckooResultError("Format string of apitype {0} describes {1} arguments, "
+                                    "{2} argument names given".format(apiname, len(formats),
+                                                                      len(parseinfo) - 1))
+
+        fields = []
+        for fs, argname in zip(formats, parseinfo[1:]):
+            kind = ARG_KINDS.get(fs, None)
+            if kind is None:
+                log.warning("No handler for format specifier {0} on apitype {1}".format(fs, apiname))
+                continue
+
+            self.argnames.append(argname)
+            fields.append((argname, kind))
+            if kind not in (ARG_INT, ARG_PTR):
+                self._add_run(fields)
+                fields = []
+
+        if fields:
+            self._add_run(fields)
+
+    def _add_run(self, fields):
+        words = sum(ARG_WORDS[kind] for argname, kind in fields)
+        self.runs.append((struct.Struct("=%dI" % words), fields))
+
+    def decode(self, parser):
+        """Decode the arguments of a call.
+        @param parser: NetlogParser reading the call.
+        @return: list of (argument name, value) tuples.
+        """
+        arguments = []
+        read_struct = parser.handler.read_struct
+
+        for st, fields in self.runs:
+            words = read_struct(st)
+            i = 0
+            for argname, kind in fields:
+                if kind == ARG_INT:
+                    value = words[i]
+                    i += 1
+                elif kind == ARG_PTR:
+                    value = "0x%08x" % words[i]
+                    i += 1
+                elif kind == ARG_STRING:
+                    value = parser.read_data(words[i], words[i + 1], "... (truncated)")
+                    i += 2
+                elif kind == ARG_BUFFER:
+                    value = parser.read_data(words[i], words[i + 1], " ... (truncated)")
+                    i += 2
+                elif kind == ARG_REGISTRY:
+                    value = parser.read_registry_value(words[i])
+                    i += 1
+                else:
+                    value = [parser.read_string() for x in xrange(words[i])]
+                    i += 1
+
+                arguments.append((argname, value))
+
+        return arguments
+
 class NetlogParser(object):
     def __init__(self, handler):
         self.handler = handler
 
-        self.formatmap = {
-            's': self.read_string,
-            'S': self.read_string,
-            'u': self.read_string,
-            'U': self.read_string,
-            'b': self.read_buffer,
-            'B': self.read_buffer,
-            'i': self.read_int32,
-            'l': self.read_int32,
-            'L': self.read_int32,
-            'p': self.read_ptr,
-            'P': self.read_ptr,
-            'o': self.read_string,
-            'O': self.read_string,
-            'a': self.read_argv,
-            'A': self.read_argv,
-            'r': self.read_registry,
-            'R': self.read_registry,
-        }
-
     def read_next_message(self):
-        apiindex, status = struct.unpack('BB', self.handler.read(2))
-        returnval, tid, timediff = struct.unpack('III', self.handler.read(12))
-        context = (apiindex, status, returnval, tid, timediff)
+        context = self.handler.read_struct(HEADER)
+        apiindex = context[0]
 
         if apiindex == 0:
             # new process message
-            timelow = self.read_int32()
-            timehigh = self.read_int32()
+            timelow, timehigh, pid, ppid = self.handler.read_struct(PROCESS)
             # FILETIME is 100-nanoseconds from 1601 :/
             vmtimeunix = (timelow + (timehigh << 32)) / 10000000.0 - 11644473600
             vmtime = datetime.datetime.fromtimestamp(vmtimeunix)
 
-            pid = self.read_int32()
-            ppid = self.read_int32()
             modulepath = self.read_string()
             procname = get_filename_from_path(modulepath)
             self.handler.log_process(context, vmtime, pid, ppid, modulepath, procname)
@@ -84,50 +190,45 @@ class NetlogParser(object):
 
         else:
             # actual API call
-            apiname, modulename, parseinfo = LOGTBL[apiindex]
-            formatspecifiers, argnames = expand_format(parseinfo[0]), parseinfo[1:]
-            arguments = []
-            for pos in range(len(formatspecifiers)):
-                fs = formatspecifiers[pos]
-                argname = argnames[pos]
-                fn = self.formatmap.get(fs, None)
-                if fn:
-                    r = fn()
-                    arguments.append((argname, r))
-                else:
-                    log.warning('No handler for format specifier {0} on apitype {1}'.format(fs,apiname))
-
-            self.handler.log_call(context, apiname, modulename, arguments)
+            decoder = DECODERS[apiindex]
+            arguments = decoder.decode(self)
+            self.handler.log_call(context, decoder.apiname, decoder.modulename, arguments)
 
         return True
 
     def read_int32(self):
         """Reads a 32bit integer from the socket."""
-        return struct.unpack('I', self.handler.read(4))[0]
+        return self.handler.read_struct(UINT32)[0]
 
     def read_ptr(self):
         """Read a pointer from the socket."""
         value = self.read_int32()
         return '0x%08x' % value
 
+    def read_data(self, length, maxlength, suffix):
+        """Reads the data part of a string or buffer from the socket."""
+        data = self.handler.read(length)
+        if maxlength > length: data += suffix
+        return data
+
     def read_string(self):
         """Reads an utf8 string from the socket."""
-        length, maxlength = struct.unpack('II', self.handler.read(8))
-        s = self.handler.read(length)
-        if maxlength > length: s += '... (truncated)'
-        return s
+        length, maxlength = self.handler.read_struct(LENGTHS)
+        return self.read_data(length, maxlength, '... (truncated)')
 
     def read_buffer(self):
         """Reads a memory socket from the socket."""
-        length, maxlength = struct.unpack('II', self.handler.read(8))
+        length, maxlength = self.handler.read_struct(LENGTHS)
         # only return the maxlength, as we don't log the actual buffer right now
-        buf = self.handler.read(length)
-        if maxlength > length: buf += ' ... (truncated)'
-        return buf
+        return self.read_data(length, maxlength, ' ... (truncated)')
 
     def read_registry(self):
         """Read logged registry data from the socket."""
-        typ = struct.unpack('I', self.handler.read(4))[0]
+        typ = self.handler.read_struct(UINT32)[0]
+        return self.read_registry_value(typ)
+
+    def read_registry_value(self, typ):
+        """Read logged registry data of a given type from the socket."""
         # do something depending on type
         if typ == REG_DWORD_BIG_ENDIAN or typ == REG_DWORD_LITTLE_ENDIAN:
             value = self.read_int32()
@@ -139,7 +240,7 @@ class NetlogParser(object):
 
     def read_list(self, fn):
         """Reads a list of _fn_ from the socket."""
-        count = struct.unpack('I', self.handler.read(4))[0]
+        count = self.handler.read_struct(UINT32)[0]
         ret = []
         for x in xrange(count):
             item = fn()
@@ -147,4 +248,7 @@ class NetlogParser(object):
         return ret
 
     def read_argv(self):
-        return self.read_list(self.read_string)
\ No newline at end of file
+        return self.read_list(self.read_string)
+
+# Decoders for every API, indexed by apiindex.
+DECODERS = [ApiDecoder(*entry) for entry in LOGTBL]
@@ -42,6 +42,183 @@ class Dictionary(dict):
     __setattr__ = dict.__setitem__
     __delattr__ = dict.__delitem__
 
+class UniqueList(list):
+    """List of unique items, with constant time membership tests.
+
+    Items have to be added through add() to be kept unique.
+    """
+
+    def __init__(self, items=()):
+        list.__init__(self)
+        self.items = set()
+        for item in items:
+            self.add(item)
+
+    def add(self, item):
+        """Append an item, unless already present.
+        @param item: hashable item.
+        """
+        if item not in self.items:
+            self.items.add(item)
+            self.append(item)
+
+    def __contains__(self, item):
+        return item in self.items
+
+class StringTable(dict):
+    """Interns strings, so that equal strings share a single object."""
+
+    def intern(self, string):
+        """Get the shared copy of a string.
+        @param string: string.
+        @return: equal string held by the table.
+        """
+        return self.setdefault(string, string)
+
+class Record(object):
+    """Read-mostly dict lookalike storing a fixed set of keys in slots.
+
+    Subclasses define __slots__ and the matching mapping keys in _keys.
+    """
+    __slots__ = ()
+    _keys = ()
+    _attrs = {}
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, self._attrs[key])
+        except (KeyError, AttributeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self._attrs:
+            raise KeyError(key)
+        setattr(self, self._attrs[key], value)
+
+    def __contains__(self, key):
+        return key in self._attrs
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return self._keys == other._keys and self.values() == other.values()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def __getstate__(self):
+        return self.values()
+
+    def __setstate__(self, state):
+        for attr, value in zip(self.__slots__, state):
+            setattr(self, attr, value)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return [getattr(self, attr) for attr in self.__slots__]
+
+    def items(self):
+        return zip(self._keys, self.values())
+
+    iterkeys = __iter__
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def to_dict(self):
+        """Convert to plain dicts and lists, e.g. for serialization.
+        @return: dict.
+        """
+        result = {}
+        for key, value in self.items():
+            if isinstance(value, Record):
+                value = value.to_dict()
+            elif isinstance(value, list):
+                value = [item.to_dict() if isinstance(item, Record) else item for item in value]
+            result[key] = value
+        return result
+
+class Argument(Record):
+    """API call argument."""
+    __slots__ = ("name", "value")
+    _keys = __slots__
+    _attrs = dict(zip(_keys, __slots__))
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    def to_dict(self):
+        return {"name": self.name, "value": self.value}
+
+class Call(Record):
+    """API call logged by a process."""
+    __slots__ = ("timestamp", "thread_id", "category", "api", "status",
+                 "return_value", "arguments", "repeated")
+    _keys = ("timestamp", "thread_id", "category", "api", "status",
+             "return", "arguments", "repeated")
+    _attrs = dict(zip(_keys, __slots__))
+
+    def __init__(self, timestamp, thread_id, category, api, status,
+                 return_value, arguments, repeated=0):
+        self.timestamp = timestamp
+        self.thread_id = thread_id
+        self.category = category
+        self.api = api
+        self.status = status
+        self.return_value = return_value
+        self.arguments = arguments
+        self.repeated = repeated
+
+    def to_dict(self):
+        # Hot path of the reporting modules, spelled out.
+        return {"timestamp": self.timestamp,
+                "thread_id": self.thread_id,
+                "category": self.category,
+                "api": self.api,
+                "status": self.status,
+                "return": self.return_value,
+                "arguments": [argument.to_dict() if isinstance(argument, Record) else argument
+                              for argument in self.arguments],
+                "repeated": self.repeated}
+
+def json_default(obj):
+    """Serialize records, to be used as default hook of json.dump().
+    @param obj: object the json module can't serialize.
+    @return: serializable object.
+    @raise TypeError: if obj isn't a record.
+    """
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    raise TypeError("%r is not JSON serializable" % obj)
+
 class URL:
     """URL base object."""
 
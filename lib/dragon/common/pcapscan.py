@@ -0,0 +1,223 @@
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+"""Fast reader of Ethernet PCAP files.
+
+The capture is memory mapped and read in batches of records. The record
+headers are walked to locate the frames, then the Ethernet, IPv4, TCP and
+UDP headers of the whole batch are decoded at once with NumPy. Only the
+frames these headers can't describe, such as IPv6, VLAN tagged or
+fragmented packets, are left to be decoded by dpkt.
+"""
+
+import mmap
+import socket
+import struct
+
+try:
+    import numpy
+    HAVE_NUMPY = True
+except ImportError:
+    HAVE_NUMPY = False
+
+from lib.dragon.common.exceptions import CuckooOperationalError
+
+# Global header magic numbers, microsecond and nanosecond resolution.
+MAGIC_USEC = 0xa1b2c3d4
+MAGIC_NSEC = 0xa1b23c4d
+LINKTYPE_ETHERNET = 1
+
+GLOBAL_HEADER_SIZE = 24
+RECORD_HEADER_SIZE = 16
+BATCH_SIZE = 65536
+
+# Kinds of packets.
+SKIP = 0
+TCP = 1
+UDP = 2
+IP = 3
+RAW = 4
+
+class Segment(object):
+    """TCP segment or UDP datagram, with the attributes of its dpkt
+    counterpart used by the network processing."""
+    __slots__ = ("sport", "dport", "seq", "flags", "data")
+
+    def __init__(self, sport, dport, seq, flags, data):
+        self.sport = sport
+        self.dport = dport
+        self.seq = seq
+        self.flags = flags
+        self.data = data
+
+class PcapScanner(object):
+    """Iterates over the packets of a PCAP file."""
+
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        """@param path: PCAP file path.
+        @param batch_size: number of records decoded at once.
+        @raise CuckooOperationalError: if NumPy is missing or the capture
+                                       isn't an Ethernet PCAP file.
+        """
+        if not HAVE_NUMPY:
+            raise CuckooOperationalError("NumPy is not installed")
+
+        self.batch_size = batch_size
+        self.fd = open(path, "rb")
+        try:
+            self.data = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError) as e:
+            self.fd.close()
+            raise CuckooOperationalError("Unable to map %s: %s" % (path, e))
+
+        try:
+            self._read_header()
+        except CuckooOperationalError:
+            self.close()
+            raise
+
+        self.bytes = numpy.frombuffer(self.data, dtype=numpy.uint8)
+        self._addresses = {}
+
+    def _read_header(self):
+        if len(self.data) < GLOBAL_HEADER_SIZE:
+            raise CuckooOperationalError("Truncated PCAP header")
+
+        for endian in ("<", ">"):
+            magic, = struct.unpack_from(endian + "I", self.data)
+            if magic in (MAGIC_USEC, MAGIC_NSEC):
+                break
+        else:
+            raise CuckooOperationalError("Not a PCAP file")
+
+        linktype, = struct.unpack_from(endian + "I", self.data, 20)
+        if linktype != LINKTYPE_ETHERNET:
+            raise CuckooOperationalError("Unsupported link type %d" % linktype)
+
+        self.record = struct.Struct(endian + "IIII")
+        self.resolution = 1e9 if magic == MAGIC_NSEC else 1e6
+
+    def close(self):
+        self.bytes = None
+        self.data.close()
+        self.fd.close()
+
+    def _records(self):
+        # The record headers are chained by their lengths and can only be
+        # walked one after the other.
+        offset = GLOBAL_HEADER_SIZE
+        end = len(self.data)
+        unpack = self.record.unpack_from
+        while offset + RECORD_HEADER_SIZE <= end:
+            seconds, fraction, starts, length = [], [], [], []
+            for i in xrange(self.batch_size):
+                if offset + RECORD_HEADER_SIZE > end:
+                    break
+                ts_sec, ts_frac, caplen, origlen = unpack(self.data, offset)
+                offset += RECORD_HEADER_SIZE
+                # Truncated last record.
+                caplen = min(caplen, end - offset)
+                seconds.append(ts_sec)
+                fraction.append(ts_frac)
+                starts.append(offset)
+                length.append(caplen)
+                offset += caplen
+            yield (numpy.array(seconds, dtype=numpy.float64) +
+                   numpy.array(fraction, dtype=numpy.float64) / self.resolution,
+                   numpy.array(starts, dtype=numpy.int64),
+                   numpy.array(length, dtype=numpy.int64))
+
+    def _address(self, value):
+        address = self._addresses.get(value)
+        if address is None:
+            address = self._addresses[value] = socket.inet_ntoa(struct.pack(">I", value))
+        return address
+
+    def _decode(self, starts, lengths):
+        """Decode the headers of a batch of frames.
+        @param starts: frame offsets.
+        @param lengths: captured frame lengths.
+        @return: dict of arrays.
+        """
+        data = self.bytes
+        last = len(data) - 1
+        ends = starts + lengths
+
+        def u8(index):
+            return data[numpy.minimum(index, last)].astype(numpy.int64)
+
+        def u16(index):
+            return (u8(index) << 8) | u8(index + 1)
+
+        def u32(index):
+            return (u16(index) << 16) | u16(index + 2)
+
+        ethertype = u16(starts + 12)
+        ethernet = lengths >= 14
+
+        version_ihl = u8(starts + 14)
+        ihl = (version_ihl & 0xf) * 4
+        ipv4 = ethernet & (ethertype == 0x0800) & (lengths >= 34) & \
+               ((version_ihl >> 4) == 4) & (ihl >= 20)
+        ip_end = numpy.minimum(starts + 14 + u16(starts + 16), ends)
+        fragment = (u16(starts + 20) & 0x3fff) != 0
+        proto = u8(starts + 23)
+        l4 = starts + 14 + ihl
+
+        tcp = ipv4 & ~fragment & (proto == socket.IPPROTO_TCP) & (l4 + 20 <= ends)
+        tcp_payload = l4 + (u8(l4 + 12) >> 4) * 4
+        tcp &= (tcp_payload >= l4 + 20) & (tcp_payload <= ip_end)
+
+        # Like dpkt, the UDP payload spans the rest of the IP packet.
+        udp = ipv4 & ~fragment & (proto == socket.IPPROTO_UDP) & (l4 + 8 <= ip_end)
+
+        kinds = numpy.full(len(starts), RAW, dtype=numpy.int8)
+        # Frames which aren't IP, ignored like dpkt does.
+        kinds[ethernet & (ethertype != 0x0800) & (ethertype != 0x86dd) &
+              (ethertype != 0x8100)] = SKIP
+        kinds[~ethernet] = SKIP
+        kinds[ipv4 & ~fragment & (proto != socket.IPPROTO_TCP) &
+              (proto != socket.IPPROTO_UDP)] = IP
+        kinds[tcp] = TCP
+        kinds[udp] = UDP
+
+        return {"kind" : kinds,
+                "src" : u32(starts + 26),
+                "dst" : u32(starts + 30),
+                "sport" : u16(l4),
+                "dport" : u16(l4 + 2),
+                "seq" : u32(l4 + 4),
+                "flags" : u8(l4 + 13),
+                "payload" : numpy.where(tcp, tcp_payload, l4 + 8),
+                "payload_end" : ip_end}
+
+    def __iter__(self):
+        """Iterate over the packets.
+        @return: generator of (timestamp, kind, src, dst, value) tuples.
+                 For TCP and UDP packets value is a Segment, for RAW ones
+                 the frame, to be decoded by dpkt.
+        """
+        data = self.data
+        for timestamps, starts, lengths in self._records():
+            fields = self._decode(starts, lengths)
+            columns = [timestamps.tolist(), starts.tolist(), lengths.tolist()]
+            columns += [fields[name].tolist() for name in
+                        ("kind", "src", "dst", "sport", "dport", "seq",
+                         "flags", "payload", "payload_end")]
+
+            for ts, start, length, kind, src, dst, sport, dport, seq, flags, \
+                payload, payload_end in zip(*columns):
+                if kind == SKIP:
+                    continue
+                if kind == RAW:
+                    yield ts, kind, None, None, data[start:start + length]
+                    continue
+
+                src = self._address(src)
+                dst = self._address(dst)
+                if kind == IP:
+                    yield ts, kind, src, dst, None
+                else:
+                    yield ts, kind, src, dst, Segment(sport, dport, seq, flags,
+                                                      data[payload:payload_end])
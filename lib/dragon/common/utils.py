@@ -50,6 +50,11 @@ def delete_folder(folder):
         except OSError as e:
             raise CuckooOperationalError("Unable to delete folder: {0}".format(folder))
 
+# Escaped form of every byte, indexed by byte value.
+PRINTABLE_TABLE = [chr(i) if chr(i) in string.printable else r'\x%02x' % i for i in xrange(256)]
+# Printable characters removed by unicode.translate().
+PRINTABLE_UNICODE = dict((ord(c), None) for c in string.printable)
+
 def convert_char(c):
     """Escapes characters.
     @param c: dirty char.
@@ -65,6 +70,16 @@ def convert_to_printable(s):
     @param s: string.
     @return: sanitized string.
     """
+    if isinstance(s, str):
+        # Nothing left once the printable characters are removed, nothing
+        # to escape.
+        if not s.translate(None, string.printable):
+            return s
+        return ''.join(map(PRINTABLE_TABLE.__getitem__, bytearray(s)))
+
+    if isinstance(s, unicode) and s and not s.translate(PRINTABLE_UNICODE):
+        return s
+
     return ''.join(convert_char(c) for c in s)
 
 def datetime_to_iso(timestamp):
@@ -5,7 +5,9 @@
 import os
 import sys
 import json
-from datetime import datetime
+import time
+import threading
+from datetime import datetime, timedelta
 
 from lib.dragon.common.constants import CUCKOO_ROOT
 from lib.dragon.common.exceptions import CuckooDatabaseError
@@ -16,19 +18,61 @@ from lib.dragon.common.objects import File, URL
 from lib.dragon.common.utils import create_folder, Singleton
 
 try:
-    from sqlalchemy import create_engine, Column
+    from sqlalchemy import create_engine, event, inspect, Column
     from sqlalchemy import Integer, String, Boolean, DateTime, Enum
     from sqlalchemy import ForeignKey, Text, Index
-    from sqlalchemy.orm import sessionmaker, relationship
+    from sqlalchemy.orm import sessionmaker, scoped_session, relationship
+    from sqlalchemy.orm import joinedload, subqueryload
     from sqlalchemy.sql import func
+    from sqlalchemy.schema import CreateTable
     from sqlalchemy.ext.declarative import declarative_base
     from sqlalchemy.exc import SQLAlchemyError, IntegrityError
-    from sqlalchemy.pool import NullPool
+    from sqlalchemy.exc import DisconnectionError, TimeoutError
+    from sqlalchemy.pool import NullPool, QueuePool
     Base = declarative_base()
 except ImportError:
     raise CuckooDependencyError("SQLAlchemy library not found, "
                                 "verify your setup")
 
+class MeasuredQueuePool(QueuePool):
+    """Connections pool keeping checkout statistics."""
+
+    def __init__(self, *args, **kwargs):
+        QueuePool.__init__(self, *args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            connection = QueuePool._do_get(self)
+        except TimeoutError:
+            with self.stats_lock:
+                self.timeouts += 1
+            raise
+
+        waited = time.time() - start
+        with self.stats_lock:
+            self.checkouts += 1
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+        return connection
+
+def _on_connect(dbapi_connection, connection_record):
+    connection_record.info["pid"] = os.getpid()
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    # Pooled connections inherited through a fork belong to the parent, the
+    # pool opens a new one instead.
+    if connection_record.info["pid"] != os.getpid():
+        connection_record.connection = connection_proxy.connection = None
+        raise DisconnectionError("Connection opened by process %s, checked "
+                                 "out by process %s"
+                                 % (connection_record.info["pid"], os.getpid()))
+
 class Machine(Base):
     """Configured virtual machines to be used as guests."""
     __tablename__ = "machines"
@@ -138,7 +182,9 @@ class Sample(Base):
                             "sha1",
                             "sha256",
                             "sha512",
-                            unique=True), )
+                            unique=True),
+                      # Lookups by MD5 use the prefix of hash_index.
+                      Index("sample_sha256", "sha256"))
 
     def __repr__(self):
         return "<Sample('%s','%s')>" % (self.id, self.sha256)
@@ -234,17 +280,34 @@ class Task(Base):
                       nullable=False)
     started_on = Column(DateTime(timezone=False), nullable=True)
     completed_on = Column(DateTime(timezone=False), nullable=True)
+    # Analyses which failed are processed and reported as well, through
+    # their own statuses so that the final one is still failure.
     status = Column(Enum("pending",
                          "processing",
+                         "completed",
+                         "failed_analysis",
+                         "reporting",
+                         "failed_reporting",
+                         "reported",
                          "failure",
+                         # Legacy status of the reported tasks, converted
+                         # to reported when the database is opened.
                          "success",
                          name="status_type"),
                          server_default="pending",
                          nullable=False)
+    status_changed_on = Column(DateTime(timezone=False), nullable=True)
     sample_id = Column(Integer, ForeignKey("samples.id"), nullable=True)
     sample = relationship("Sample", backref="tasks")
     guest = relationship("Guest", uselist=False, backref="tasks", cascade="save-update, delete")
     errors = relationship("Error", backref="tasks", cascade="save-update, delete")
+    # Fetching the pending or completed tasks by priority, and listing the
+    # tasks by status, category or date, newest first.
+    __table_args__ = (Index("task_status_priority", "status", "priority", "added_on"),
+                      Index("task_status_id", "status", "id"),
+                      Index("task_category_id", "category", "id"),
+                      Index("task_added_on", "added_on"),
+                      Index("task_sample_id", "sample_id"))
 
     def to_dict(self):
         """Converts object to dict.
@@ -271,6 +334,12 @@ class Task(Base):
     def __repr__(self):
         return "<Task('%s','%s')>" % (self.id, self.target)
 
+# Status of the completed and failed analyses once claimed for reporting.
+REPORTING_STATUS = {"completed" : "reporting",
+                    "failed_analysis" : "failed_reporting"}
+# Status of the tasks held by a scheduler or a processing worker.
+IN_FLIGHT_STATUS = ("processing", "reporting", "failed_reporting")
+
 class Database(object):
     """Analysis queue database.
 
@@ -279,15 +348,16 @@ class Database(object):
     """
     __metaclass__ = Singleton
 
-    def __init__(self, dsn=None):
-        """@param dsn: database connection string."""
+    def __init__(self, dsn=None, pool_size=None):
+        """@param dsn: database connection string.
+        @param pool_size: number of pooled connections, overriding the
+                          configuration, 0 to disable pooling.
+        """
         cfg = Config()
 
-        if dsn:
-            self.engine = create_engine(dsn, poolclass=NullPool)
-        elif cfg.database.connection:
-            self.engine = create_engine(cfg.database.connection, poolclass=NullPool)
-        else:
+        if not dsn:
+            dsn = cfg.database.connection
+        if not dsn:
             db_file = os.path.join(CUCKOO_ROOT, "db", "cuckoo.db")
             if not os.path.exists(db_file):
                 db_dir = os.path.dirname(db_file)
@@ -297,29 +367,148 @@ class Database(object):
                     except CuckooOperationalError as e:
                         raise CuckooDatabaseError("Unable to create database "
                                                   "directory: %s" % e)
-            self.engine = create_engine("sqlite:///%s" % db_file, poolclass=NullPool)
+            dsn = "sqlite:///%s" % db_file
+
+        if pool_size is None:
+            pool_size = cfg.database.pool_size
+        self.pooled = bool(pool_size)
+
+        options = {}
+        if dsn.startswith("sqlite"):
+            # Connections are returned to the pool, or closed, by the thread
+            # releasing the session, not necessarily the one opening it.
+            options["connect_args"] = {"check_same_thread" : False}
+
+        if self.pooled:
+            self.engine = create_engine(dsn,
+                                        poolclass=MeasuredQueuePool,
+                                        pool_size=int(pool_size),
+                                        max_overflow=int(cfg.database.max_overflow or 0),
+                                        # Connection timeout.
+                                        pool_timeout=cfg.database.timeout or 60,
+                                        **options)
+            event.listen(self.engine, "connect", _on_connect)
+            event.listen(self.engine, "checkout", _on_checkout)
+        else:
+            self.engine = create_engine(dsn, poolclass=NullPool, **options)
 
         # Disable SQL logging. Turn it on for debugging.
         self.engine.echo = False
-        # Connection timeout.
-        if cfg.database.timeout:
-            self.engine.pool_timeout = cfg.database.timeout
-        else:
-            self.engine.pool_timeout = 60
         # Create schema.
         try:
             Base.metadata.create_all(self.engine)
+            self._migrate()
+            self._create_indexes()
         except SQLAlchemyError as e:
             raise CuckooDatabaseError("Unable to create or connect to "
                                       "database: %s" % e)
 
-        # Get db session.
-        self.Session = sessionmaker(bind=self.engine)
+        # Get db session. When pooled, every thread reuses its own session
+        # until end_session() is called.
+        if self.pooled:
+            self.Session = scoped_session(sessionmaker(bind=self.engine))
+        else:
+            self.Session = sessionmaker(bind=self.engine)
 
     def __del__(self):
         """Disconnects pool."""
         self.engine.dispose()
 
+    def _migrate(self):
+        """Bring the tables created by an older version up to date,
+        create_all() only creates the missing tables."""
+        # The columns added since are all nullable.
+        existing = set(column["name"] for column in inspect(self.engine).get_columns("tasks"))
+        for column in Task.__table__.columns:
+            if column.name not in existing:
+                self.engine.execute("ALTER TABLE tasks ADD COLUMN %s %s"
+                                    % (column.name, column.type.compile(self.engine.dialect)))
+
+        self._migrate_status_type()
+        # Tasks processed and reported in one go by older versions.
+        self.engine.execute(Task.__table__.update().where(Task.status == "success").values(status="reported"))
+
+    def _migrate_status_type(self):
+        """Add the missing task statuses to the type, or the constraint,
+        the status column was created with."""
+        statuses = Task.__table__.c.status.type.enums
+        dialect = self.engine.dialect.name
+
+        if dialect == "postgresql":
+            existing = set(row[0] for row in self.engine.execute(
+                "SELECT enumlabel FROM pg_enum JOIN pg_type "
+                "ON pg_enum.enumtypid = pg_type.oid "
+                "WHERE pg_type.typname = 'status_type'"))
+            # Values can't be added to an enum within a transaction block.
+            connection = self.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+            try:
+                for status in statuses:
+                    if status not in existing:
+                        connection.execute("ALTER TYPE status_type ADD VALUE '%s'" % status)
+            finally:
+                connection.close()
+        elif dialect == "mysql":
+            column = [column for column in inspect(self.engine).get_columns("tasks")
+                      if column["name"] == "status"][0]
+            if set(statuses) - set(getattr(column["type"], "enums", statuses)):
+                self.engine.execute("ALTER TABLE tasks MODIFY status ENUM(%s) "
+                                    "NOT NULL DEFAULT 'pending'"
+                                    % ", ".join("'%s'" % status for status in statuses))
+        elif dialect == "sqlite":
+            sql = self.engine.execute("SELECT sql FROM sqlite_master "
+                                      "WHERE type = 'table' AND name = 'tasks'").scalar()
+            if all("'%s'" % status in sql for status in statuses):
+                return
+
+            # The CHECK constraint can't be altered, the table is rebuilt
+            # and its indexes created again by _create_indexes().
+            columns = set(column.name for column in Task.__table__.columns)
+            columns &= set(column["name"] for column in inspect(self.engine).get_columns("tasks"))
+            columns = ", ".join(sorted(columns))
+            create = str(CreateTable(Task.__table__).compile(self.engine))
+            create = create.replace("CREATE TABLE tasks ", "CREATE TABLE tasks_new ", 1)
+
+            with self.engine.begin() as connection:
+                connection.execute(create)
+                connection.execute("INSERT INTO tasks_new (%s) SELECT %s FROM tasks" % (columns, columns))
+                connection.execute("DROP TABLE tasks")
+                connection.execute("ALTER TABLE tasks_new RENAME TO tasks")
+
+    def _create_indexes(self):
+        """Create the indexes missing from tables created by an older
+        version, create_all() only creates the indexes of new tables."""
+        inspector = inspect(self.engine)
+        for table in Base.metadata.sorted_tables:
+            existing = set(index["name"] for index in inspector.get_indexes(table.name))
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(self.engine)
+
+    def end_session(self):
+        """End the session of the current thread, if pooled, returning its
+        connection to the pool. To be called once a unit of work, such as
+        an API request, is done, so that the next one sees fresh data."""
+        if self.pooled:
+            self.Session.remove()
+
+    def pool_status(self):
+        """Get the connections pool statistics.
+        @return: statistics dict, empty if not pooled.
+        """
+        pool = self.engine.pool
+        if not isinstance(pool, MeasuredQueuePool):
+            return {}
+
+        with pool.stats_lock:
+            return {"size" : pool.size(),
+                    "checked_in" : pool.checkedin(),
+                    "checked_out" : pool.checkedout(),
+                    "overflow" : pool.overflow(),
+                    "checkouts" : pool.checkouts,
+                    "timeouts" : pool.timeouts,
+                    "wait_time" : round(pool.wait_time, 6),
+                    "max_wait" : round(pool.max_wait, 6)}
+
     def clean_machines(self):
         """Clean old stored machines."""
         session = self.Session()
@@ -337,7 +526,9 @@ class Database(object):
         """
         session = self.Session()
         try:
-            session.query(Task).get(task_id).status = status
+            task = session.query(Task).get(task_id)
+            task.status = status
+            task.status_changed_on = datetime.now()
             session.commit()
         except SQLAlchemyError:
             session.rollback()
@@ -373,7 +564,7 @@ class Database(object):
         """
         session = self.Session()
         try:
-            row = session.query(Task).filter(Task.status == "pending").order_by("priority desc, added_on").first()
+            row = session.query(Task).filter(Task.status == "pending").order_by(Task.priority.desc(), Task.added_on).first()
         except SQLAlchemyError:
             return None
         return row
@@ -389,22 +580,133 @@ class Database(object):
         """Fetches a task waiting to be processed and locks it for processing.
         @return: None or task
         """
+        tasks = self.fetch_and_process_batch(1)
+        if tasks:
+            return tasks[0]
+        return None
+
+    def fetch_and_process_batch(self, limit):
+        """Fetches tasks waiting to be processed and locks them for processing.
+
+        Every task is claimed with a compare-and-set update, in a single
+        transaction, so that schedulers sharing the database never claim the
+        same task. Databases supporting it also lock the selected rows.
+        @param limit: maximum number of tasks.
+        @return: list of tasks, by priority and age.
+        """
+        if limit < 1:
+            return []
+
         session = self.Session()
         try:
-            row = session.query(Task).filter(Task.status == "pending").order_by("priority desc, added_on").first()
-            if row:
-               row.status = "processing"
-               row.started_on = datetime.now()
+            query = session.query(Task.id).filter(Task.status == "pending")
+            query = query.order_by(Task.priority.desc(), Task.added_on).limit(limit)
+            # Other schedulers skip the rows being claimed instead of waiting.
+            query = query.with_for_update(skip_locked=self.engine.dialect.name == "postgresql")
+
+            claimed = []
+            started_on = datetime.now()
+            for task_id, in query.all():
+                # Another scheduler might have claimed it in the meanwhile.
+                if session.query(Task).filter(Task.id == task_id, Task.status == "pending").update({"status" : "processing", "started_on" : started_on, "status_changed_on" : started_on}, synchronize_session=False):
+                    claimed.append(task_id)
             session.commit()
+
+            if not claimed:
+                return []
+            return session.query(Task).filter(Task.id.in_(claimed)).order_by(Task.priority.desc(), Task.added_on).all()
+        except SQLAlchemyError:
+            session.rollback()
+            return []
+
+    def fetch_and_report(self):
+        """Fetches a completed or failed analysis task and locks it for
+        reporting, moving it to reporting or failed_reporting respectively.
+        @return: None or task
+        """
+        session = self.Session()
+        try:
+            while True:
+                row = session.query(Task).filter(Task.status.in_(REPORTING_STATUS.keys())).order_by(Task.priority.desc(), Task.completed_on).first()
+                if not row:
+                    break
+
+                # Another worker might have claimed it in the meanwhile.
+                claimed = session.query(Task).filter(Task.id == row.id, Task.status == row.status).update({"status" : REPORTING_STATUS[row.status], "status_changed_on" : datetime.now()}, synchronize_session=False)
+                session.commit()
+                if claimed:
+                    session.refresh(row)
+                    break
         except SQLAlchemyError:
             session.rollback()
             return None
         return row
 
-    def complete(self, task_id, success=True):
+    def touch_tasks(self, task_ids):
+        """Record that tasks are still being worked on, so that they aren't
+        reclaimed as left by a dead scheduler or processing worker.
+        @param task_ids: ids of the tasks being analyzed, processed or
+                         reported.
+        @return: operation status.
+        """
+        if not task_ids:
+            return True
+
+        session = self.Session()
+        try:
+            session.query(Task).filter(Task.id.in_(task_ids), Task.status.in_(IN_FLIGHT_STATUS)).update({"status_changed_on" : datetime.now()}, synchronize_session=False)
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            return False
+
+        return True
+
+    def reclaim_stale_tasks(self, timeout):
+        """Reclaim the tasks left processing or reporting by a scheduler or
+        a processing worker which died. The interrupted analyses are marked
+        as failed, their results are processed by the workers, and the
+        interrupted reports are queued again. Live schedulers and workers
+        keep their tasks with touch_tasks().
+        @param timeout: seconds after which a task is considered left.
+        @return: number of reclaimed tasks.
+        """
+        now = datetime.now()
+        threshold = now - timedelta(seconds=timeout)
+        reclaimed = 0
+
+        session = self.Session()
+        try:
+            # Tasks claimed by older versions have no status change date.
+            for status, reclaimed_status, started in (("processing", "failed_analysis", Task.started_on),
+                                                      ("reporting", "completed", Task.completed_on),
+                                                      ("failed_reporting", "failed_analysis", Task.completed_on)):
+                reclaimed += session.query(Task).filter(Task.status == status, func.coalesce(Task.status_changed_on, started) < threshold).update({"status" : reclaimed_status, "status_changed_on" : now}, synchronize_session=False)
+            session.commit()
+        except SQLAlchemyError:
+            session.rollback()
+            return 0
+
+        return reclaimed
+
+    def report(self, task_id, success=True):
+        """Mark the results of a task as processed and reported.
+        @param task_id: task id.
+        @param success: reported with status.
+        @return: operation status.
+        """
+        if success:
+            return self._set_status(task_id, "reported")
+        else:
+            return self._set_status(task_id, "failure")
+
+    def complete(self, task_id, success=True, claim=False):
         """Mark a task as completed.
         @param task_id: task id.
         @param success: completed with status.
+        @param claim: lock the task for reporting right away, as
+                      fetch_and_report() does, when its results are
+                      processed by the caller.
         @return: operation status.
         """
         session = self.Session()
@@ -414,11 +716,14 @@ class Database(object):
             return False
 
         if success:
-            task.status = "success"
+            task.status = "completed"
         else:
-            task.status = "failure"
+            task.status = "failed_analysis"
+
+        if claim:
+            task.status = REPORTING_STATUS[task.status]
 
-        task.completed_on = datetime.now()
+        task.completed_on = task.status_changed_on = datetime.now()
 
         try:
             session.commit()
@@ -710,14 +1015,44 @@ class Database(object):
                         memory,
                         enforce_timeout)
 
-    def list_tasks(self, limit=None):
-        """Retrieve list of task.
+    def list_tasks(self,
+                   limit=None,
+                   before=None,
+                   status=None,
+                   category=None,
+                   added_after=None,
+                   added_before=None):
+        """Retrieve list of task, newest first.
         @param limit: specify a limit of entries.
+        @param before: only tasks with a lower ID, the last ID of the
+                       previous page.
+        @param status: only tasks with this status.
+        @param category: only tasks of this category.
+        @param added_after: only tasks added since this datetime.
+        @param added_before: only tasks added before this datetime.
         @return: list of tasks.
         """
         session = self.Session()
         try:
-            tasks = session.query(Task).order_by("added_on desc").limit(limit)
+            # Relations are loaded with the tasks, the session may be gone
+            # when they are accessed.
+            query = session.query(Task).options(joinedload(Task.sample),
+                                                joinedload(Task.guest),
+                                                subqueryload(Task.errors))
+            # Pages are delimited by the last ID, rather than an offset, so
+            # that they don't get slower the further they are.
+            if before is not None:
+                query = query.filter(Task.id < before)
+            if status:
+                query = query.filter(Task.status == status)
+            if category:
+                query = query.filter(Task.category == category)
+            if added_after:
+                query = query.filter(Task.added_on >= added_after)
+            if added_before:
+                query = query.filter(Task.added_on < added_before)
+
+            tasks = query.order_by(Task.id.desc()).limit(limit).all()
         except SQLAlchemyError:
             return None
         return tasks
@@ -729,7 +1064,7 @@ class Database(object):
         """
         session = self.Session()
         try:
-            task = session.query(Task).get(task_id)
+            task = session.query(Task).options(joinedload(Task.guest), subqueryload(Task.errors)).get(task_id)
         except SQLAlchemyError:
             return None
         return task
@@ -3,9 +3,14 @@
 # See the file 'docs/LICENSE' for copying permission.
 
 import os
+import time
+import Queue
 import logging
+from collections import Counter, defaultdict
 from distutils.version import StrictVersion
+from multiprocessing.pool import ThreadPool
 
+from lib.dragon.common.config import Config
 from lib.dragon.common.constants import CUCKOO_ROOT, CUCKOO_VERSION
 from lib.dragon.common.exceptions import CuckooProcessingError
 from lib.dragon.core.database import Database
@@ -17,22 +22,24 @@ class Processor:
     """Analysis Results Processing Engine.
 
     This class handles the loading and execution of the processing modules.
-    It executes the enabled ones sequentially and generates a dictionary which
-    is then passed over the reporting engine.
+    It executes the enabled ones concurrently, each as soon as the modules it
+    requires are completed, and generates a dictionary which is then passed
+    over the reporting engine.
     """
 
     def __init__(self, task_id):
         """@param task_id: ID of the analyses to process."""
+        self.cfg = Config()
         self.task = Database().view_task(task_id).to_dict()
         self.analysis_path = os.path.join(CUCKOO_ROOT,
                                           "storage",
                                           "analyses",
                                           str(task_id))
 
-    def _run_processing(self, module):
+    def _run_processing(self, module, results=None):
         """Run a processing module.
         @param module: processing module to run.
-        @param results: results dict.
+        @param results: results of the modules it requires.
         @return: results generated by module.
         """
         # Initialize the specified processing module.
@@ -41,6 +48,8 @@ class Processor:
         current.set_path(self.analysis_path)
         # Set analysis task dictionary.
         current.set_task(self.task)
+        # Provide it the results it depends on.
+        current.set_results(results or {})
 
         # If current processing module is disabled, skip it.
         if not current.enabled:
@@ -66,17 +75,84 @@ class Processor:
 
         return None
 
-    def _run_signature(self, signature, results):
-        """Run a signature.
-        @param signature: signature to run.
-        @param signs: signature results dict.
-        @return: matched signature.
+    def _run_timed_processing(self, module, results):
+        """Run a processing module and measure its execution time.
+        @param module: processing module to run.
+        @param results: results of the modules it requires.
+        @return: tuple of module, results generated by module and seconds.
+        """
+        start = time.time()
+        try:
+            result = self._run_processing(module, results)
+        except Exception:
+            log.exception("Failed to initialize the processing module \"%s\":"
+                          % module.__name__)
+            result = None
+
+        return module, result, time.time() - start
+
+    def _run_all_processing(self, modules_list):
+        """Run the processing modules, concurrently when their requirements
+        allow it.
+        @param modules_list: processing modules sorted by order.
+        @return: results dict and list of execution times.
+        """
+        results = {}
+        timings = []
+
+        # Number of modules yet to complete for each results key.
+        providers = Counter(module.key for module in modules_list if module.key)
+        pending = list(modules_list)
+        running = 0
+        completed = Queue.Queue()
+
+        pool = ThreadPool(max(int(self.cfg.processing.module_threads or 1), 1))
+        try:
+            while pending or running:
+                # Start, in order, every module with its requirements met.
+                for module in list(pending):
+                    if any(providers[key] for key in module.requires):
+                        continue
+
+                    pending.remove(module)
+                    required = dict((key, results[key]) for key in module.requires if key in results)
+                    pool.apply_async(self._run_timed_processing,
+                                     (module, required),
+                                     callback=completed.put)
+                    running += 1
+
+                if not running:
+                    log.error("Unable to run processing modules with circular "
+                              "requirements: %s"
+                              % ", ".join(module.__name__ for module in pending))
+                    break
+
+                module, result, elapsed = completed.get()
+                running -= 1
+
+                # If it provided some results, append it to the big results
+                # container.
+                if result:
+                    results.update(result)
+
+                if module.key:
+                    providers[module.key] -= 1
+                timings.append({"name" : module.__name__, "time" : round(elapsed, 3)})
+        finally:
+            pool.close()
+            pool.join()
+
+        return results, timings
+
+    def _load_signature(self, signature, results):
+        """Initialize a signature, if enabled and compatible.
+        @param signature: signature to load.
+        @param results: results dict.
+        @return: signature instance or None.
         """
         # Initialize the current signature.
         current = signature(results)
 
-        log.debug("Running signature \"%s\"" % current.name)
-
         # If the signature is disabled, skip it.
         if not current.enabled:
             return None
@@ -120,27 +196,121 @@ class Processor:
                           % current.name)
                 return None
 
+        return current
+
+    def _signature_match(self, current):
+        """Extract key information from a matched signature.
+        @param current: matched signature.
+        @return: matched signature dict.
+        """
+        log.debug("Analysis at \"%s\" matched signature \"%s\""
+                  % (self.analysis_path, current.name))
+
+        return {"name" : current.name,
+                "description" : current.description,
+                "severity" : current.severity,
+                "references" : current.references,
+                "data" : current.data,
+                "alert" : current.alert}
+
+    def _run_signature(self, signature, results):
+        """Run a signature.
+        @param signature: signature to run.
+        @param signs: signature results dict.
+        @return: matched signature.
+        """
+        current = self._load_signature(signature, results)
+        if not current:
+            return None
+
+        log.debug("Running signature \"%s\"" % current.name)
+
         try:
             # Run the signature and if it gets matched, extract key information
             # from it and append it to the results container.
             if current.run():
-                matched = {"name" : current.name,
-                           "description" : current.description,
-                           "severity" : current.severity,
-                           "references" : current.references,
-                           "data" : current.data,
-                           "alert" : current.alert}
-
-                log.debug("Analysis at \"%s\" matched signature \"%s\""
-                          % (self.analysis_path, current.name))
-
                 # Return information on the matched signature.
-                return matched
+                return self._signature_match(current)
         except Exception as e:
             log.exception("Failed to run signature \"%s\":" % (current.name))
 
         return None
 
+    def _run_evented_signatures(self, signatures, results):
+        """Run the evented signatures over a single pass on the API calls.
+        @param signatures: evented signature instances.
+        @param results: results dict.
+        @return: list of matched signatures.
+        """
+        matched = []
+
+        # Index the signatures by the API names or, failing that, the
+        # categories they are interested in.
+        by_api = defaultdict(list)
+        by_category = defaultdict(list)
+        unfiltered = []
+        for current in signatures:
+            if current.filter_apinames:
+                for apiname in current.filter_apinames:
+                    by_api[apiname].append(current)
+            elif current.filter_categories:
+                for category in current.filter_categories:
+                    by_category[category].append(current)
+            else:
+                unfiltered.append(current)
+
+        # Signatures still willing to receive calls.
+        active = set(signatures)
+
+        def notify(current, call, process):
+            if current not in active:
+                return
+            if current.filter_processnames and process["process_name"] not in current.filter_processnames:
+                return
+            if current.filter_categories and call["category"] not in current.filter_categories:
+                return
+
+            try:
+                result = current.on_call(call, process)
+            except Exception:
+                log.exception("Failed to run signature \"%s\":" % current.name)
+                active.discard(current)
+                return
+
+            if result is not None:
+                active.discard(current)
+                if result:
+                    matched.append(self._signature_match(current))
+
+        behavior = results.get("behavior") or {}
+        for process in behavior.get("processes") or []:
+            for call in process["calls"]:
+                for current in by_api.get(call["api"], ()):
+                    notify(current, call, process)
+                for current in by_category.get(call["category"], ()):
+                    notify(current, call, process)
+                for current in unfiltered:
+                    notify(current, call, process)
+
+                # No more signature to notify, skip the remaining calls.
+                if not active:
+                    break
+
+            if not active:
+                break
+
+        for current in signatures:
+            if current not in active:
+                continue
+
+            try:
+                if current.on_complete():
+                    matched.append(self._signature_match(current))
+            except Exception:
+                log.exception("Failed to run signature \"%s\":" % current.name)
+
+        return matched
+
     def run(self):
         """Run all processing modules and all signatures.
         @return: processing results.
@@ -166,23 +336,32 @@ class Processor:
         modules_list.sort(key=lambda module: module.order)
 
         # Run every loaded processing module.
-        for module in modules_list:
-            result = self._run_processing(module)
-            # If it provided some results, append it to the big results
-            # container.
-            if result:
-                results.update(result)
+        results, timings = self._run_all_processing(modules_list)
+
+        # Keep track of where the processing time goes.
+        results["statistics"] = {"processing" : timings}
 
         # This will contain all the matched signatures.
         sigs = []
+        evented = []
 
         # Run every loaded signature.
         for signature in list_plugins(group="signatures"):
+            # The evented ones share a single pass over the calls, below.
+            if signature.evented:
+                current = self._load_signature(signature, results)
+                if current:
+                    evented.append(current)
+                continue
+
             match = self._run_signature(signature, results)
             # If the signature is matched, add it to the list.
             if match:
                 sigs.append(match)
 
+        if evented:
+            sigs.extend(self._run_evented_signatures(evented, results))
+
         # Sort the matched signatures by their severity level.
         sigs.sort(key=lambda key: key["severity"])
 
@@ -3,8 +3,12 @@
 # See the file 'docs/LICENSE' for copying permission.
 
 import os
+import time
 import inspect
 import logging
+import itertools
+from Queue import Queue, Empty
+from threading import Thread
 
 from lib.dragon.common.constants import CUCKOO_ROOT
 from lib.dragon.common.config import Config
@@ -37,10 +41,23 @@ class Reporter:
                                            "conf",
                                            "reporting.conf"))
 
+    def _module_options(self, module):
+        """Get the reporting.conf section of a reporting module.
+        @param module: reporting module.
+        @return: options dict.
+        """
+        # Extract the module name.
+        module_name = inspect.getmodule(module).__name__
+        if "." in module_name:
+            module_name = module_name.rsplit(".", 1)[1]
+
+        return self.cfg.get(module_name)
+
     def _run_report(self, module, results):
         """Run a single reporting module.
         @param module: reporting module.
         @param results: results results from analysis.
+        @return: whether the module is enabled.
         """
         # Initialize current reporting module.
         current = module()
@@ -49,16 +66,11 @@ class Reporter:
         # Load the content of the analysis.conf file.
         current.cfg = Config(current.conf_path)
 
-        # Extract the module name.
-        module_name = inspect.getmodule(current).__name__
-        if "." in module_name:
-            module_name = module_name.rsplit(".", 1)[1]
-
-        options = self.cfg.get(module_name)
+        options = self._module_options(module)
 
         # If the reporting module is disabled in the config, skip it.
         if not options.enabled:
-            return
+            return False
 
         # Give it the content of the relevant section from the reporting.conf
         # configuration file.
@@ -79,6 +91,90 @@ class Reporter:
             log.exception("Failed to run the reporting module \"%s\":"
                           % (current.__class__.__name__))
 
+        return True
+
+    def _run_timed_report(self, module, results):
+        """Run a single reporting module and time it.
+        @param module: reporting module.
+        @param results: results results from analysis.
+        @return: execution time, None if the module is disabled.
+        """
+        start = time.time()
+        if not self._run_report(module, results):
+            return None
+        return time.time() - start
+
+    def _run_queued_report(self, module, results, done):
+        """Run a single reporting module in its own thread.
+        @param module: reporting module.
+        @param results: results results from analysis.
+        @param done: queue the module and its execution time are put in.
+        """
+        elapsed = None
+        try:
+            elapsed = self._run_timed_report(module, results)
+        except Exception:
+            log.exception("Failed to run the reporting module \"%s\":"
+                          % module.__name__)
+        finally:
+            done.put((module, elapsed))
+
+    def _run_all_reports(self, modules_list, results, timings, threads, timeout):
+        """Run the reporting modules concurrently. Modules with the same order
+        run together, a higher order waits for the lower ones to complete.
+        @param modules_list: reporting modules sorted by order.
+        @param results: results from analysis.
+        @param timings: list the execution times are added to.
+        @param threads: number of modules run at the same time.
+        @param timeout: default time given to each module, in seconds.
+        """
+        for order, group in itertools.groupby(modules_list, key=lambda module: module.order):
+            group = list(group)
+            queued = list(group)
+            # Every module gets its own time from its start on, whatever the
+            # time spent waiting for a thread.
+            running = {}
+            done = Queue()
+            group_timings = {}
+
+            while queued or running:
+                # Timed out modules can't be interrupted, they are left
+                # behind and don't take the place of the queued ones.
+                while queued and len(running) < threads:
+                    module = queued.pop(0)
+                    module_timeout = int(self._module_options(module).timeout or timeout)
+                    running[module] = (module_timeout, time.time())
+                    thread = Thread(target=self._run_queued_report, args=(module, results, done))
+                    thread.daemon = True
+                    thread.start()
+
+                deadline = min(started + module_timeout for module_timeout, started in running.values())
+                try:
+                    module, elapsed = done.get(timeout=max(0, deadline - time.time()))
+                except Empty:
+                    now = time.time()
+                    for module, (module_timeout, started) in running.items():
+                        if now < started + module_timeout:
+                            continue
+                        log.error("The reporting module \"%s\" did not complete "
+                                  "within %d seconds, moving on"
+                                  % (module.__name__, module_timeout))
+                        group_timings[module] = {"name" : module.__name__,
+                                                 "time" : round(now - started, 3),
+                                                 "timeout" : True}
+                        del running[module]
+                    continue
+
+                # Modules completing after their timeout are already
+                # accounted for.
+                if running.pop(module, None) and elapsed is not None:
+                    group_timings[module] = {"name" : module.__name__,
+                                             "time" : round(elapsed, 3)}
+
+            # Modules of the following orders see the times of the previous
+            # ones.
+            timings.extend(group_timings[module] for module in group if module in group_timings)
+
     def run(self, results):
         """Generates all reports.
         @param results: analysis results.
@@ -97,6 +193,17 @@ class Reporter:
 
         modules_list.sort(key=lambda module: module.order)
 
+        timings = results.setdefault("statistics", {}).setdefault("reporting", [])
+
+        cfg = Config()
+        threads = int(cfg.processing.reporting_threads or 1)
+        if threads > 1:
+            timeout = int(cfg.processing.reporting_timeout or 600)
+            self._run_all_reports(modules_list, results, timings, threads, timeout)
+            return
+
         # Run every loaded reporting module.
         for module in modules_list:
-            self._run_report(module, results)
+            elapsed = self._run_timed_report(module, results)
+            if elapsed is not None:
+                timings.append({"name" : module.__name__, "time" : round(elapsed, 3)})
@@ -7,6 +7,8 @@ import socket
 import select
 import logging
 import time
+import errno
+import asyncore
 import datetime
 import SocketServer
 from threading import Timer, Event, Thread
@@ -16,6 +18,7 @@ from lib.dragon.common.exceptions import CuckooOperationalError
 from lib.dragon.common.constants import *
 from lib.dragon.common.utils import create_folder, Singleton, logtime
 from lib.dragon.common.netlog import NetlogParser
+from lib.dragon.common.callstore import CallStoreWriter, store_path
 
 log = logging.getLogger(__name__)
 
@@ -25,36 +28,30 @@ class Disconnect(Exception):
     pass
 
 
-class Resultserver(SocketServer.ThreadingTCPServer, object):
-    """Result server. Singleton!
+class Incomplete(Exception):
+    """Not enough data buffered yet to decode the next message."""
+    pass
 
-    This class handles results coming back from the analysis machines.
+
+def get_resultserver():
+    """Get the result server selected in the configuration.
+    @return: Resultserver or AsyncResultserver instance.
     """
+    if Config().resultserver.eventloop:
+        return AsyncResultserver()
+    return Resultserver()
 
-    __metaclass__ = Singleton
 
-    allow_reuse_address = True
-    daemon_threads = True
+class ResultserverBase(object):
+    """Task bookkeeping shared by the result servers."""
 
-    def __init__(self, *args, **kwargs):
+    __metaclass__ = Singleton
+
+    def __init__(self):
         self.cfg = Config()
         self.analysistasks = {}
         self.analysishandlers = {}
 
-        try:
-            SocketServer.ThreadingTCPServer.__init__(self,
-                                                     (self.cfg.resultserver.ip, self.cfg.resultserver.port),
-                                                     Resulthandler,
-                                                     *args,
-                                                     **kwargs)
-        except Exception as e:
-            log.error("Unable to bind result server on %s:%s: %s",
-                      self.cfg.resultserver.ip, self.cfg.resultserver.port, e)
-        else:
-            self.servethread = Thread(target=self.serve_forever)
-            self.servethread.setDaemon(True)
-            self.servethread.start()
-
     def add_task(self, task, machine):
         """Register a task/machine with the Resultserver."""
         self.analysistasks[machine.ip] = (task, machine)
@@ -93,6 +90,185 @@ class Resultserver(SocketServer.ThreadingTCPServer, object):
         return storagepath
 
 
+class Resultserver(ResultserverBase, SocketServer.ThreadingTCPServer):
+    """Result server. Singleton!
+
+    This class handles results coming back from the analysis machines.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        ResultserverBase.__init__(self)
+
+        if self.cfg.resultserver.buffered:
+            handler = BufferedResulthandler
+        else:
+            handler = Resulthandler
+
+        try:
+            SocketServer.ThreadingTCPServer.__init__(self,
+                                                     (self.cfg.resultserver.ip, self.cfg.resultserver.port),
+                                                     handler,
+                                                     *args,
+                                                     **kwargs)
+        except Exception as e:
+            log.error("Unable to bind result server on %s:%s: %s",
+                      self.cfg.resultserver.ip, self.cfg.resultserver.port, e)
+        else:
+            self.servethread = Thread(target=self.serve_forever)
+            self.servethread.setDaemon(True)
+            self.servethread.start()
+
+
+class AsyncResultserver(ResultserverBase, asyncore.dispatcher):
+    """Event driven result server. Singleton!
+
+    Same duties as Resultserver, but all the guest connections are
+    multiplexed by a single thread running a poll() loop instead of getting
+    a thread each.
+    """
+
+    def __init__(self, address=None):
+        ResultserverBase.__init__(self)
+        self.handler_class = AsyncResulthandler
+        self.running = True
+        self.map = {}
+        asyncore.dispatcher.__init__(self, map=self.map)
+
+        if not address:
+            address = (self.cfg.resultserver.ip, self.cfg.resultserver.port)
+
+        try:
+            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.set_reuse_addr()
+            self.bind(address)
+            self.listen(128)
+        except Exception as e:
+            log.error("Unable to bind result server on %s:%s: %s",
+                      address[0], address[1], e)
+        else:
+            self.servethread = Thread(target=self.serve_forever)
+            self.servethread.setDaemon(True)
+            self.servethread.start()
+
+    def serve_forever(self):
+        while self.running:
+            asyncore.loop(timeout=1, use_poll=True, map=self.map, count=1)
+
+            # Drop the connections of the tasks being deleted.
+            for conn in self.map.values():
+                if isinstance(conn, AsyncConnection) and conn.handler.end_request.isSet():
+                    conn.handle_close()
+
+        for conn in self.map.values():
+            conn.handle_close()
+
+    def shutdown(self):
+        """Stop the event loop and close all the connections."""
+        self.running = False
+        self.servethread.join()
+
+    def handle_close(self):
+        self.close()
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair:
+            sock, client_address = pair
+            AsyncConnection(sock, client_address, self)
+
+
+class ReadBuffer(object):
+    """Reusable receive buffer.
+
+    Data is received with recv_into() straight into a preallocated bytearray
+    and consumed by moving a read offset, so messages can be decoded with
+    struct.unpack_from() without building intermediate strings. Consumed
+    bytes are kept until release() so the caller can still dump them (e.g.
+    to the raw netlog file) in one write.
+    """
+
+    def __init__(self, size=BUFSIZE * 4):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        # Offset of the first unread byte.
+        self.start = 0
+        # Offset of the first free byte.
+        self.end = 0
+        # Offset of the first consumed byte not yet released.
+        self.mark = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def _compact(self):
+        """Drop released bytes, growing the buffer if it is still full."""
+        keep = self.end - self.mark
+        if keep * 2 > len(self.buf):
+            # A bytearray with exported views can't be resized in place.
+            self.buf = bytearray(len(self.buf) * 2)
+            self.buf[:keep] = self.view[self.mark:self.end]
+            self.view = memoryview(self.buf)
+        elif keep:
+            self.buf[:keep] = self.buf[self.mark:self.end]
+
+        self.start -= self.mark
+        self.end = keep
+        self.mark = 0
+
+    def recv_from(self, sock):
+        """Receive as much data as fits in the buffer.
+        @param sock: socket to read from.
+        @return: number of bytes received, 0 if the peer disconnected.
+        """
+        if self.end * 2 > len(self.buf):
+            self._compact()
+
+        length = sock.recv_into(self.view[self.end:])
+        self.end += length
+        return length
+
+    def take(self, length):
+        """Consume bytes.
+        @param length: number of bytes, must be available.
+        @return: consumed data string.
+        """
+        data = self.view[self.start:self.start + length].tobytes()
+        self.start += length
+        return data
+
+    def unpack(self, st):
+        """Consume and decode a fixed size structure.
+        @param st: struct.Struct instance, its size must be available.
+        @return: unpacked values tuple.
+        """
+        values = st.unpack_from(self.buf, self.start)
+        self.start += st.size
+        return values
+
+    def find(self, sub):
+        """Search unread data.
+        @param sub: string to look for.
+        @return: length up to and including sub, or -1 if not found.
+        """
+        pos = self.buf.find(sub, self.start, self.end)
+        if pos < 0:
+            return -1
+        return pos - self.start + len(sub)
+
+    def pending(self):
+        """Consumed but not yet released data.
+        @return: memoryview of the data.
+        """
+        return self.view[self.mark:self.start]
+
+    def release(self):
+        """Allow consumed data to be discarded."""
+        self.mark = self.start
+
+
 class Resulthandler(SocketServer.BaseRequestHandler):
     """Result handler.
 
@@ -102,6 +278,7 @@ class Resulthandler(SocketServer.BaseRequestHandler):
     def setup(self):
         self.logfd = None
         self.rawlogfd = None
+        self.callstore = None
         self.protocol = None
         self.startbuf = ''
         self.end_request = Event()
@@ -130,6 +307,9 @@ class Resulthandler(SocketServer.BaseRequestHandler):
             else: self.startbuf += buf
         return buf
 
+    def read_struct(self, st):
+        return st.unpack(self.read(st.size))
+
     def read_any(self):
         if not self.wait_sock_or_end(): raise Disconnect()
         tmp = self.request.recv(BUFSIZE)
@@ -155,16 +335,23 @@ class Resulthandler(SocketServer.BaseRequestHandler):
         else:
             raise CuckooOperationalError("Netlog failure, unknown protocol requested.")
 
-    def handle(self):
+    def start(self):
+        """Map the connection to its analysis.
+        @return: False if there is no analysis for this client.
+        """
         ip, port = self.client_address
-        self.connect_time = datetime.datetime.now()        
+        self.connect_time = datetime.datetime.now()
         log.debug("New connection from: {0}:{1}".format(ip, port))
 
         self.storagepath = self.server.build_storage_path(ip)
-        if not self.storagepath: return
+        if not self.storagepath: return False
 
         # create all missing folders for this analysis
         self.create_folders()
+        return True
+
+    def handle(self):
+        if not self.start(): return
 
         # initialize the protocol handler class for this connection
         self.negotiate_protocol()
@@ -178,13 +365,25 @@ class Resulthandler(SocketServer.BaseRequestHandler):
         except socket.error, e:
             log.debug("socket.error: {0}".format(e))
 
+        self.close()
+
+    def close(self):
+        """Close the protocol and the log files."""
+        ip, port = self.client_address
+
         try: self.protocol.close()
         except: pass
 
+        self.flush()
         if self.logfd: self.logfd.close()
         if self.rawlogfd: self.rawlogfd.close()
+        if self.callstore: self.callstore.close()
         log.debug("Connection closed: {0}:{1}".format(ip, port))
 
+    def flush(self):
+        """Write out any data still held by the handler."""
+        pass
+
     def log_process(self, context, timestring, pid, ppid, modulepath, procname):
         log.debug("New process (pid={0}, ppid={1}, name={2}, path={3})".format(pid, ppid, procname, modulepath))
 
@@ -193,8 +392,13 @@ class Resulthandler(SocketServer.BaseRequestHandler):
             self.logfd = open(os.path.join(self.storagepath, "logs", str(pid) + '.csv'), 'w')
 
         # Netlog raw format is mandatory (postprocessing)
-        self.rawlogfd = open(os.path.join(self.storagepath, "logs", str(pid) + '.raw'), 'w')
+        rawlogpath = os.path.join(self.storagepath, "logs", str(pid) + '.raw')
+        self.rawlogfd = open(rawlogpath, 'wb')
         self.rawlogfd.write(self.startbuf)
+
+        # Columnar call store, spares processing from decoding the netlog
+        if self.server.cfg.resultserver.callstore:
+            self.callstore = CallStoreWriter(store_path(rawlogpath), timestring, pid, ppid, modulepath)
         self.pid, self.ppid, self.procname = pid, ppid, procname
 
     def log_thread(self, context, pid):
@@ -211,6 +415,9 @@ class Resulthandler(SocketServer.BaseRequestHandler):
         current_time = self.connect_time + datetime.timedelta(0,0, timediff*1000)
         timestring = logtime(current_time)
 
+        if self.callstore:
+            self.callstore.add(context, arguments)
+
         argumentstrings = ['{0}->{1}'.format(argname, r) for argname, r in arguments]
 
         if self.logfd:
@@ -229,13 +436,181 @@ class Resulthandler(SocketServer.BaseRequestHandler):
                 return False
 
 
+class BufferedResulthandler(Resulthandler):
+    """Buffered result handler.
+
+    Same protocol as Resulthandler, but the socket is drained with large
+    recv_into() calls into a ReadBuffer and messages are decoded out of it.
+    The raw netlog is written in chunks instead of once per field.
+    """
+
+    def setup(self):
+        self.rbuf = ReadBuffer()
+        Resulthandler.setup(self)
+
+    def fill(self, length=1):
+        """Receive more data, blocking until some is available.
+        @param length: number of unread bytes the caller needs.
+        """
+        self.flush()
+        if not self.wait_sock_or_end(): raise Disconnect()
+        if not self.rbuf.recv_from(self.request): raise Disconnect()
+
+    def flush(self):
+        pending = self.rbuf.pending()
+        if len(pending) and isinstance(self.protocol, NetlogParser):
+            if self.rawlogfd: self.rawlogfd.write(pending)
+            else: self.startbuf += pending.tobytes()
+        self.rbuf.release()
+
+    def read(self, length):
+        while len(self.rbuf) < length:
+            self.fill(length)
+        return self.rbuf.take(length)
+
+    def read_struct(self, st):
+        while len(self.rbuf) < st.size:
+            self.fill(st.size)
+        return self.rbuf.unpack(st)
+
+    def read_any(self):
+        if not len(self.rbuf):
+            self.fill()
+        return self.rbuf.take(len(self.rbuf))
+
+    def read_newline(self):
+        length = self.rbuf.find("\n")
+        while length < 0:
+            self.fill(len(self.rbuf) + 1)
+            length = self.rbuf.find("\n")
+        return self.rbuf.take(length)
+
+    def negotiate_protocol(self):
+        Resulthandler.negotiate_protocol(self)
+        # The protocol line itself doesn't belong to the raw log.
+        self.rbuf.release()
+
+    def log_process(self, context, timestring, pid, ppid, modulepath, procname):
+        # Move what has been read of the first message so far into
+        # startbuf, it gets written out as soon as the raw log is opened.
+        self.flush()
+        Resulthandler.log_process(self, context, timestring, pid, ppid, modulepath, procname)
+
+
+class AsyncResulthandler(BufferedResulthandler):
+    """Result handler driven by the AsyncResultserver event loop.
+
+    Received data is pushed into the buffer by AsyncConnection and decoded
+    with feed(). Reads that can't be satisfied from the buffer raise
+    Incomplete and the message is decoded again from its start once the
+    bytes it was missing arrived. The length of every field is known once
+    its prefix is read, so a message isn't decoded again on every received
+    segment of a large field.
+    """
+
+    def __init__(self, request, client_address, server):
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.storagepath = None
+        # Buffer offset of the message being decoded, and number of bytes
+        # from there needed before decoding it again.
+        self.message_start = 0
+        self.wanted = 0
+        self.setup()
+
+    def fill(self, length=1):
+        self.wanted = self.rbuf.start - self.message_start + length
+        raise Incomplete()
+
+    def feed(self):
+        """Decode all the complete messages buffered so far.
+        @return: False if the connection should be closed.
+        """
+        try:
+            while len(self.rbuf) >= self.wanted:
+                self.message_start = self.rbuf.start
+                self.wanted = 0
+                try:
+                    if not self.protocol:
+                        self.negotiate_protocol()
+                    elif not self.protocol.read_next_message():
+                        return False
+                except Incomplete:
+                    self.rbuf.start = self.message_start
+                    return True
+            return True
+        finally:
+            self.flush()
+
+
+class AsyncConnection(asyncore.dispatcher):
+    """Event loop side of a guest connection."""
+
+    def __init__(self, sock, client_address, server):
+        asyncore.dispatcher.__init__(self, sock, map=server.map)
+        self.handler = server.handler_class(sock, client_address, server)
+        self.closed = False
+
+        if not self.handler.start():
+            self.closed = True
+            self.close()
+            self.handler.finish()
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        try:
+            if not self.handler.rbuf.recv_from(self.socket):
+                self.handle_close()
+                return
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return
+            log.debug("socket.error: {0}".format(e))
+            self.handle_close()
+            return
+
+        try:
+            if not self.handler.feed():
+                self.handle_close()
+        except CuckooOperationalError as e:
+            log.error(e)
+            self.handle_close()
+
+    def handle_close(self):
+        if self.closed:
+            return
+
+        self.closed = True
+        self.close()
+        if self.handler.protocol:
+            self.handler.close()
+        self.handler.finish()
+
+
 class FileUpload(object):
     def __init__(self, handler):
         self.handler = handler
         self.upload_max_size = self.handler.server.cfg.resultserver.upload_max_size
         self.storagepath = self.handler.storagepath
+        self.fd = None
 
     def read_next_message(self):
+        if not self.fd:
+            return self.open_file()
+
+        chunk = self.handler.read_any()
+        self.fd.write(chunk)
+
+        if self.fd.tell() >= self.upload_max_size:
+            self.fd.write('... (truncated)')
+            return False
+
+        return True
+
+    def open_file(self):
         # read until newline for file path
         # e.g. shots/0001.jpg or files/9498687557/libcurl-4.dll.bin
 
@@ -255,19 +630,13 @@ class FileUpload(object):
 
         file_path = os.path.join(self.storagepath, buf.strip())
 
-        fd = open(file_path, "wb")
-        chunk = self.handler.read_any()
-        while chunk:
-            fd.write(chunk)
-
-            if fd.tell() >= self.upload_max_size:
-                fd.write('... (truncated)')
-                break
-
-            chunk = self.handler.read_any()
+        self.fd = open(file_path, "wb")
+        return True
 
-        log.debug("Uploaded file length: {0}".format(fd.tell()))
-        fd.close()
+    def close(self):
+        if self.fd:
+            log.debug("Uploaded file length: {0}".format(self.fd.tell()))
+            self.fd.close()
 
 
 class LogHandler(object):
@@ -7,7 +7,7 @@ import sys
 import time
 import shutil
 import logging
-from threading import Thread, Lock
+from threading import Thread, Condition
 
 from lib.dragon.common.constants import CUCKOO_ROOT
 from lib.dragon.common.exceptions import CuckooMachineError
@@ -20,7 +20,7 @@ from lib.dragon.common.utils import  create_folders, create_folder
 from lib.dragon.common.config import Config
 from lib.dragon.core.database import Database
 from lib.dragon.core.guest import GuestManager
-from lib.dragon.core.resultserver import Resultserver
+from lib.dragon.core.resultserver import get_resultserver
 from lib.dragon.core.sniffer import Sniffer
 from lib.dragon.core.processor import Processor
 from lib.dragon.core.reporter import Reporter
@@ -29,7 +29,15 @@ from lib.dragon.core.plugins import import_plugin, list_plugins
 log = logging.getLogger(__name__)
 
 mmanager = None
-machine_lock = Lock()
+# Guards the machines acquisition, notified when a machine is released.
+machine_lock = Condition()
+# Number of analyses started and not holding a machine yet.
+machine_waiters = 0
+
+# Tasks submitted by other processes are only noticed by polling.
+POLL_INTERVAL = 1
+# Seconds between two lookups for the tasks left by a dead scheduler.
+RECLAIM_INTERVAL = 60
 
 class AnalysisManager(Thread):
     """Analysis Manager.
@@ -50,6 +58,21 @@ class AnalysisManager(Thread):
         self.storage = ""
         self.binary = ""
 
+        # The scheduler doesn't count the machine this analysis is going to
+        # acquire as available anymore.
+        self.waiting_machine = True
+        global machine_waiters
+        with machine_lock:
+            machine_waiters += 1
+
+    def stop_waiting_machine(self):
+        """Stop being counted as waiting for a machine."""
+        global machine_waiters
+        with machine_lock:
+            if self.waiting_machine:
+                self.waiting_machine = False
+                machine_waiters -= 1
+
     def init_storage(self):
         """Initialize analysis storage folder."""
         self.storage = os.path.join(CUCKOO_ROOT,
@@ -112,23 +135,24 @@ class AnalysisManager(Thread):
         """Acquire an analysis machine from the pool of available ones."""
         machine = None
 
-        # Start a loop to acquire the a machine to run the analysis on.
-        while True:
-            machine_lock.acquire()
-            # If the user specified a specific machine ID or a platform to be
-            # used, acquire the machine accordingly.
-            machine = mmanager.acquire(machine_id=self.task.machine,
-                                       platform=self.task.platform)
-            machine_lock.release()
-
-            # If no machine is available at this moment, wait for one second
-            # and try again.
-            if not machine:
-                log.debug("Task #%d: no machine available yet", self.task.id)
-                time.sleep(1)
-            else:
-                log.info("Task #%d: acquired machine %s (label=%s)", self.task.id, machine.name, machine.label)
-                break
+        with machine_lock:
+            # Start a loop to acquire the a machine to run the analysis on.
+            while True:
+                # If the user specified a specific machine ID or a platform to
+                # be used, acquire the machine accordingly.
+                machine = mmanager.acquire(machine_id=self.task.machine,
+                                           platform=self.task.platform)
+
+                # If no machine is available at this moment, wait for one to
+                # be released and try again.
+                if not machine:
+                    log.debug("Task #%d: no machine available yet", self.task.id)
+                    machine_lock.wait()
+                else:
+                    log.info("Task #%d: acquired machine %s (label=%s)", self.task.id, machine.name, machine.label)
+                    break
+
+            self.stop_waiting_machine()
 
         return machine
 
@@ -181,7 +205,7 @@ class AnalysisManager(Thread):
         machine = self.acquire_machine()
 
         # At this point we can tell the Resultserver about it
-        Resultserver().add_task(self.task, machine)
+        get_resultserver().add_task(self.task, machine)
 
         # If enabled in the configuration, start the tcpdump instance.
         if self.cfg.sniffer.enabled:
@@ -261,15 +285,20 @@ class AnalysisManager(Thread):
             # Market the machine in the database as stopped.
             Database().guest_stop(guest_log)
 
-            try:
-                # Release the analysis machine.
-                mmanager.release(machine.label)
-            except CuckooMachineError as e:
-                log.error("Unable to release machine %s, reason %s. "
-                          "You might need to restore it manually", machine.label, e)
+            with machine_lock:
+                try:
+                    # Release the analysis machine.
+                    mmanager.release(machine.label)
+                except CuckooMachineError as e:
+                    log.error("Unable to release machine %s, reason %s. "
+                              "You might need to restore it manually", machine.label, e)
+                else:
+                    # Wake up the analyses waiting for a machine and the
+                    # scheduler.
+                    machine_lock.notify_all()
 
             # after all this, we can make the Resultserver forget about it
-            Resultserver().del_task(self.task, machine)
+            get_resultserver().del_task(self.task, machine)
 
         return succeeded
 
@@ -306,13 +335,27 @@ class AnalysisManager(Thread):
 
     def run(self):
         """Run manager thread."""
-        success = self.launch_analysis()
-        Database().complete(self.task.id, success)
+        try:
+            success = self.launch_analysis()
+        finally:
+            # The analysis might have been aborted before acquiring a machine.
+            self.stop_waiting_machine()
+            with machine_lock:
+                machine_lock.notify_all()
+
+        # Otherwise the results are left to the processing workers, failed
+        # analyses included. The task is claimed for reporting along with its
+        # completion so that they don't pick it up as well.
+        process = self.cfg.cuckoo.process_results
+        Database().complete(self.task.id, success, claim=process)
 
-        self.process_results()
+        if process:
+            # Refused results are neither processed nor reported.
+            Database().report(self.task.id, self.process_results() and success)
 
         log.debug("Releasing database task #%d with status %s", self.task.id, success)
         log.info("Task #%d: analysis procedure completed", self.task.id)
+        Database().end_session()
 
 class Scheduler:
     """Tasks Scheduler.
@@ -329,6 +372,8 @@ class Scheduler:
         self.running = True
         self.cfg = Config()
         self.db = Database()
+        # Analyses started by this scheduler.
+        self.analyses = []
 
     def initialize(self):
         """Initialize the machine manager."""
@@ -370,6 +415,8 @@ class Scheduler:
     def stop(self):
         """Stop scheduler."""
         self.running = False
+        with machine_lock:
+            machine_lock.notify_all()
         # Shutdown machine manager (used to kill machines that still alive).
         mmanager.shutdown()
 
@@ -380,21 +427,44 @@ class Scheduler:
         log.info("Waiting for analysis tasks...")
 
         # This loop runs forever.
+        reclaimed_on = 0
         while self.running:
-            time.sleep(1)
-
-            # If no machines are available, it's pointless to fetch for
-            # pending tasks. Loop over.
-            if mmanager.availables() == 0:
-                continue
-
-            # Fetch a pending analysis task.
-            task = self.db.fetch_and_process()
-
-            if task:
-                log.debug("Processing task #%s", task.id)
-
-                # Initialize the analysis manager.
-                analysis = AnalysisManager(task)
-                # Start.
-                analysis.start()
+            if self.cfg.timeouts.reclaim and time.time() - reclaimed_on > RECLAIM_INTERVAL:
+                # The tasks of the running analyses aren't stale, however
+                # long they have been waiting for a machine or running.
+                self.analyses = [analysis for analysis in self.analyses if analysis.is_alive()]
+                self.db.touch_tasks([analysis.task.id for analysis in self.analyses])
+                reclaimed = self.db.reclaim_stale_tasks(int(self.cfg.timeouts.reclaim))
+                if reclaimed:
+                    log.warning("Reclaimed %d tasks left by a dead scheduler or processing worker", reclaimed)
+                reclaimed_on = time.time()
+
+            self.dispatch()
+            self.db.end_session()
+
+            # Wait for a machine to be released, or for new tasks.
+            with machine_lock:
+                if self.running:
+                    machine_lock.wait(POLL_INTERVAL)
+
+    def dispatch(self):
+        """Start as many pending tasks as there are available machines.
+        @return: number of started tasks.
+        """
+        # Machines about to be acquired by the started analyses aren't
+        # available anymore.
+        with machine_lock:
+            available = mmanager.availables() - machine_waiters
+
+        # Claim the pending analysis tasks at once.
+        tasks = self.db.fetch_and_process_batch(available)
+        for task in tasks:
+            log.debug("Processing task #%s", task.id)
+
+            # Initialize the analysis manager.
+            analysis = AnalysisManager(task)
+            # Start.
+            analysis.start()
+            self.analyses.append(analysis)
+
+        return len(tasks)
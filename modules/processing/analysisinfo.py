@@ -15,13 +15,12 @@ log = logging.getLogger(__name__)
 
 class AnalysisInfo(Processing):
     """General information about analysis session."""
+    key = "info"
 
     def run(self):
         """Run information gathering.
         @return: information dict.
         """
-        self.key = "info"
-
         try:
             started = datetime.fromtimestamp(time.mktime(time.strptime(self.task["started_on"], "%Y-%m-%d %H:%M:%S")))
             ended = datetime.fromtimestamp(time.mktime(time.strptime(self.task["completed_on"], "%Y-%m-%d %H:%M:%S")))
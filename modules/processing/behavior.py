@@ -5,22 +5,142 @@
 import os
 import sys
 import csv
+import array
+import cPickle
 import logging
 import datetime
+import tempfile
+import threading
 import inspect
 
 from lib.dragon.common.abstracts import Processing
+from lib.dragon.common.config import Config
+from lib.dragon.common.exceptions import CuckooOperationalError
+from lib.dragon.common.objects import Argument, Call, StringTable, UniqueList
 from lib.dragon.common.utils import convert_to_printable, logtime
 from lib.dragon.common.netlog import NetlogParser
+from lib.dragon.common.callstore import CallStoreReader, store_path
 
 log = logging.getLogger(__name__)
 
-class ParseProcessLog(list):
-    """Parses process log file."""
-    
-    def __init__(self, log_path):
-        """@param log_path: log file path."""
+# Longer argument values are seldom repeated, don't keep them interned.
+INTERN_MAX_LENGTH = 128
+
+# Decoded calls of a process kept in memory, and per spilled chunk.
+CACHE_SIZE = 100000
+CACHE_CHUNK_SIZE = 1024
+
+class CallIndex(object):
+    """Lookup structures over the calls of a process, built while they are
+    parsed, to answer signatures without walking the calls again."""
+
+    def __init__(self):
+        # API name to the offsets of its calls.
+        self.calls = {}
+        # API name to category.
+        self.categories = {}
+        # API name to argument name to value to offset of its first call.
+        self.arguments = {}
+        # API name to the names of its arguments with values too long to be
+        # indexed, such as buffers, which are looked for in the calls.
+        self.long_arguments = {}
+
+    def add(self, offset, call):
+        """Index a call.
+        @param offset: call offset in the process calls.
+        @param call: call.
+        """
+        api = call["api"]
+        offsets = self.calls.get(api)
+        if offsets is None:
+            offsets = self.calls[api] = array.array("I")
+            self.categories[api] = call["category"]
+            self.arguments[api] = {}
+        offsets.append(offset)
+
+        arguments = self.arguments[api]
+        for argument in call["arguments"]:
+            if len(argument["value"]) > INTERN_MAX_LENGTH:
+                names = self.long_arguments.get(api)
+                if names is None:
+                    names = self.long_arguments[api] = set()
+                names.add(argument["name"])
+                continue
+
+            values = arguments.get(argument["name"])
+            if values is None:
+                values = arguments[argument["name"]] = {}
+            values.setdefault(argument["value"], offset)
+
+class CallCache(object):
+    """Decoded calls of a process, shared by all its consumers. The first
+    calls are kept in memory, the following ones are spilled to a temporary
+    file in chunks."""
+
+    def __init__(self, memory_limit, chunk_size=CACHE_CHUNK_SIZE):
+        """@param memory_limit: number of calls kept in memory.
+        @param chunk_size: number of calls per spilled chunk.
+        """
+        self.memory_limit = memory_limit
+        self.chunk_size = chunk_size
+        self.memory = []
+        # Calls not spilled yet and file offsets of the spilled chunks.
+        self.pending = []
+        self.chunks = []
+        self.spill = None
+        self.count = 0
+
+    def append(self, call):
+        """Add the next call.
+        @param call: call.
+        """
+        if len(self.memory) < self.memory_limit:
+            self.memory.append(call)
+        else:
+            self.pending.append(call)
+            if len(self.pending) == self.chunk_size:
+                self._spill()
+        self.count += 1
+
+    def _spill(self):
+        if not self.spill:
+            self.spill = tempfile.TemporaryFile(prefix="calls_")
+        self.spill.seek(0, os.SEEK_END)
+        self.chunks.append(self.spill.tell())
+        cPickle.dump(self.pending, self.spill, cPickle.HIGHEST_PROTOCOL)
+        self.pending = []
+
+    def read(self, offset):
+        """Read cached calls.
+        @param offset: offset of the first call.
+        @return: list of the calls from offset on, possibly not all of them,
+                 empty if none is cached yet.
+        """
+        if offset < len(self.memory):
+            return self.memory[offset:offset + self.chunk_size]
+
+        chunk, position = divmod(offset - len(self.memory), self.chunk_size)
+        if chunk < len(self.chunks):
+            self.spill.seek(self.chunks[chunk])
+            return cPickle.load(self.spill)[position:]
+        if chunk == len(self.chunks):
+            return self.pending[position:]
+        return []
+
+    def close(self):
+        if self.spill:
+            self.spill.close()
+            self.spill = None
+
+class LogDecoder(object):
+    """Decodes the calls of a process log, one pass over the log."""
+
+    def __init__(self, log_path, strings):
+        """@param log_path: log file path.
+        @param strings: StringTable shared by the analysis.
+        """
         self._log_path = log_path
+        self.strings = strings
         self.fd = None
         self.parser = None
 
@@ -28,17 +148,22 @@ class ParseProcessLog(list):
         self.process_name = None
         self.parent_id = None
         self.first_seen = None
-        self.calls = self
         self.lastcall = None
 
-        if os.path.exists(log_path) and os.stat(log_path).st_size > 0:
-            self.parse_first_and_reset()
+        # Prefer the call store written by the result server, if complete.
+        calls_path = store_path(log_path)
+        if os.path.exists(calls_path):
+            try:
+                self.parser = CallStoreReader(calls_path, self)
+            except CuckooOperationalError as e:
+                log.warning("Falling back to the netlog raw log: %s", e)
 
-    def parse_first_and_reset(self):
-        self.fd = open(self._log_path, "rb")
-        self.parser = NetlogParser(self)
+        if not self.parser:
+            self.fd = open(log_path, "rb")
+            self.parser = NetlogParser(self)
+
+        # The first message describes the process.
         self.parser.read_next_message()
-        self.fd.seek(0)
 
     def read(self, length):
         if length == 0: return b''
@@ -46,18 +171,17 @@ class ParseProcessLog(list):
         if not buf or len(buf) != length: raise EOFError()
         return buf
 
-    def __iter__(self):
-        #log.debug('iter called by this guy: {0}'.format(inspect.stack()[1]))
-        return self
-
-    def __getitem__(self, key):
-        return getattr(self, key)
+    def read_struct(self, st):
+        return st.unpack(self.read(st.size))
 
-    def __repr__(self):
-        return 'ParseProcessLog {0}'.format(self._log_path)
+    def close(self):
+        if self.fd:
+            self.fd.close()
+        else:
+            self.parser.close()
 
-    def __nonzero__(self):
-        return True
+    def __iter__(self):
+        return self
 
     def compare_calls(self, a, b):
         """Compare two calls for equality. Same implementation as before netlog.
@@ -85,7 +209,6 @@ class ParseProcessLog(list):
     def next(self):
         x = self.wait_for_lastcall()
         if not x:
-            self.fd.seek(0)
             raise StopIteration()
 
         nextcall, self.lastcall = self.lastcall, None
@@ -121,9 +244,9 @@ class ParseProcessLog(list):
     def _parse(self, row):
         """Parse log row.
         @param row: row data.
-        @return: parsed information dict.
+        @return: parsed information Call.
         """
-        call = {}
+        intern = self.strings.intern
         arguments = []
 
         try:
@@ -140,8 +263,6 @@ class ParseProcessLog(list):
         # Now walk through the remaining columns, which will contain API
         # arguments.
         for index in range(6, len(row)):
-            argument = {}
-
             # Split the argument name with its value based on the separator.
             try:                
                 (arg_name, arg_value) = row[index]
@@ -149,32 +270,158 @@ class ParseProcessLog(list):
                 log.debug("Unable to parse analysis row argument (row=%s): %s", row[index], e)
                 continue
 
-            argument["name"] = arg_name
-            argument["value"] = convert_to_printable(str(arg_value)).lstrip("\\??\\")
-            arguments.append(argument)
-
-        call["timestamp"] = timestamp
-        call["thread_id"] = str(thread_id)
-        call["category"] = category
-        call["api"] = api_name
-        call["status"] = bool(int(status_value))
+            arg_value = convert_to_printable(str(arg_value)).lstrip("\\??\\")
+            if len(arg_value) <= INTERN_MAX_LENGTH:
+                arg_value = intern(arg_value)
+            arguments.append(Argument(intern(arg_name), arg_value))
 
         if isinstance(return_value, int):
-            call["return"] = "0x%.08x" % return_value
+            return_value = "0x%.08x" % return_value
         else:
-            call["return"] = convert_to_printable(str(return_value))
+            return_value = convert_to_printable(str(return_value))
+
+        return Call(intern(timestamp),
+                    intern(str(thread_id)),
+                    intern(category),
+                    intern(api_name),
+                    bool(int(status_value)),
+                    intern(return_value),
+                    arguments)
+
+class ParseProcessLog(list):
+    """Parses process log file."""
+    
+    def __init__(self, log_path, strings=None, cache_size=CACHE_SIZE):
+        """@param log_path: log file path.
+        @param strings: StringTable shared by the analysis.
+        @param cache_size: number of decoded calls kept in memory, the others
+                           being spilled to disk, or None to decode the log
+                           again on every iteration.
+        """
+        self._log_path = log_path
+        self.strings = strings if strings is not None else StringTable()
+
+        self.process_id = None
+        self.process_name = None
+        self.parent_id = None
+        self.first_seen = None
+        self.calls = self
+
+        # Index of the calls, available once they have all been parsed.
+        self.calls_index = None
+        # Number of passes decoding the log.
+        self.decodes = 0
+
+        self.cache = None
+        self._decoder = None
+        self._index = None
+        self._lock = threading.Lock()
+
+        if os.path.exists(log_path) and os.stat(log_path).st_size > 0:
+            self._decoder = LogDecoder(log_path, self.strings)
+            self.process_id = self._decoder.process_id
+            self.process_name = self._decoder.process_name
+            self.parent_id = self._decoder.parent_id
+            self.first_seen = self._decoder.first_seen
+
+            if cache_size is None:
+                self._decoder.close()
+                self._decoder = None
+            else:
+                self.cache = CallCache(cache_size)
+
+    def __iter__(self):
+        #log.debug('iter called by this guy: {0}'.format(inspect.stack()[1]))
+        # Every iteration is independent, consumers may stop halfway.
+        if self.cache is None:
+            return self._decode()
+        return self._replay()
 
-        call["arguments"] = arguments
-        call["repeated"] = 0
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __repr__(self):
+        return 'ParseProcessLog {0}'.format(self._log_path)
+
+    def __nonzero__(self):
+        return True
 
-        return call
+    def __reduce__(self):
+        # The decoder, its cache and the lock can't be pickled, e.g. by the
+        # pickled report, the calls are pickled as a plain list instead.
+        return (list, (list(self),))
+
+    def _decode(self):
+        """Iterate over the calls decoding the whole log."""
+        if self.process_id is None:
+            return
+
+        decoder = LogDecoder(self._log_path, self.strings)
+        self.decodes += 1
+        index = CallIndex() if self.calls_index is None else None
+        try:
+            for offset, call in enumerate(decoder):
+                if index:
+                    index.add(offset, call)
+                yield call
+        finally:
+            decoder.close()
+
+        if index:
+            self.calls_index = index
+        log.debug("Decoded %s (pass %d)", self._log_path, self.decodes)
+
+    def _replay(self):
+        """Iterate over the cached calls, decoding the log as far as needed."""
+        offset = 0
+        while True:
+            with self._lock:
+                calls = self.cache.read(offset)
+                if not calls:
+                    calls = self._decode_next()
+                    if not calls:
+                        return
+
+            for call in calls:
+                yield call
+            offset += len(calls)
+
+    def _decode_next(self):
+        """Decode and cache the next call.
+        @return: list of the decoded call, empty at the end of the log.
+        """
+        if not self._decoder:
+            return []
+
+        if not self._index:
+            self.decodes += 1
+            self._index = CallIndex()
+
+        try:
+            call = self._decoder.next()
+        except StopIteration:
+            self._decoder.close()
+            self._decoder = None
+            self.calls_index = self._index
+            log.debug("Decoded %s (pass %d, %d calls cached)",
+                      self._log_path, self.decodes, self.cache.count)
+            return []
+
+        self._index.add(self.cache.count, call)
+        self.cache.append(call)
+        return [call]
 
 class Processes:
     """Processes analyzer."""
 
-    def __init__(self, logs_path):
-        """@param  logs_path: logs path."""
+    def __init__(self, logs_path, strings=None, cache_size=CACHE_SIZE):
+        """@param  logs_path: logs path.
+        @param strings: StringTable shared by the analysis.
+        @param cache_size: decoded calls kept in memory per process.
+        """
         self._logs_path = logs_path
+        self.strings = strings if strings is not None else StringTable()
+        self.cache_size = cache_size
 
     def run(self):
         """Run analysis.
@@ -201,7 +448,7 @@ class Processes:
                 continue
 
             # Invoke parsing of current log file.
-            current_log = ParseProcessLog(file_path)
+            current_log = ParseProcessLog(file_path, self.strings, self.cache_size)
             if current_log.process_id == None: continue
 
             # If the current log actually contains any data, add its data to
@@ -231,9 +478,9 @@ class Summary:
         """Get registry keys, mutexes and files.
         @return: Summary of keys, mutexes and files.
         """
-        keys = []
-        mutexes = []
-        files = []
+        keys = UniqueList()
+        mutexes = UniqueList()
+        files = UniqueList()
 
         def _check_registry(handles, registry, subkey, handle):
             for known_handle in handles:
@@ -286,8 +533,8 @@ class Summary:
                             handle = int(argument["value"], 16)
 
                     name = _check_registry(handles, registry, subkey, handle)
-                    if name and name not in keys:
-                        keys.append(name)
+                    if name:
+                        keys.add(name)
                 elif call["api"].startswith("RegCloseKey"):
                     handle = 0
 
@@ -303,8 +550,7 @@ class Summary:
                             if not value:
                                 continue
 
-                            if value not in files:
-                                files.append(value)
+                            files.add(value)
 
                 elif call["category"] == "synchronization":
                     for argument in call["arguments"]:
@@ -313,8 +559,7 @@ class Summary:
                             if not value:
                                 continue
 
-                            if value not in mutexes:
-                                mutexes.append(value)
+                            mutexes.add(value)
 
         return {"files": files, "keys": keys, "mutexes": mutexes}
 
@@ -398,15 +643,21 @@ class ProcessTree:
 
 class BehaviorAnalysis(Processing):
     """Behavior Analyzer."""
+    key = "behavior"
 
     def run(self):
         """Run analysis.
         @return: results dict.
         """
-        self.key = "behavior"
+        cfg = Config()
+        cache_size = None
+        if cfg.processing.parse_once:
+            cache_size = cfg.processing.calls_in_memory
+            if cache_size is None:
+                cache_size = CACHE_SIZE
 
         behavior = {}
-        behavior["processes"]   = Processes(self.logs_path).run()
+        behavior["processes"]   = Processes(self.logs_path, StringTable(), cache_size).run()
         behavior["processtree"] = ProcessTree(behavior["processes"]).run()
         behavior["summary"]     = Summary(behavior["processes"]).run()
 
@@ -7,14 +7,18 @@ import re
 import sys
 import socket
 import logging
+import threading
 from urlparse import urlunparse
 
 from lib.dragon.common.utils import convert_to_printable
 from lib.dragon.common.abstracts import Processing
 from lib.dragon.common.config import Config
-from lib.dragon.common.dns import resolve
-from lib.dragon.common.irc import ircMessage
-from lib.dragon.common.objects import File
+from lib.dragon.common.dns import get_resolver, DNS_CONCURRENCY, DNS_CACHE_TTL
+from lib.dragon.common.irc import IRCParser
+from lib.dragon.common.objects import File, UniqueList
+from lib.dragon.common.constants import CUCKOO_ROOT
+from lib.dragon.common.exceptions import CuckooOperationalError
+from lib.dragon.common import pcapscan
 
 try:
     import dpkt
@@ -22,6 +26,225 @@ try:
 except ImportError:
     IS_DPKT = False
 
+# Out of order segments kept per TCP stream while waiting for the missing ones.
+MAX_PENDING_SEGMENTS = 64
+# Default number of bytes reassembled per TCP stream direction.
+STREAM_SIZE_LIMIT = 1024 * 1024
+# Default number of bytes kept by all the open TCP streams together.
+STREAMS_SIZE_LIMIT = 64 * 1024 * 1024
+# Client lines, and bytes, looked at to tell whether a TCP flow is IRC. The
+# server side is only dissected for IRC, it isn't kept for the other flows.
+IRC_DETECTION_LINES = 2
+IRC_DETECTION_SIZE = 4096
+
+# Server replies left out of the IRC results.
+IRC_SERVER_FILTERS = ("266",)
+
+# Domains never reported.
+DOMAIN_FILTERS = re.compile(r".*\.windows\.com$|.*\.in\-addr\.arpa$")
+DOMAINS_WHITELIST = os.path.join("data", "whitelist", "domains.txt")
+
+# Whitelists by path, loaded once.
+_whitelists = {}
+_whitelists_lock = threading.Lock()
+
+def load_whitelist(path):
+    """Load a domain whitelist, one domain per line.
+    @param path: whitelist path, relative to the Cuckoo root.
+    @return: frozenset of lowercase domains, empty if the file is missing.
+    """
+    path = os.path.join(CUCKOO_ROOT, path)
+    with _whitelists_lock:
+        if path not in _whitelists:
+            domains = set()
+            try:
+                with open(path, "r") as whitelist:
+                    for line in whitelist:
+                        line = line.strip().lower().strip(".")
+                        if line and not line.startswith("#"):
+                            domains.add(line)
+            except (IOError, OSError) as e:
+                logging.getLogger("Processing.Pcap").warning("Unable to read the domain whitelist %s: %s", path, e)
+            _whitelists[path] = frozenset(domains)
+        return _whitelists[path]
+
+def is_whitelisted(domain, whitelist):
+    """Check whether a domain or one of its parents is whitelisted.
+    @param domain: domain name.
+    @param whitelist: set of lowercase domains.
+    @return: boolean.
+    """
+    labels = domain.lower().strip(".").split(".")
+    for index in xrange(len(labels)):
+        if ".".join(labels[index:]) in whitelist:
+            return True
+    return False
+
+class StreamBudget(object):
+    """Number of bytes the TCP streams can still keep, shared by all the
+    streams of a capture."""
+
+    def __init__(self, size):
+        """@param size: number of bytes."""
+        self.available = size
+
+class TcpStream(object):
+    """One direction of a TCP connection, reassembled in sequence order.
+
+    Only the first bytes of the stream are kept, up to the size limit and
+    within the budget shared with the other streams, and a bounded number
+    of out of order segments are buffered.
+    """
+
+    def __init__(self, size_limit=STREAM_SIZE_LIMIT, budget=None):
+        """@param size_limit: number of bytes kept.
+        @param budget: StreamBudget the kept bytes are taken from.
+        """
+        self.size_limit = size_limit
+        self.budget = budget
+        # Next expected sequence number.
+        self.seq = None
+        self.chunks = []
+        self.size = 0
+        self.pending = {}
+        self.truncated = False
+        self.released = False
+        self.fin = False
+
+    def _offset(self, seq):
+        # Distance from the expected sequence number, across wrap arounds.
+        return ((seq - self.seq + 0x80000000) & 0xffffffff) - 0x80000000
+
+    def _take(self, size):
+        if self.budget:
+            self.budget.available -= size
+
+    def _append(self, data):
+        self.seq = (self.seq + len(data)) & 0xffffffff
+        room = self.size_limit - self.size
+        if self.budget:
+            room = min(room, self.budget.available)
+        if len(data) > room:
+            data = data[:max(room, 0)]
+            self.truncated = True
+        if data:
+            self.chunks.append(data)
+            self.size += len(data)
+            self._take(len(data))
+
+    def add(self, seq, data, syn=False):
+        """Add a segment.
+        @param seq: sequence number.
+        @param data: payload.
+        @param syn: whether the SYN flag is set.
+        """
+        if self.released:
+            return
+        if self.seq is None:
+            # The SYN takes a sequence number. Without it the capture began
+            # in the middle of the connection.
+            self.seq = (seq + 1) & 0xffffffff if syn else seq
+        if not data:
+            return
+
+        offset = self._offset(seq)
+        if offset > 0:
+            if seq in self.pending:
+                return
+            if len(self.pending) < MAX_PENDING_SEGMENTS and \
+               (not self.budget or len(data) <= self.budget.available):
+                self.pending[seq] = data
+                self._take(len(data))
+            else:
+                self.truncated = True
+            return
+
+        # Skip the retransmitted bytes.
+        if -offset < len(data):
+            self._append(data[-offset:])
+
+        # Append the pending segments which became contiguous.
+        while self.pending:
+            ready = [pending for pending in self.pending if self._offset(pending) <= 0]
+            if not ready:
+                break
+            for pending in sorted(ready, key=self._offset):
+                data = self.pending.pop(pending)
+                self._take(-len(data))
+                offset = self._offset(pending)
+                if -offset < len(data):
+                    self._append(data[-offset:])
+
+    def release(self):
+        """Drop the kept bytes, giving them back to the budget, and stop
+        keeping the following ones."""
+        self._take(-self.size - sum(len(data) for data in self.pending.itervalues()))
+        self.chunks = []
+        self.pending = {}
+        self.size = 0
+        self.released = True
+
+    @property
+    def data(self):
+        """Reassembled bytes."""
+        return "".join(self.chunks)
+
+class Flow(object):
+    """Traffic between two endpoints over TCP or UDP.
+
+    Endpoints are ordered, the source is the one who initiated the flow.
+    """
+
+    def __init__(self, src, sport, dst, dport, ts, stream_size=None, budget=None):
+        """@param src: source address.
+        @param sport: source port.
+        @param dst: destination address.
+        @param dport: destination port.
+        @param ts: timestamp of the first packet.
+        @param stream_size: TCP streams size limit, None for UDP flows.
+        @param budget: StreamBudget shared by the TCP streams.
+        """
+        self.key = (src, sport, dst, dport)
+        self.src = src
+        self.sport = sport
+        self.dst = dst
+        self.dport = dport
+        self.packets = 0
+        self.bytes = 0
+        self.first_seen = ts
+        self.last_seen = ts
+        self.closed = False
+        # Whether the client talks IRC, None until known, and the parser of
+        # the client lines with the number of chunks and lines it was fed.
+        self.irc = None
+        self.irc_parser = None
+        self.irc_chunks = 0
+        self.irc_lines = 0
+        if stream_size is None:
+            self.streams = None
+        else:
+            # Source to destination and destination to source.
+            self.streams = (TcpStream(stream_size, budget), TcpStream(stream_size, budget))
+
+    def update(self, ts, size):
+        """Count a packet.
+        @param ts: timestamp.
+        @param size: payload size.
+        """
+        self.packets += 1
+        self.bytes += size
+        self.last_seen = ts
+
+    def to_dict(self):
+        return {"src" : self.src,
+                "sport" : self.sport,
+                "dst" : self.dst,
+                "dport" : self.dport,
+                "packets" : self.packets,
+                "bytes" : self.bytes,
+                "first_seen" : self.first_seen,
+                "last_seen" : self.last_seen}
+
 class Pcap:
     """Reads network data from PCAP file."""
 
@@ -30,23 +253,30 @@ class Pcap:
         @param filepath: path to PCAP file
         """
         self.filepath = filepath
+        # Bytes of TCP streams given to the dissectors, per direction.
+        self.stream_size = int(Config().processing.stream_size_limit or STREAM_SIZE_LIMIT)
+        # Bytes of all the open TCP streams.
+        self.stream_budget = StreamBudget(int(Config().processing.streams_size_limit or STREAMS_SIZE_LIMIT))
+        self.whitelist = load_whitelist(Config().processing.domains_whitelist or DOMAINS_WHITELIST)
 
         # List containing all IP addresses involved in the analysis.
-        self.unique_hosts = []
+        self.unique_hosts = UniqueList()
         # List of unique domains.
         self.unique_domains = []
-        # List containing all TCP packets.
+        self.domains = set()
+        # List containing all TCP flows.
         self.tcp_connections = []
-        # List containing all UDP packets.
+        # List containing all UDP flows.
         self.udp_connections = []
+        # Flows by source and destination address and port.
+        self.tcp_flows = {}
+        self.udp_flows = {}
         # List containing all HTTP requests.
         self.http_requests = []
         # List containing all DNS requests.
         self.dns_requests = []
         # List containing all SMTP requests.
         self.smtp_requests = []
-        # Reconstruncted SMTP flow.
-        self.smtp_flow = {}
         # List containing all IRC requests.
         self.irc_requests = []
         # Dictionary containing all the results of this processing.
@@ -57,73 +287,69 @@ class Pcap:
         @param connection: connection data
         """
         try:
-            if connection["src"] not in self.unique_hosts:
-                self.unique_hosts.append(convert_to_printable(connection["src"]))
-            if connection["dst"] not in self.unique_hosts:
-                self.unique_hosts.append(convert_to_printable(connection["dst"]))
+            self.unique_hosts.add(convert_to_printable(connection["src"]))
+            self.unique_hosts.add(convert_to_printable(connection["dst"]))
         except Exception:
             return False
 
         return True
 
-    def _dns_gethostbyname(self, name):
-        """Get host by name wrapper.
-        @param name: hostname.
-        @return: IP address or blank
-        """
-        if Config().processing.resolve_dns:
-            ip = resolve(name)
-        else:
-            ip = ""
-        return ip
+    def _resolve_domains(self):
+        """Resolves the unique domains, all at once."""
+        cfg = Config().processing
+        if not cfg.resolve_dns or not self.unique_domains:
+            return
+
+        resolver = get_resolver(server=cfg.dns_server or None,
+                                concurrency=int(cfg.dns_concurrency or DNS_CONCURRENCY),
+                                ttl=int(cfg.dns_cache_ttl or DNS_CACHE_TTL))
+        ips = resolver.resolve_many([entry["domain"] for entry in self.unique_domains])
+        for entry in self.unique_domains:
+            entry["ip"] = ips[entry["domain"]]
 
     def _add_domain(self, domain):
         """Add a domain to unique list.
         @param domain: domain name.
         """
-        filters = [
-            ".*\\.windows\\.com$",
-            ".*\\.in\\-addr\\.arpa$"
-        ]
-
-        regexps = [re.compile(filter) for filter in filters]
-        for regexp in regexps:
-            if regexp.match(domain):
-                return
+        if domain in self.domains:
+            return
+        self.domains.add(domain)
 
-        for entry in self.unique_domains:
-            if entry["domain"] == domain:
-                return
+        if DOMAIN_FILTERS.match(domain) or is_whitelisted(domain, self.whitelist):
+            return
 
-        self.unique_domains.append({"domain" : domain,
-                                    "ip" : self._dns_gethostbyname(domain)})
+        # Resolved once the whole capture is read.
+        self.unique_domains.append({"domain" : domain, "ip" : ""})
 
-    def _check_http(self, tcpdata):
-        """Checks for HTTP traffic.
-        @param tcpdata: TCP data flow.
+    def _add_http(self, tcpdata, dport):
+        """Adds the HTTP requests of a TCP stream.
+        @param tcpdata: TCP stream data.
+        @param dport: destination port.
         """
-        try:
-            r = dpkt.http.Request()
-            r.method, r.version, r.uri = None, None, None
-            r.unpack(tcpdata)
-        except dpkt.dpkt.UnpackError:
-            if r.method != None or r.version != None or r.uri != None:
-                return True
-            return False
+        while tcpdata:
+            http = dpkt.http.Request()
+            http.method, http.version, http.uri = None, None, None
+            try:
+                http.unpack(tcpdata)
+                rest = http.data
+            except dpkt.dpkt.UnpackError:
+                if http.method is None and http.version is None and http.uri is None:
+                    return False
+                # Request cut by the end of the capture or the size limit.
+                rest = ""
+
+            if not self._add_http_request(http, tcpdata[:len(tcpdata) - len(rest)], dport):
+                return False
+            tcpdata = rest
 
         return True
 
-    def _add_http(self, tcpdata, dport):
-        """Adds an HTTP flow.
-        @param tcpdata: TCP data flow.
+    def _add_http_request(self, http, data, dport):
+        """Adds an HTTP request.
+        @param http: parsed request.
+        @param data: request data.
         @param dport: destination port.
         """
-        try:
-            http = dpkt.http.Request()
-            http.unpack(tcpdata)
-        except dpkt.dpkt.UnpackError:
-            pass
-
         try:
             entry = {}
 
@@ -133,7 +359,7 @@ class Pcap:
                 entry["host"] = ""
 
             entry["port"] = dport
-            entry["data"] = convert_to_printable(tcpdata)
+            entry["data"] = convert_to_printable(data)
             entry["uri"] = convert_to_printable(urlunparse(("http", entry["host"], http.uri, None, None, None)))
             entry["body"] = convert_to_printable(http.body)
             entry["path"] = convert_to_printable(http.uri)
@@ -248,76 +474,207 @@ class Pcap:
 
         return True
 
-    def _reassemble_smtp(self, conn, data):
-        """Reassemble a SMTP flow.
-        @param conn: connection dict.
-        @param data: raw data.
+    def _tcp_dissect(self, flow):
+        """Runs all TCP dissectors on the reassembled streams of a flow.
+        @param flow: TCP flow.
         """
-        if conn["dst"] in self.smtp_flow:
-            self.smtp_flow[conn["dst"]] += data
-        else:
-            self.smtp_flow[conn["dst"]] = data
-
-    def _process_smtp(self):
-        """Process SMTP flow."""
-        for conn, data in self.smtp_flow.iteritems():
-            # Detect new SMTP flow.
-            if data.startswith("EHLO") or data.startswith("HELO"):
-                self.smtp_requests.append({"dst": conn, "raw": data})
-
-    def _tcp_dissect(self, conn, data):
-        """Runs all TCP dissectors.
-        @param conn: connection.
-        @param data: payload data.
-        """
-        if self._check_http(data):
-            self._add_http(data, conn["dport"])
+        client = flow.streams[0].data
+        if not client:
+            return
+
+        self._add_http(client, flow.dport)
         # SMTP.
-        if conn["dport"] == 25:
-            self._reassemble_smtp(conn, data)
+        if flow.dport == 25 and (client.startswith("EHLO") or client.startswith("HELO")):
+            self.smtp_requests.append({"dst": flow.dst, "raw": client})
         # IRC.
-        if self._check_irc(data):
-            self._add_irc(data)
+        self._add_irc(flow)
 
-    def _udp_dissect(self, conn, data):
+    def _udp_dissect(self, flow, data):
         """Runs all UDP dissectors.
-        @param conn: connection.
+        @param flow: UDP flow.
         @param data: payload data.
         """
-        if conn["dport"] == 53 or conn["sport"] == 53:
+        if flow.dport == 53 or flow.sport == 53:
             if self._check_dns(data):
                 self._add_dns(data)
 
-    def _check_irc(self, tcpdata):
+    def _new_flow(self, flows, connections, src, sport, dst, dport, ts, stream_size=None):
+        """Creates a flow.
+        @param flows: flows table.
+        @param connections: flows list.
+        @return: Flow.
         """
-        Checks for IRC traffic.
-        @param tcpdata: tcp data flow
+        flow = Flow(src, sport, dst, dport, ts, stream_size, self.stream_budget)
+        flows[flow.key] = flow
+        connections.append(flow)
+        self._add_hosts({"src": src, "dst": dst})
+        return flow
+
+    def _close_flow(self, flow):
+        """Dissects the streams of a TCP flow and releases them.
+        @param flow: TCP flow.
         """
-        try:
-            req = ircMessage()
-        except Exception, why:
-            return False
-
-        return req.isthereIRC(tcpdata)
-
-    def _add_irc(self, tcpdata):
+        if flow.closed:
+            return
+        flow.closed = True
+        self._tcp_dissect(flow)
+        for stream in flow.streams:
+            stream.release()
+        flow.streams = None
+
+    def _tcp_packet(self, ts, src, dst, tcp):
+        """Adds a TCP segment to its flow.
+        @param ts: timestamp.
+        @param src: source address.
+        @param dst: destination address.
+        @param tcp: TCP segment.
+        """
+        syn = tcp.flags & dpkt.tcp.TH_SYN
+        ack = tcp.flags & dpkt.tcp.TH_ACK
+
+        flow = self.tcp_flows.get((src, tcp.sport, dst, tcp.dport))
+        forward = True
+        if flow is None:
+            flow = self.tcp_flows.get((dst, tcp.dport, src, tcp.sport))
+            forward = False
+
+        # A new connection, possibly reusing the ports of a closed one.
+        if flow is None or (flow.closed and syn and not ack):
+            if flow is not None:
+                del self.tcp_flows[flow.key]
+            if syn and ack:
+                # The capture began after the SYN, this is the reply.
+                flow = self._new_flow(self.tcp_flows, self.tcp_connections,
+                                      dst, tcp.dport, src, tcp.sport, ts, self.stream_size)
+                forward = False
+            else:
+                flow = self._new_flow(self.tcp_flows, self.tcp_connections,
+                                      src, tcp.sport, dst, tcp.dport, ts, self.stream_size)
+                forward = True
+
+        flow.update(ts, len(tcp.data))
+        if flow.closed:
+            return
+
+        stream = flow.streams[0 if forward else 1]
+        stream.add(tcp.seq, tcp.data, syn)
+        if forward and tcp.data and flow.irc is None:
+            self._check_irc(flow)
+
+        if tcp.flags & dpkt.tcp.TH_RST:
+            self._close_flow(flow)
+        elif tcp.flags & dpkt.tcp.TH_FIN:
+            stream.fin = True
+            if flow.streams[0].fin and flow.streams[1].fin:
+                self._close_flow(flow)
+
+    def _udp_packet(self, ts, src, dst, udp):
+        """Adds a UDP datagram to its flow and dissects it.
+        @param ts: timestamp.
+        @param src: source address.
+        @param dst: destination address.
+        @param udp: UDP datagram.
         """
-        Adds an IRC communication.
-        @param tcpdata: TCP data in flow
-        @param dport: destination port
+        flow = self.udp_flows.get((src, udp.sport, dst, udp.dport))
+        if flow is None:
+            flow = self.udp_flows.get((dst, udp.dport, src, udp.sport))
+        if flow is None:
+            flow = self._new_flow(self.udp_flows, self.udp_connections,
+                                  src, udp.sport, dst, udp.dport, ts)
+
+        flow.update(ts, len(udp.data))
+        if udp.data:
+            self._udp_dissect(flow, udp.data)
+
+    def _check_irc(self, flow):
+        """Tell whether a TCP flow is IRC from the first bytes of its client
+        stream, the server stream of the other flows is released.
+        @param flow: TCP flow.
         """
+        client = flow.streams[0]
+        if flow.irc_parser is None:
+            flow.irc_parser = IRCParser()
+
+        # Only the chunks added since the previous packet are parsed.
+        for chunk in client.chunks[flow.irc_chunks:]:
+            flow.irc_parser.feed(chunk)
+            flow.irc_lines += chunk.count("\n")
+        flow.irc_chunks = len(client.chunks)
+
+        if flow.irc_parser.messages:
+            flow.irc = True
+        elif flow.irc_lines >= IRC_DETECTION_LINES or client.size >= IRC_DETECTION_SIZE or client.truncated:
+            flow.irc = False
+            flow.streams[1].release()
+        else:
+            return
+        flow.irc_parser = None
 
-        try:
-            reqc = ircMessage()
-            reqs = ircMessage()
-            filters_sc = ['266']
-            filters_cc = []
-            self.irc_requests = self.irc_requests + reqc.getClientMessages(tcpdata) + reqs.getServerMessagesFilter(tcpdata,filters_sc)
-        except Exception, why:
+    def _add_irc(self, flow):
+        """Adds the IRC messages of a TCP flow.
+        @param flow: TCP flow.
+        @return: whether the flow is IRC.
+        """
+        client = IRCParser()
+        for chunk in flow.streams[0].chunks:
+            client.feed(chunk)
+        if not client.close():
             return False
-
+        self.irc_requests.extend(client.messages)
+
+        # Not kept when the first client lines weren't IRC.
+        if not flow.streams[1].released:
+            server = IRCParser(server=True, filters=IRC_SERVER_FILTERS)
+            for chunk in flow.streams[1].chunks:
+                server.feed(chunk)
+            self.irc_requests.extend(server.close())
         return True
 
+    def _read_frame(self, ts, buf):
+        """Decodes an Ethernet frame with dpkt and processes its packet.
+        @param ts: timestamp.
+        @param buf: frame.
+        """
+        try:
+            eth = dpkt.ethernet.Ethernet(buf)
+            ip = eth.data
+
+            if isinstance(ip, dpkt.ip.IP):
+                src = socket.inet_ntoa(ip.src)
+                dst = socket.inet_ntoa(ip.dst)
+            elif isinstance(ip, dpkt.ip6.IP6):
+                src = socket.inet_ntop(socket.AF_INET6, ip.src)
+                dst = socket.inet_ntop(socket.AF_INET6, ip.dst)
+            else:
+                return
+
+            # The hosts of TCP and UDP packets are added with their flow.
+            if ip.p == dpkt.ip.IP_PROTO_TCP:
+                self._tcp_packet(ts, src, dst, ip.data)
+            elif ip.p == dpkt.ip.IP_PROTO_UDP:
+                self._udp_packet(ts, src, dst, ip.data)
+            else:
+                self._add_hosts({"src": src, "dst": dst})
+        except AttributeError:
+            pass
+        except dpkt.dpkt.NeedData:
+            pass
+
+    def _read_scanner(self, scanner):
+        """Processes the packets decoded in bulk by the scanner, only the
+        frames it can't decode go through dpkt.
+        @param scanner: PcapScanner.
+        """
+        for ts, kind, src, dst, value in scanner:
+            if kind == pcapscan.TCP:
+                self._tcp_packet(ts, src, dst, value)
+            elif kind == pcapscan.UDP:
+                self._udp_packet(ts, src, dst, value)
+            elif kind == pcapscan.IP:
+                self._add_hosts({"src": src, "dst": dst})
+            else:
+                self._read_frame(ts, value)
+
     def run(self):
         """Process PCAP.
         @return: dict with network analysis data.
@@ -343,65 +700,44 @@ class Pcap:
             return None
 
         try:
-            pcap = dpkt.pcap.Reader(file)
-        except dpkt.dpkt.NeedData:
-            log.error("Unable to read PCAP file at path \"%s\"." % self.filepath)
-            return None
-        except ValueError:
-            log.error("Unable to read PCAP file at path \"%s\". File is corrupted or wrong format." % self.filepath)
-            return None
-
-        for ts, buf in pcap:
             try:
-                eth = dpkt.ethernet.Ethernet(buf)
-                ip = eth.data
-
-                connection = {}
-                if isinstance(ip, dpkt.ip.IP):
-                    connection["src"] = socket.inet_ntoa(ip.src)
-                    connection["dst"] = socket.inet_ntoa(ip.dst)
-                elif isinstance(ip, dpkt.ip6.IP6):
-                    connection["src"] = socket.inet_ntop(socket.AF_INET6, ip.src)
-                    connection["dst"] = socket.inet_ntop(socket.AF_INET6, ip.dst)
-
-                self._add_hosts(connection)
-
-                if ip.p == dpkt.ip.IP_PROTO_TCP:
-
-                    tcp = ip.data
-
-                    if len(tcp.data) > 0:
-                        connection["sport"] = tcp.sport
-                        connection["dport"] = tcp.dport
-                        self._tcp_dissect(connection, tcp.data)
-                        self.tcp_connections.append(connection)
-                    else:
-                        continue
-                elif ip.p == dpkt.ip.IP_PROTO_UDP:
-                    udp = ip.data
-
-                    if len(udp.data) > 0:
-                        connection["sport"] = udp.sport
-                        connection["dport"] = udp.dport
-                        self._udp_dissect(connection, udp.data)
-                        self.udp_connections.append(connection)
-                #elif ip.p == dpkt.ip.IP_PROTO_ICMP:
-                    #icmp = ip.data
-            except AttributeError:
-                continue
+                pcap = dpkt.pcap.Reader(file)
             except dpkt.dpkt.NeedData:
-                continue
+                log.error("Unable to read PCAP file at path \"%s\"." % self.filepath)
+                return None
+            except ValueError:
+                log.error("Unable to read PCAP file at path \"%s\". File is corrupted or wrong format." % self.filepath)
+                return None
+
+            scanner = None
+            if pcapscan.HAVE_NUMPY:
+                try:
+                    scanner = pcapscan.PcapScanner(self.filepath)
+                except CuckooOperationalError as e:
+                    log.debug("Reading the PCAP file with dpkt only: %s", e)
+
+            if scanner:
+                try:
+                    self._read_scanner(scanner)
+                finally:
+                    scanner.close()
+            else:
+                for ts, buf in pcap:
+                    self._read_frame(ts, buf)
+        finally:
+            file.close()
 
-        file.close()
+        # Dissect the connections still open at the end of the capture.
+        for flow in self.tcp_connections:
+            self._close_flow(flow)
 
-        # Post processors for reconstructed flows.
-        self._process_smtp()
+        self._resolve_domains()
 
         # Build results dict.
         self.results["hosts"] = self.unique_hosts
         self.results["domains"] = self.unique_domains
-        self.results["tcp"] = self.tcp_connections
-        self.results["udp"] = self.udp_connections
+        self.results["tcp"] = [flow.to_dict() for flow in self.tcp_connections]
+        self.results["udp"] = [flow.to_dict() for flow in self.udp_connections]
         self.results["http"] = self.http_requests
         self.results["dns"] = self.dns_requests
         self.results["smtp"] = self.smtp_requests
@@ -411,10 +747,9 @@ class Pcap:
 
 class NetworkAnalysis(Processing):
     """Network analysis."""
+    key = "network"
 
     def run(self):
-        self.key = "network"
-
         results = Pcap(self.pcap_path).run()
 
         # Save PCAP file hash.
@@ -7,13 +7,12 @@ from lib.dragon.common.abstracts import Processing
 
 class TargetInfo(Processing):
     """General information about a file."""
+    key = "target"
 
     def run(self):
         """Run file information gathering.
         @return: information dict.
         """
-        self.key = "target"
-
         target_info = {"category" : self.task["category"]}
 
         if self.task["category"] == "file":
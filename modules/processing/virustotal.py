@@ -17,12 +17,12 @@ VIRUSTOTAL_KEY = "a0283a2c3d55728300d064874239b5346fb991317e8449fe43c902879d7580
 
 class VirusTotal(Processing):
     """Gets antivirus signatures from VirusTotal.com"""
+    key = "virustotal"
 
     def run(self):
         """Runs VirusTotal processing
         @return: full VirusTotal report.
         """
-        self.key = "virustotal"
         virustotal = []
 
         if not VIRUSTOTAL_KEY:
@@ -0,0 +1,32 @@
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import os
+import cPickle
+
+from lib.dragon.common.abstracts import Report
+from lib.dragon.common.binreport import BinaryReportWriter
+from lib.dragon.common.exceptions import CuckooReportError
+
+class BinaryDump(Report):
+    """Saves analysis results in the binary report format, whose sections
+    can be loaded on their own."""
+
+    def run(self, results):
+        """Writes report.
+        @param results: Cuckoo results dict.
+        @raise CuckooReportError: if fails to write report.
+        """
+        path = os.path.join(self.reports_path, "report.bin")
+        try:
+            writer = BinaryReportWriter(path)
+            try:
+                writer.write(results)
+            except:
+                # Not left with a header telling it's complete.
+                writer.abort()
+                raise
+            writer.close()
+        except (cPickle.PickleError, TypeError, IOError, OSError) as e:
+            raise CuckooReportError("Failed to generate binary report: %s" % e)
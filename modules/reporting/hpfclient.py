@@ -6,6 +6,7 @@ import json
 
 from lib.dragon.common.abstracts import Report
 from lib.dragon.common.exceptions import CuckooDependencyError, CuckooReportError
+from lib.dragon.common.objects import json_default
 
 try:
 	import lib.hpfeeds as hpfeeds
@@ -22,7 +23,7 @@ class HPFClient(Report):
         """
 		try:
 			hpc = hpfeeds.HPC(self.options["host"], self.options["port"], self.options["ident"], self.options["secret"], timeout=60)
-			hpc.publish(self.options["channel"], json.dumps(results, sort_keys=False, indent=4))
+			hpc.publish(self.options["channel"], json.dumps(results, sort_keys=False, indent=4, default=json_default))
 			hpc.close()
 		except hpfeeds.FeedException as e:
 			raise CuckooReportError("Failed to publish on HPFeeds channel: %s" % e)
\ No newline at end of file
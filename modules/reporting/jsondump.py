@@ -3,11 +3,12 @@
 # See the file 'docs/LICENSE' for copying permission.
 
 import os
+import gzip
 import json
-import codecs
 
 from lib.dragon.common.abstracts import Report
 from lib.dragon.common.exceptions import CuckooReportError
+from lib.dragon.common.jsonwriter import JsonWriter
 
 class JsonDump(Report):
     """Saves analysis results in JSON format."""
@@ -17,9 +18,29 @@ class JsonDump(Report):
         @param results: Cuckoo results dict.
         @raise CuckooReportError: if fails to write report.
         """
+        options = self.options or {}
+        indent = None if options.get("compact") else 4
+
         try:
-            report = codecs.open(os.path.join(self.reports_path, "report.json"), "w", "utf-8")
-            json.dump(results, report, sort_keys=False, indent=4)
-            report.close()
-        except (UnicodeError, TypeError, IOError) as e:
+            if options.get("compress"):
+                file_name = "report.json.gz"
+                report = gzip.open(os.path.join(self.reports_path, file_name), "wb")
+            else:
+                file_name = "report.json"
+                report = open(os.path.join(self.reports_path, file_name), "wb")
+
+            writer = JsonWriter(report, indent=indent)
+            try:
+                writer.write(results)
+            finally:
+                report.close()
+
+            # Offsets of the top level sections, in the uncompressed report,
+            # for their retrieval without parsing the whole report.
+            index = {"file": file_name, "sections": {}}
+            for key, (offset, length) in writer.sections.iteritems():
+                index["sections"][key] = {"offset": offset, "length": length}
+            with open(os.path.join(self.reports_path, "report.index.json"), "wb") as fd:
+                json.dump(index, fd, sort_keys=True, indent=4)
+        except (UnicodeError, TypeError, ValueError, IOError) as e:
             raise CuckooReportError("Failed to generate JSON report: %s" % e)
@@ -3,18 +3,95 @@
 # See the file 'docs/LICENSE' for copying permission.
 
 import os
+import Queue
+import threading
 
 from lib.dragon.common.abstracts import Report
 from lib.dragon.common.exceptions import CuckooDependencyError, CuckooReportError
-from lib.dragon.common.objects import File
+from lib.dragon.common.objects import File, Record
 
 try:
-    from pymongo.connection import Connection
-    from pymongo.errors import ConnectionFailure, InvalidDocument
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError, ConnectionFailure, InvalidDocument
+    from bson.objectid import ObjectId
     from gridfs import GridFS
 except ImportError:
     raise CuckooDependencyError("Unable to import pymongo")
 
+# Clients by process, host and port. A client holds a pool of connections and
+# is thread safe, but must not be shared across a fork.
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(host, port):
+    """Get the pooled client of a MongoDB server.
+    @param host: server host.
+    @param port: server port.
+    @return: MongoClient.
+    """
+    key = (os.getpid(), host, port)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = MongoClient(host, port, connect=False)
+        return _clients[key]
+
+class CallsWriter(threading.Thread):
+    """Inserts chunks of API calls in batches, while the following chunks are
+    being built."""
+
+    def __init__(self, collection, batch_size):
+        """@param collection: calls collection.
+        @param batch_size: number of chunks per insert.
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.collection = collection
+        self.batch_size = batch_size
+        self.queue = Queue.Queue(maxsize=4)
+        self.batch = []
+        self.error = None
+
+    def add(self, chunk):
+        """Queue a chunk of calls for insertion.
+        @param chunk: chunk document, with its _id set.
+        @raise CuckooReportError: if an insertion already failed, so that the
+                                  following chunks aren't built for nothing.
+        """
+        if self.error:
+            raise CuckooReportError("Failed to store API calls in MongoDB: %s" % self.error)
+
+        self.batch.append(chunk)
+        if len(self.batch) >= self.batch_size:
+            self.queue.put(self.batch)
+            self.batch = []
+
+    def close(self):
+        """Insert the remaining chunks and wait for the insertions.
+        @raise CuckooReportError: if an insertion failed.
+        """
+        if self.batch:
+            self.queue.put(self.batch)
+            self.batch = []
+        self.queue.put(None)
+        self.join()
+
+        if self.error:
+            raise CuckooReportError("Failed to store API calls in MongoDB: %s" % self.error)
+
+    def run(self):
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            # Keep consuming after an error, not to block the producer.
+            if self.error:
+                continue
+
+            try:
+                self.collection.insert_many(batch, ordered=False)
+            except (PyMongoError, InvalidDocument) as e:
+                self.error = e
+
 class MongoDB(Report):
     """Stores report in MongoDB."""
 
@@ -26,7 +103,7 @@ class MongoDB(Report):
         port = self.options.get("port", 27017)
 
         try:
-            self.conn = Connection(host, port)
+            self.conn = get_client(host, port)
             self.db = self.conn.cuckoo
             self.fs = GridFS(self.db)
         except TypeError:
@@ -34,26 +111,84 @@ class MongoDB(Report):
         except ConnectionFailure:
             raise CuckooReportError("Cannot connect to MongoDB")
 
+    def store_files(self, files):
+        """Store files in GridFS, unless already stored.
+        @param files: list of (File, filename) tuples, filename can be empty.
+        @return: list of the object ids of the stored files.
+        """
+        md5s = [file_obj.get_md5() for file_obj, filename in files]
+
+        # A single query for the files already stored.
+        existing = {}
+        if md5s:
+            for stored in self.db.fs.files.find({"md5": {"$in": list(set(md5s))}},
+                                                {"md5": True}):
+                existing[stored["md5"]] = stored["_id"]
+
+        object_ids = []
+        for (file_obj, filename), md5 in zip(files, md5s):
+            if md5 not in existing:
+                new = self.fs.new_file(filename=filename or file_obj.get_name())
+                for chunk in file_obj.get_chunks():
+                    new.write(chunk)
+                new.close()
+                existing[md5] = new._id
+
+            object_ids.append(existing[md5])
+
+        return object_ids
+
     def store_file(self, file_obj, filename=""):
         """Store a file in GridFS.
         @param file_obj: object to the file to store
         @param filename: name of the file to store
         @return: object id of the stored file
         """
-        if not filename:
-            filename = file_obj.get_name()
+        return self.store_files([(file_obj, filename)])[0]
+
+    def store_calls(self, processes):
+        """Store chunks of API calls in their own collection.
+        @param processes: behavior processes.
+        @return: list of the chunk ids of every process.
+        """
+        calls_per_chunk = int(self.options.get("calls_per_chunk") or 100)
+        chunks_per_insert = int(self.options.get("chunks_per_insert") or 50)
+
+        writer = CallsWriter(self.db.calls, chunks_per_insert)
+        writer.start()
+
+        processes_chunks = []
+        try:
+            for process in processes:
+                chunk = []
+                chunks_ids = []
+                # Loop on each process call.
+                for call in process["calls"]:
+                    # Append call to the chunk, BSON only encodes real dicts.
+                    if isinstance(call, Record):
+                        call = call.to_dict()
+                    chunk.append(call)
+
+                    if len(chunk) == calls_per_chunk:
+                        chunks_ids.append(self._add_chunk(writer, process, chunk))
+                        chunk = []
+
+                # Store leftovers.
+                if chunk:
+                    chunks_ids.append(self._add_chunk(writer, process, chunk))
 
-        existing = self.db.fs.files.find_one({"md5": file_obj.get_md5()})
+                processes_chunks.append(chunks_ids)
+        finally:
+            writer.close()
 
-        if existing:
-            return existing["_id"]
-        else:
-            new = self.fs.new_file(filename=filename)
-            for chunk in file_obj.get_chunks():
-                new.write(chunk)
-            new.close()
+        return processes_chunks
 
-            return new._id
+    def _add_chunk(self, writer, process, calls):
+        # Ids are generated here so that the chunks can be referenced before
+        # being inserted.
+        chunk_id = ObjectId()
+        writer.add({"_id": chunk_id, "pid": process["process_id"], "calls": calls})
+        return chunk_id
 
     def run(self, results):
         """Writes report.
@@ -62,84 +197,83 @@ class MongoDB(Report):
         """
         self.connect()
 
+        # The client connects lazily, an unreachable server is only noticed
+        # by the first operation.
+        try:
+            self.store_report(results)
+        except (PyMongoError, InvalidDocument) as e:
+            raise CuckooReportError("Failed to store the report in MongoDB: %s" % e)
+
+    def store_report(self, results):
+        """Store the report, its files and API calls.
+        @param results: analysis results dictionary.
+        """
         # Create a copy of the dictionary. This is done in order to not modify
         # the original dictionary and possibly compromise the following
         # reporting modules.
         report = dict(results)
 
         # Set an unique index on stored files, to avoid duplicates.
-        # From pymongo docs:
-        #  Returns the name of the created index if an index is actually created. 
-        #  Returns None if the index already exists.
-        self.db.fs.files.ensure_index("md5", unique=True, name="md5_unique")
+        # Creating an existing index is a no-op.
+        self.db.fs.files.create_index("md5", unique=True, name="md5_unique")
+
+        # Collect the PCAP, the dropped files and the screenshots, and store
+        # them at once in GridFS.
+        files = []
 
-        # Store the PCAP file in GridFS and reference it back in the report.
         pcap_path = os.path.join(self.analysis_path, "dump.pcap")
         pcap = File(pcap_path)
         if pcap.valid():
-            pcap_id = self.store_file(pcap)
-            report["network"] = {"pcap_id": pcap_id}
-            report["network"].update(results["network"])
+            files.append((pcap, ""))
 
-        # Walk through the dropped files, store them in GridFS and update the
-        # report with the ObjectIds.
-        new_dropped = []
+        dropped_files = []
         for dropped in report["dropped"]:
-            new_drop = dict(dropped)
             drop = File(dropped["path"])
             if drop.valid():
-                dropped_id = self.store_file(drop, filename=dropped["name"])
-                new_drop["object_id"] = dropped_id
+                dropped_files.append(dropped)
+                files.append((drop, dropped["name"]))
+
+        shots = []
+        shots_path = os.path.join(self.analysis_path, "shots")
+        if os.path.exists(shots_path):
+            # Walk through the files and select the JPGs.
+            for shot_file in sorted(os.listdir(shots_path)):
+                if not shot_file.endswith(".jpg"):
+                    continue
+                shot = File(os.path.join(shots_path, shot_file))
+                if shot.valid():
+                    shots.append(shot)
+                    files.append((shot, ""))
 
+        object_ids = iter(self.store_files(files))
+
+        # Reference the PCAP back in the report.
+        if pcap.valid():
+            report["network"] = {"pcap_id": object_ids.next()}
+            report["network"].update(results["network"])
+
+        # Update the report with the ObjectIds of the dropped files.
+        dropped_ids = dict((id(dropped), object_ids.next()) for dropped in dropped_files)
+        new_dropped = []
+        for dropped in report["dropped"]:
+            new_drop = dict(dropped)
+            if id(dropped) in dropped_ids:
+                new_drop["object_id"] = dropped_ids[id(dropped)]
             new_dropped.append(new_drop)
 
         report["dropped"] = new_dropped
 
         # Add screenshots.
-        report["shots"] = []
-        shots_path = os.path.join(self.analysis_path, "shots")
-        if os.path.exists(shots_path):
-            # Walk through the files and select the JPGs.
-            shots = [shot for shot in os.listdir(shots_path) if shot.endswith(".jpg")]
-            for shot_file in sorted(shots):
-                shot_path = os.path.join(self.analysis_path, "shots", shot_file)
-                shot = File(shot_path)
-                # If the screenshot path is a valid file, store it and
-                # reference it back in the report.
-                if shot.valid():
-                    shot_id = self.store_file(shot)
-                    report["shots"].append(shot_id)
+        report["shots"] = [object_ids.next() for shot in shots]
 
         # Store chunks of API calls in a different collection and reference
         # those chunks back in the report. In this way we should defeat the
         # issue with the oversized reports exceeding MongoDB's boundaries.
         # Also allows paging of the reports.
+        processes = report["behavior"]["processes"]
         new_processes = []
-        for process in report["behavior"]["processes"]:
+        for process, chunks_ids in zip(processes, self.store_calls(processes)):
             new_process = dict(process)
-
-            chunk = []
-            chunks_ids = []
-            # Loop on each process call.
-            for index, call in enumerate(process["calls"]):
-                # If the chunk size is 100 or if the loop is completed then
-                # store the chunk in MongoDB.
-                if len(chunk) == 100:
-                    chunk_id = self.db.calls.insert({"pid" : process["process_id"],
-                                                     "calls" : chunk})
-                    chunks_ids.append(chunk_id)
-                    # Reset the chunk.
-                    chunk = []
-
-                # Append call to the chunk.
-                chunk.append(call)
-
-            # Store leftovers.
-            if chunk:
-                chunk_id = self.db.calls.insert({"pid" : process["process_id"],
-                                                 "calls" : chunk})
-                chunks_ids.append(chunk_id)
-
             # Add list of chunks.
             new_process["calls"] = chunks_ids
             new_processes.append(new_process)
@@ -149,5 +283,4 @@ class MongoDB(Report):
         report["behavior"]["processes"] = new_processes
 
         # Store the report and retrieve its object id.
-        self.db.analysis.insert(report)
-        self.conn.disconnect()
+        self.db.analysis.insert_one(report)
@@ -8,6 +8,8 @@ from nose.tools import assert_equals, raises
 
 import lib.dragon.common.abstracts as abstracts
 from lib.dragon.common.config import Config
+from lib.dragon.common.objects import UniqueList
+from modules.processing.behavior import CallIndex
 
 class TestMachineManager:
 
@@ -91,6 +93,62 @@ class TestSignature(object):
     def test_not_implemented_run(self):
         self.s.run()
 
+class IndexedCalls(list):
+    def __init__(self, calls):
+        list.__init__(self, calls)
+        self.calls_index = CallIndex()
+        for offset, call in enumerate(calls):
+            self.calls_index.add(offset, call)
+
+class TestSignatureIndex(object):
+    def setUp(self):
+        def call(api, category, **arguments):
+            return {"api" : api, "category" : category,
+                    "arguments" : [{"name" : k, "value" : v} for k, v in sorted(arguments.items())]}
+
+        calls = [call("NtCreateFile", "filesystem", FileName="C:\\a.exe", Handle="0x1"),
+                 call("RegOpenKeyExA", "registry", SubKey="Software\\Foo", Handle="0x2"),
+                 call("NtCreateFile", "filesystem", FileName="C:\\b.dll", Handle="0x3"),
+                 call("NtOpenFile", "filesystem", FileName="C:\\c.exe", Handle="0x4"),
+                 call("NtWriteFile", "filesystem", Buffer="MZ" + "\\x00" * 200, FileHandle="0x4"),
+                 call("NtWriteFile", "filesystem", Buffer="PK" + "\\x00" * 200, FileHandle="0x4")]
+        summary = {"files" : UniqueList(["C:\\a.exe", "C:\\b.dll"]), "keys" : [], "mutexes" : []}
+
+        def results(calls):
+            return {"behavior" : {"processes" : [{"process_name" : "foo.exe", "calls" : calls}],
+                                  "summary" : summary}}
+
+        self.scan = abstracts.Signature(results(calls))
+        self.indexed = abstracts.Signature(results(IndexedCalls(calls)))
+
+    def _check(self, method, *args, **kwargs):
+        expected = getattr(self.scan, method)(*args, **kwargs)
+        assert_equals(expected, getattr(self.indexed, method)(*args, **kwargs))
+        return expected
+
+    def test_check_api(self):
+        assert_equals("NtOpenFile", self._check("check_api", "NtOpenFile"))
+        assert_equals("NtCreateFile", self._check("check_api", "Nt.*File", regex=True))
+        assert_equals(None, self._check("check_api", "NtOpenFile", process="bar.exe"))
+        assert_equals(None, self._check("check_api", "Foo"))
+
+    def test_check_argument(self):
+        assert_equals("C:\\a.exe", self._check("check_argument", ".*\\.exe$", regex=True))
+        assert_equals("C:\\c.exe", self._check("check_argument", ".*\\.exe$", api="NtOpenFile", regex=True))
+        assert_equals("0x2", self._check("check_argument", "0x2", name="Handle"))
+        assert_equals("0x2", self._check("check_argument", "0x.", category="registry", regex=True))
+        assert_equals(None, self._check("check_argument", "0x2", category="filesystem"))
+        assert_equals(None, self._check("check_argument", "0x2", name="FileName"))
+        # Buffers aren't indexed.
+        assert_equals("PK" + "\\x00" * 200, self._check("check_argument", "PK.*", regex=True))
+        assert_equals("MZ" + "\\x00" * 200, self._check("check_argument", ".*\\\\x00$", name="Buffer", regex=True))
+        assert_equals("C:\\a.exe", self._check("check_argument", "(MZ|C:).*", regex=True))
+
+    def test_check_file(self):
+        assert_equals("C:\\b.dll", self.indexed.check_file("C:\\b.dll"))
+        assert_equals("C:\\b.dll", self.indexed.check_file(".*\\.DLL", regex=True))
+        assert_equals(None, self.indexed.check_file("C:\\c.exe"))
+
 class TestReport:
     def setUp(self):
         self.r = abstracts.Report()
@@ -0,0 +1,103 @@
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import os
+import struct
+import pickle
+import shutil
+import cPickle
+import tempfile
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_equals
+
+from modules.processing.behavior import CallCache, ParseProcessLog
+from callstore_tests import netlog_stream, apiindex
+
+def rss():
+    """Resident set size of the process in bytes."""
+    try:
+        with open("/proc/self/statm") as fd:
+            return int(fd.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        raise SkipTest("Resident set size not available")
+
+
+class TestCallCache:
+    def test_spill(self):
+        cache = CallCache(3, chunk_size=2)
+        for i in range(8):
+            cache.append({"api": i})
+        assert_equals(2, len(cache.chunks))
+
+        calls = []
+        while True:
+            read = cache.read(len(calls))
+            if not read:
+                break
+            calls.extend(read)
+        assert_equals(range(8), [call["api"] for call in calls])
+        assert_equals([{"api": 4}], cache.read(4))
+        assert_equals([{"api": 7}], cache.read(7))
+        cache.close()
+
+class TestParseProcessLog:
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "1234.raw")
+        with open(self.path, "wb") as fd:
+            fd.write(netlog_stream(100))
+
+    def test_decoded_once(self):
+        uncached = ParseProcessLog(self.path, cache_size=None)
+        expected = list(uncached)
+        list(uncached)
+        assert_equals(2, uncached.decodes)
+        assert_equals(200, len(expected))
+
+        calls = ParseProcessLog(self.path, cache_size=50)
+        assert_equals(1234, calls.process_id)
+        # Nested and interrupted iterations share the decoded calls.
+        for first in calls:
+            assert_equals(expected[:10], [call for call, i in zip(calls, range(10))])
+            break
+        assert_equals(expected, list(calls))
+        assert_equals(expected, list(calls))
+        assert_equals(1, calls.decodes)
+        assert_equals([0, 2, 4], list(calls.calls_index.calls["NtDeleteFile"][:3]))
+
+    def test_pickle(self):
+        calls = ParseProcessLog(self.path, cache_size=50)
+        expected = list(ParseProcessLog(self.path, cache_size=None))
+        for module in (pickle, cPickle):
+            for protocol in (0, 2):
+                data = module.dumps({"calls": calls}, protocol)
+                assert_equals(expected, module.loads(data)["calls"])
+        calls.cache.close()
+
+    def test_large_buffers(self):
+        """Buffers are neither indexed nor kept in memory past the cache
+        and the chunk being spilled."""
+        count, size = 8000, 16384
+        with open(self.path, "wb") as fd:
+            fd.write(netlog_stream(0))
+            for i in range(count):
+                # NtWriteFile, 'pb' FileHandle, Buffer.
+                buf = ("%08d" % i) * (size / 8)
+                fd.write(struct.pack("=BBIII", apiindex("NtWriteFile"), 1, 0, 1, i))
+                fd.write(struct.pack("III", 0x10, size, size) + buf)
+
+        before = rss()
+        calls = ParseProcessLog(self.path, cache_size=50)
+        for call in calls:
+            pass
+        growth = rss() - before
+
+        assert "Buffer" not in calls.calls_index.arguments["NtWriteFile"]
+        assert "FileHandle" in calls.calls_index.arguments["NtWriteFile"]
+        assert_equals(set(["Buffer"]), calls.calls_index.long_arguments["NtWriteFile"])
+        assert growth < count * size / 4, "RSS grew by %d bytes" % growth
+        calls.cache.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
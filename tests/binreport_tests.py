@@ -0,0 +1,77 @@
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import os
+import shutil
+import tempfile
+from nose.tools import assert_equals, raises
+
+from lib.dragon.common.binreport import BinaryReportWriter, BinaryReportReader
+from lib.dragon.common.exceptions import CuckooOperationalError
+from lib.dragon.common.objects import Argument, Call
+
+
+class TestBinaryReport:
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "report.bin")
+
+        calls = [Call("2013-01-01 00:00:00,000", "1", "filesystem", "NtDeleteFile",
+                      True, "0x00000000", [Argument("FileName", "C:\\%d.txt" % i)])
+                 for i in range(10)]
+        self.results = {"info": {"id": 1},
+                        "signatures": [{"name": "foo"}],
+                        "network": {"hosts": ["1.2.3.4"], "pcap_sha256": "abc"},
+                        "behavior": {"processes": [{"process_id": 1234, "calls": calls}],
+                                     "summary": {"files": ["C:\\0.txt"]}}}
+
+        writer = BinaryReportWriter(self.path, chunk_size=3)
+        writer.write(self.results)
+        writer.close()
+
+    def test_sections(self):
+        report = BinaryReportReader(self.path)
+        assert_equals({"id": 1}, report.load("info"))
+        assert_equals([{"name": "foo"}], report.load("signatures"))
+
+        calls = report.load("behavior")["processes"][0]["calls"]
+        assert_equals(10, len(calls))
+        assert_equals(["C:\\4.txt", "C:\\5.txt", "C:\\6.txt"],
+                      [call["arguments"][0]["value"] for call in calls.slice(4, 3)])
+        assert_equals([], calls.slice(10, 5))
+        report.close()
+
+    def test_load_all(self):
+        report = BinaryReportReader(self.path)
+        results = report.load_all(lazy=False)
+        report.close()
+
+        calls = self.results["behavior"]["processes"][0]["calls"]
+        self.results["behavior"]["processes"][0]["calls"] = [call.to_dict() for call in calls]
+        assert_equals(self.results, results)
+
+    @raises(CuckooOperationalError)
+    def test_incomplete(self):
+        writer = BinaryReportWriter(self.path)
+        writer.add_object("info", {})
+        writer.fd.close()
+        BinaryReportReader(writer.temp_path)
+
+    def test_failed_write(self):
+        """A failed write leaves the previous report untouched."""
+        writer = BinaryReportWriter(self.path)
+        try:
+            writer.write({"info": {"id": 2}, "bad": {"value": lambda: None}})
+        except Exception:
+            writer.abort()
+        else:
+            assert False, "Expected the write to fail"
+
+        assert_equals(["report.bin"], os.listdir(self.tmp))
+        report = BinaryReportReader(self.path)
+        assert_equals({"id": 1}, report.load("info"))
+        report.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
@@ -0,0 +1,131 @@
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import os
+import struct
+import shutil
+import tempfile
+from nose.tools import assert_equals, raises
+
+from lib.dragon.common import callstore
+from lib.dragon.common.callstore import CallStoreWriter, CallStoreReader
+from lib.dragon.common.exceptions import CuckooOperationalError
+from lib.dragon.common.netlog import NetlogParser, DECODERS
+
+
+def netlog_string(s):
+    return struct.pack("II", len(s), len(s)) + s
+
+def apiindex(apiname):
+    return [decoder.apiname for decoder in DECODERS].index(apiname)
+
+def netlog_stream(calls):
+    data = struct.pack("=BBIII", 0, 0, 0, 0, 0)
+    filetime = 130013280000000000
+    data += struct.pack("IIII", filetime & 0xffffffff, filetime >> 32, 1234, 4)
+    data += netlog_string("C:\\sample.exe")
+    for i in range(calls):
+        # NtDeleteFile, 'O' FileName.
+        data += struct.pack("=BBIII", 2, 1, i, 1, i)
+        data += netlog_string("C:\\file%d.txt" % i)
+        # NtCreateMutant, 'POl' Handle, MutexName, InitialOwner.
+        data += struct.pack("=BBIII", apiindex("NtCreateMutant"), 0, 0xc0000001, 2, i)
+        data += struct.pack("III", 0x1234, 0, 0) + struct.pack("I", 1)
+    return data
+
+class Recorder(object):
+    """Netlog handler recording the messages, optionally into a store."""
+
+    def __init__(self, data="", path=None):
+        self.data = data
+        self.path = path
+        self.writer = None
+        self.process = None
+        self.calls = []
+
+    def read(self, length):
+        buf, self.data = self.data[:length], self.data[length:]
+        if len(buf) != length: raise EOFError()
+        return buf
+
+    def read_struct(self, st):
+        return st.unpack(self.read(st.size))
+
+    def log_process(self, context, timestring, pid, ppid, modulepath, procname):
+        self.process = (timestring, pid, ppid, modulepath, procname)
+        if self.path:
+            self.writer = CallStoreWriter(self.path, timestring, pid, ppid, modulepath)
+
+    def log_call(self, context, apiname, modulename, arguments):
+        self.calls.append((context, apiname, modulename,
+                           [(name, str(value)) for name, value in arguments]))
+        if self.writer:
+            self.writer.add(context, arguments)
+
+    def replay(self, parser):
+        try:
+            while parser.read_next_message():
+                pass
+        except EOFError:
+            pass
+
+class TestCallStore:
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "1234.calls")
+
+    def _write(self, calls, close=True):
+        recorder = Recorder(netlog_stream(calls), self.path)
+        recorder.replay(NetlogParser(recorder))
+        if close:
+            recorder.writer.close()
+        else:
+            recorder.writer.flush()
+            recorder.writer.fd.close()
+        return recorder
+
+    def test_same_as_netlog(self):
+        netlog = self._write(50)
+        stored = Recorder()
+        reader = CallStoreReader(self.path, stored)
+        stored.replay(reader)
+        reader.close()
+
+        assert_equals(netlog.process, stored.process)
+        assert_equals(100, len(stored.calls))
+        assert_equals(netlog.calls, stored.calls)
+
+    def test_blocks(self):
+        size = callstore.BLOCK_SIZE
+        callstore.BLOCK_SIZE = 7
+        try:
+            netlog = self._write(50)
+        finally:
+            callstore.BLOCK_SIZE = size
+
+        stored = Recorder()
+        reader = CallStoreReader(self.path, stored)
+        assert_equals(15, len(reader.blocks))
+        stored.replay(reader)
+        assert_equals(netlog.calls, stored.calls)
+
+        # Replays again after a reset.
+        stored.calls = []
+        reader.reset()
+        stored.replay(reader)
+        assert_equals(netlog.calls, stored.calls)
+        reader.close()
+
+    @raises(CuckooOperationalError)
+    def test_incomplete(self):
+        self._write(10, close=False)
+        CallStoreReader(self.path, Recorder())
+
+    @raises(CuckooOperationalError)
+    def test_empty(self):
+        open(self.path, "wb").close()
+        CallStoreReader(self.path, Recorder())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
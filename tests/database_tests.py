@@ -0,0 +1,205 @@
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from nose.tools import assert_equals
+from sqlalchemy import inspect
+
+from lib.dragon.common.utils import Singleton
+from lib.dragon.core.database import Database, Task
+
+
+class TestDatabase:
+    pool_size = 0
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        Singleton._instances.pop(Database, None)
+        self.d = Database(dsn="sqlite:///%s" % os.path.join(self.tmp, "cuckoo.db"),
+                          pool_size=self.pool_size)
+
+    def test_fetch_and_report(self):
+        first = self.d.add_url("http://example.com/1")
+        second = self.d.add_url("http://example.com/2", priority=2)
+        for task_id in (first, second):
+            self.d.process(task_id)
+            self.d.complete(task_id)
+
+        # Higher priority first.
+        assert_equals(second, self.d.fetch_and_report().id)
+        assert_equals(first, self.d.fetch_and_report().id)
+        assert_equals(None, self.d.fetch_and_report())
+        assert_equals("reporting", self.d.view_task(first).status)
+
+        self.d.report(first)
+        assert_equals("reported", self.d.view_task(first).status)
+
+    def test_failed_analysis_reported(self):
+        task_id = self.d.add_url("http://example.com")
+        self.d.complete(task_id, success=False)
+        assert_equals("failed_analysis", self.d.view_task(task_id).status)
+
+        assert_equals("failed_reporting", self.d.fetch_and_report().status)
+        assert_equals(None, self.d.fetch_and_report())
+        self.d.report(task_id, success=False)
+        assert_equals("failure", self.d.view_task(task_id).status)
+
+    def test_reclaim_stale_tasks(self):
+        processing, reporting, failed, recent = [self.d.add_url("http://example.com/%d" % i) for i in range(4)]
+        self.d.fetch_and_process_batch(4)
+        for task_id in (reporting, failed):
+            self.d.complete(task_id, success=task_id == reporting)
+        self.d.fetch_and_report()
+        self.d.fetch_and_report()
+
+        past = datetime.now() - timedelta(hours=2)
+        session = self.d.Session()
+        session.query(Task).filter(Task.id != recent).update({"status_changed_on" : past}, synchronize_session=False)
+        session.commit()
+
+        assert_equals(3, self.d.reclaim_stale_tasks(3600))
+        assert_equals(["failed_analysis", "completed", "failed_analysis", "processing"],
+                      [self.d.view_task(task_id).status for task_id in (processing, reporting, failed, recent)])
+        assert_equals(0, self.d.reclaim_stale_tasks(3600))
+
+    def test_touched_tasks_not_reclaimed(self):
+        running, left = [self.d.add_url("http://example.com/%d" % i) for i in range(2)]
+        self.d.fetch_and_process_batch(2)
+
+        past = datetime.now() - timedelta(hours=2)
+        session = self.d.Session()
+        session.query(Task).update({"status_changed_on" : past}, synchronize_session=False)
+        session.commit()
+
+        self.d.touch_tasks([running])
+        assert_equals(1, self.d.reclaim_stale_tasks(3600))
+        assert_equals(["processing", "failed_analysis"],
+                      [self.d.view_task(task_id).status for task_id in (running, left)])
+
+    def test_complete_and_claim(self):
+        succeeded, failed = [self.d.add_url("http://example.com/%d" % i) for i in range(2)]
+        self.d.fetch_and_process_batch(2)
+        self.d.complete(succeeded, claim=True)
+        self.d.complete(failed, success=False, claim=True)
+
+        assert_equals(["reporting", "failed_reporting"],
+                      [self.d.view_task(task_id).status for task_id in (succeeded, failed)])
+        assert_equals(None, self.d.fetch_and_report())
+
+    def test_fetch_and_process_batch(self):
+        first = self.d.add_url("http://example.com/1")
+        second = self.d.add_url("http://example.com/2", priority=2)
+        third = self.d.add_url("http://example.com/3")
+
+        assert_equals([second, first], [task.id for task in self.d.fetch_and_process_batch(2)])
+        assert_equals("processing", self.d.view_task(first).status)
+        assert_equals(third, self.d.fetch_and_process().id)
+        assert_equals([], self.d.fetch_and_process_batch(2))
+
+    def test_concurrent_claims(self):
+        """Schedulers sharing the database never claim a task twice."""
+        tasks = set(self.d.add_url("http://example.com/%d" % i) for i in range(60))
+        claims = []
+
+        def scheduler():
+            while True:
+                batch = self.d.fetch_and_process_batch(4)
+                claims.extend(task.id for task in batch)
+                if not batch:
+                    # Claims can fail while the database is locked.
+                    session = self.d.Session()
+                    if not session.query(Task).filter(Task.status == "pending").count():
+                        break
+
+        threads = [threading.Thread(target=scheduler) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert_equals(len(tasks), len(claims))
+        assert_equals(tasks, set(claims))
+
+    def test_list_tasks_pages(self):
+        tasks = [self.d.add_url("http://example.com/%d" % i) for i in range(5)]
+
+        first = self.d.list_tasks(limit=2)
+        assert_equals(tasks[:-3:-1], [task.id for task in first])
+        second = self.d.list_tasks(limit=2, before=first[-1].id)
+        assert_equals(tasks[-3:-5:-1], [task.id for task in second])
+        last = self.d.list_tasks(limit=2, before=second[-1].id)
+        assert_equals([tasks[0]], [task.id for task in last])
+
+    def test_list_tasks_filters(self):
+        url = self.d.add_url("http://example.com")
+        self.d.add_url("http://example.com/done")
+        self.d.process(url)
+
+        assert_equals([url], [task.id for task in self.d.list_tasks(status="processing")])
+        assert_equals([], self.d.list_tasks(category="file"))
+        assert_equals(2, len(self.d.list_tasks(category="url")))
+
+        now = datetime.now()
+        assert_equals(2, len(self.d.list_tasks(added_after=now - timedelta(days=1))))
+        assert_equals([], self.d.list_tasks(added_before=now - timedelta(days=1)))
+
+    def test_create_indexes(self):
+        """Indexes are added to the tables of an existing database."""
+        self.d.engine.execute("DROP INDEX task_status_priority")
+        Singleton._instances.pop(Database, None)
+        self.d = Database(dsn="sqlite:///%s" % os.path.join(self.tmp, "cuckoo.db"),
+                          pool_size=self.pool_size)
+
+        names = [index["name"] for index in inspect(self.d.engine).get_indexes("tasks")]
+        assert "task_status_priority" in names
+
+    def test_migrate_status(self):
+        """Databases created with the older statuses are migrated."""
+        self.d.engine.execute("DROP TABLE tasks")
+        self.d.engine.execute("CREATE TABLE tasks (id INTEGER NOT NULL, "
+                              "target TEXT NOT NULL, category VARCHAR(255) NOT NULL, "
+                              "timeout INTEGER DEFAULT '0' NOT NULL, "
+                              "priority INTEGER DEFAULT '1' NOT NULL, "
+                              "custom VARCHAR(255), machine VARCHAR(255), "
+                              "package VARCHAR(255), options VARCHAR(255), "
+                              "platform VARCHAR(255), memory BOOLEAN NOT NULL, "
+                              "enforce_timeout BOOLEAN NOT NULL, added_on DATETIME NOT NULL, "
+                              "started_on DATETIME, completed_on DATETIME, "
+                              "status VARCHAR(10) DEFAULT 'pending' NOT NULL, "
+                              "sample_id INTEGER, PRIMARY KEY (id), "
+                              "CONSTRAINT status_type CHECK (status IN "
+                              "('pending', 'processing', 'failure', 'success')), "
+                              "FOREIGN KEY(sample_id) REFERENCES samples (id))")
+        self.d.engine.execute("INSERT INTO tasks (target, category, memory, enforce_timeout, added_on, status) "
+                              "VALUES ('http://example.com', 'url', 0, 0, '2013-01-01 00:00:00', 'success')")
+        Singleton._instances.pop(Database, None)
+        self.d = Database(dsn="sqlite:///%s" % os.path.join(self.tmp, "cuckoo.db"),
+                          pool_size=self.pool_size)
+
+        assert_equals("reported", self.d.view_task(1).status)
+        task_id = self.d.add_url("http://example.com/new")
+        self.d.complete(task_id)
+        assert_equals("completed", self.d.view_task(task_id).status)
+        names = [index["name"] for index in inspect(self.d.engine).get_indexes("tasks")]
+        assert "task_status_priority" in names
+
+    def tearDown(self):
+        Singleton._instances.pop(Database, None)
+        shutil.rmtree(self.tmp)
+
+class TestPooledDatabase(TestDatabase):
+    pool_size = 2
+
+    def test_pool_status(self):
+        task_id = self.d.add_url("http://example.com")
+        assert_equals("pending", self.d.view_task(task_id).status)
+        self.d.end_session()
+
+        status = self.d.pool_status()
+        assert status["checkouts"] > 0
+        assert_equals(0, status["checked_out"])
@@ -0,0 +1,102 @@
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import socket
+import struct
+import threading
+from nose.tools import assert_equals
+
+from lib.dragon.common.dns import Resolver, DNS_TIMEOUT_VALUE
+
+class StubServer(threading.Thread):
+    """DNS server answering the A queries of *.example, never answering
+    slow.example, answering another question to wrong.example, and of
+    nothing else."""
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        self.queries = []
+
+    def run(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(512)
+            except socket.error:
+                return
+
+            query_id, = struct.unpack_from(">H", data)
+            end = data.index("\0", 12) + 5
+            labels, offset = [], 12
+            while data[offset] != "\0":
+                length = ord(data[offset])
+                labels.append(data[offset + 1:offset + 1 + length])
+                offset += length + 1
+            name = ".".join(labels)
+            self.queries.append(name)
+
+            if name == "slow.example":
+                continue
+            if name == "wrong.example":
+                data = data[:12] + "\x05other" + data[18:]
+            if name.endswith(".example"):
+                header = struct.pack(">HHHHHH", query_id, 0x8180, 1, 1, 0, 0)
+                answer = struct.pack(">HHHIH", 0xc00c, 1, 1, 60, 4) + socket.inet_aton("10.0.0.%d" % len(name))
+            else:
+                header = struct.pack(">HHHHHH", query_id, 0x8183, 1, 0, 0, 0)
+                answer = ""
+            self.sock.sendto(header + data[12:end] + answer, address)
+
+class TestResolver:
+    def setUp(self):
+        self.server = StubServer()
+        self.server.start()
+        self.resolver = Resolver(server="127.0.0.1", port=self.server.port,
+                                 timeout=0.2, concurrency=4)
+
+    def test_resolve_many(self):
+        names = ["a.example", "bb.example", "missing.test", "a.example"]
+        results = self.resolver.resolve_many(names)
+        assert_equals({"a.example": "10.0.0.9", "bb.example": "10.0.0.10",
+                       "missing.test": ""}, results)
+        assert_equals(3, len(self.server.queries))
+
+    def test_cache(self):
+        self.resolver.resolve("a.example")
+        assert_equals("10.0.0.9", self.resolver.resolve("a.example"))
+        assert_equals(["a.example"], self.server.queries)
+
+    def test_timeout_not_cached(self):
+        assert_equals(DNS_TIMEOUT_VALUE, self.resolver.resolve("slow.example"))
+        self.resolver.resolve("slow.example")
+        assert_equals(2, len(self.server.queries))
+
+    def test_concurrency(self):
+        names = ["host%d.example" % i for i in range(50)] + ["slow.example"]
+        results = self.resolver.resolve_many(names)
+        assert_equals(51, len(results))
+        assert_equals("10.0.0.13", results["host1.example"])
+
+        # All the slots are released.
+        for i in range(4):
+            assert self.resolver.slots.acquire(False)
+
+    def test_invalid_names(self):
+        names = ["a" * 64 + ".example", "b" * 300 + ".example",
+                 ".".join(["c" * 63] * 4) + ".example", "d..example"]
+        results = self.resolver.resolve_many(names)
+        assert_equals(dict((name, "") for name in names), results)
+        assert_equals([], self.server.queries)
+        for i in range(4):
+            assert self.resolver.slots.acquire(False)
+
+    def test_question_mismatch(self):
+        assert_equals(DNS_TIMEOUT_VALUE, self.resolver.resolve("wrong.example"))
+        assert_equals(["wrong.example"], self.server.queries)
+
+    def tearDown(self):
+        self.server.sock.close()
@@ -0,0 +1,43 @@
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+from nose.tools import assert_equals
+
+from lib.dragon.common.irc import IRCParser, ircMessage, MAX_LINE_SIZE
+
+class TestIRCParser:
+    def test_client_lines_across_segments(self):
+        parser = IRCParser()
+        for segment in ("NICK bot\r\nJO", "IN #chan", "nel\r\n", "GET / HTTP/1.1\r\nPRIVMSG #c :hi"):
+            parser.feed(segment)
+        assert_equals(2, len(parser.messages))
+        assert_equals({"command": "JOIN", "params": "#channel", "type": "client"},
+                      parser.messages[1])
+
+        # The unterminated line is parsed on close.
+        assert_equals("PRIVMSG", parser.close()[2]["command"])
+
+    def test_server_filters(self):
+        parser = IRCParser(server=True, filters=["266"])
+        parser.feed(":irc.example.net 001 bot :Welcome\r\n"
+                    ":irc.example.net 266 bot :Current global users\r\n"
+                    "NICK bot\r\n")
+        messages = parser.close()
+        assert_equals(1, len(messages))
+        assert_equals({"prefix": ":irc.example.net", "command": "001",
+                       "params": "bot :Welcome", "type": "server"}, messages[0])
+
+    def test_long_lines_skipped(self):
+        parser = IRCParser()
+        parser.feed("NICK " + "a" * MAX_LINE_SIZE)
+        parser.feed("a" * 10 + "\r\nNICK bot\r\n")
+        assert_equals(["bot"], [message["params"] for message in parser.close()])
+
+class TestIrcMessage:
+    def test_compatibility(self):
+        data = "USER a b c :d\r\n:server 376 bot :End\r\n"
+        assert ircMessage().isthereIRC(data)
+        assert not ircMessage().isthereIRC("GET / HTTP/1.1\r\nHost: a\r\n\r\n")
+        assert_equals(["USER"], [m["command"] for m in ircMessage().getClientMessages(data)])
+        assert_equals([], ircMessage().getServerMessagesFilter(data, ["376"]))
@@ -0,0 +1,45 @@
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import json
+import StringIO
+from nose.tools import assert_equals
+
+from lib.dragon.common.jsonwriter import JsonWriter
+from lib.dragon.common.objects import Argument, Call
+
+
+class TestJsonWriter:
+    def setUp(self):
+        calls = [Call("2013-01-01 00:00:00,000", "1", "filesystem", "NtDeleteFile",
+                      True, "0x00000000", [Argument("FileName", "C:\\a.txt")])]
+        self.doc = {"empty": {}, "list": [], 1: (1, "a\nb"),
+                    "processes": [{"calls": calls}]}
+        self.expected = json.loads(json.dumps(self.doc, default=lambda o: o.to_dict()))
+
+    def _write(self, indent):
+        out = StringIO.StringIO()
+        JsonWriter(out, indent=indent).write(self.doc)
+        return out.getvalue()
+
+    def test_indented(self):
+        data = self._write(4)
+        assert_equals(self.expected, json.loads(data))
+        assert data.startswith("{\n    \"")
+
+    def test_compact(self):
+        data = self._write(None)
+        assert_equals(self.expected, json.loads(data))
+        assert "\n" not in data.replace("\\n", "")
+
+    def test_sections(self):
+        for indent in (None, 4):
+            out = StringIO.StringIO()
+            writer = JsonWriter(out, indent=indent)
+            writer.write(self.doc)
+            data = out.getvalue()
+
+            assert_equals(set(self.expected), set(writer.sections))
+            for key, (offset, length) in writer.sections.iteritems():
+                assert_equals(self.expected[key], json.loads(data[offset:offset + length]))
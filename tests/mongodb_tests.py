@@ -0,0 +1,67 @@
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import os
+import socket
+from nose.tools import assert_equals, raises
+
+from lib.dragon.common.exceptions import CuckooReportError
+from lib.dragon.common.objects import Dictionary
+from modules.reporting import mongodb
+from modules.reporting.mongodb import CallsWriter, MongoDB
+from pymongo import MongoClient
+from pymongo.errors import AutoReconnect
+
+
+class FailingCollection(object):
+    def __init__(self):
+        self.inserts = 0
+
+    def insert_many(self, documents, ordered=True):
+        self.inserts += 1
+        raise AutoReconnect("connection closed")
+
+class TestCallsWriter:
+    def test_stops_after_error(self):
+        collection = FailingCollection()
+        writer = CallsWriter(collection, 1)
+        writer.start()
+        writer.add({"_id": 1})
+        # Wait for the failed insertion.
+        while writer.error is None and writer.is_alive():
+            writer.join(0.01)
+
+        try:
+            writer.add({"_id": 2})
+        except CuckooReportError:
+            pass
+        else:
+            assert False, "Expected the writer to refuse the chunk"
+
+        try:
+            writer.close()
+        except CuckooReportError:
+            pass
+        assert_equals(1, collection.inserts)
+
+class TestMongoDB:
+    def setUp(self):
+        # A port nothing listens on.
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        self.port = sock.getsockname()[1]
+        sock.close()
+
+        self.key = (os.getpid(), "127.0.0.1", self.port)
+        mongodb._clients[self.key] = MongoClient("127.0.0.1", self.port, connect=False,
+                                                 serverSelectionTimeoutMS=100)
+
+    @raises(CuckooReportError)
+    def test_unreachable_server(self):
+        report = MongoDB()
+        report.set_options(Dictionary(host="127.0.0.1", port=self.port))
+        report.run({"dropped": [], "behavior": {"processes": []}, "network": {}})
+
+    def tearDown(self):
+        mongodb._clients.pop(self.key).close()
@@ -0,0 +1,56 @@
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import struct
+from nose.tools import assert_equals, raises
+
+from lib.dragon.common.exceptions import CuckooResultError
+from lib.dragon.common.netlog import ApiDecoder, NetlogParser
+
+
+class HandlerMock(object):
+    def __init__(self, data):
+        self.data = data
+        self.reads = 0
+
+    def read(self, length):
+        self.reads += 1
+        buf, self.data = self.data[:length], self.data[length:]
+        return buf
+
+    def read_struct(self, st):
+        return st.unpack(self.read(st.size))
+
+class TestApiDecoder:
+    def test_runs(self):
+        decoder = ApiDecoder("Foo", "system", ("lpOpb", "A", "B", "C", "D", "E"))
+        assert_equals(2, len(decoder.runs))
+        assert_equals(16, decoder.runs[0][0].size)
+        assert_equals(12, decoder.runs[1][0].size)
+
+    def test_decode(self):
+        decoder = ApiDecoder("Foo", "system", ("lpOr", "A", "B", "C", "D"))
+        data = struct.pack("IIII", 1, 2, 3, 3) + "foo"
+        data += struct.pack("III", 1, 3, 5) + "bar"
+        handler = HandlerMock(data)
+        arguments = decoder.decode(NetlogParser(handler))
+
+        assert_equals([("A", 1),
+                       ("B", "0x00000002"),
+                       ("C", "foo"),
+                       ("D", "bar... (truncated)")], arguments)
+        assert_equals("", handler.data)
+        assert_equals(5, handler.reads)
+
+    def test_no_arguments(self):
+        decoder = ApiDecoder("IsDebuggerPresent", "system", ("",))
+        assert_equals([], decoder.decode(NetlogParser(HandlerMock(""))))
+
+    @raises(CuckooResultError)
+    def test_missing_argument_name(self):
+        ApiDecoder("Foo", "system", ("2lp", "A", "B"))
+
+    @raises(CuckooResultError)
+    def test_extra_argument_name(self):
+        ApiDecoder("Foo", "system", ("lp", "A", "B", "C"))
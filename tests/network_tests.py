@@ -0,0 +1,210 @@
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import os
+import socket
+import tempfile
+import dpkt
+from nose.tools import assert_equals
+
+from lib.dragon.common import pcapscan
+from lib.dragon.common.irc import IRCParser
+from modules.processing import network
+from modules.processing.network import Pcap, TcpStream, StreamBudget, is_whitelisted
+
+CLIENT = "192.168.56.101"
+SERVER = "10.0.0.1"
+
+def ethernet(src, dst, transport):
+    ip = dpkt.ip.IP(src=socket.inet_aton(src), dst=socket.inet_aton(dst),
+                    p=dpkt.ip.IP_PROTO_TCP if isinstance(transport, dpkt.tcp.TCP) else dpkt.ip.IP_PROTO_UDP,
+                    data=transport)
+    ip.len = len(ip)
+    return str(dpkt.ethernet.Ethernet(data=ip))
+
+def segment(sport, dport, seq, data="", flags=dpkt.tcp.TH_ACK):
+    return dpkt.tcp.TCP(sport=sport, dport=dport, seq=seq, flags=flags, data=data)
+
+class TestTcpStream:
+    def test_in_order(self):
+        stream = TcpStream()
+        stream.add(99, "", syn=True)
+        stream.add(100, "abc")
+        stream.add(103, "def")
+        assert_equals("abcdef", stream.data)
+
+    def test_out_of_order_and_retransmission(self):
+        stream = TcpStream()
+        stream.add(0xfffffffe, "", syn=True)
+        stream.add(2, "def")
+        stream.add(0xffffffff, "abc")
+        stream.add(0, "bcdefg")
+        assert_equals("abcdefg", stream.data)
+        assert_equals(0, len(stream.pending))
+
+    def test_size_limit(self):
+        stream = TcpStream(size_limit=4)
+        stream.add(0, "abc")
+        stream.add(3, "def")
+        assert_equals("abcd", stream.data)
+        assert stream.truncated
+
+    def test_budget(self):
+        budget = StreamBudget(8)
+        first, second = TcpStream(budget=budget), TcpStream(budget=budget)
+        first.add(0, "abcd")
+        # Out of order segments count too.
+        first.add(8, "ij")
+        second.add(0, "efgh")
+        assert_equals("ef", second.data)
+        assert second.truncated
+        assert_equals(0, budget.available)
+
+        first.release()
+        assert_equals(6, budget.available)
+        first.add(4, "efgh")
+        assert_equals("", first.data)
+
+def test_is_whitelisted():
+    whitelist = frozenset(["example.com"])
+    assert is_whitelisted("example.com", whitelist)
+    assert is_whitelisted("WWW.Example.com.", whitelist)
+    assert not is_whitelisted("badexample.com", whitelist)
+    assert not is_whitelisted("example.com.evil", whitelist)
+
+class TestPcap:
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".pcap")
+        self.fd = os.fdopen(fd, "wb")
+        self.writer = dpkt.pcap.Writer(self.fd)
+        self.ts = 1000.0
+
+    def write(self, src, dst, transport):
+        self.ts += 1
+        self.writer.writepkt(ethernet(src, dst, transport), self.ts)
+
+    def test_flows(self):
+        request = "GET /a HTTP/1.1\r\nHost: example.com\r\n\r\n" \
+                  "GET /b HTTP/1.1\r\nHost: example.com\r\n\r\n"
+
+        self.write(CLIENT, SERVER, segment(1025, 80, 0, flags=dpkt.tcp.TH_SYN))
+        self.write(SERVER, CLIENT, segment(80, 1025, 500, flags=dpkt.tcp.TH_SYN | dpkt.tcp.TH_ACK))
+        # The request is split, out of order and partly retransmitted.
+        self.write(CLIENT, SERVER, segment(1025, 80, 21, request[20:]))
+        self.write(CLIENT, SERVER, segment(1025, 80, 1, request[:30]))
+        self.write(SERVER, CLIENT, segment(80, 1025, 501, "HTTP/1.1 200 OK\r\n\r\n"))
+        self.write(CLIENT, SERVER, segment(1025, 80, 1 + len(request), flags=dpkt.tcp.TH_FIN | dpkt.tcp.TH_ACK))
+        self.write(SERVER, CLIENT, segment(80, 1025, 520, flags=dpkt.tcp.TH_FIN | dpkt.tcp.TH_ACK))
+        self.write(CLIENT, SERVER, segment(1025, 80, 2 + len(request)))
+        # Same ports, new connection.
+        self.write(CLIENT, SERVER, segment(1025, 80, 5000, flags=dpkt.tcp.TH_SYN))
+        for i in range(3):
+            self.write(CLIENT, SERVER, dpkt.udp.UDP(sport=1026, dport=9999, data="x"))
+        self.fd.close()
+
+        results = Pcap(self.path).run()
+
+        assert_equals(2, len(results["tcp"]))
+        first = results["tcp"][0]
+        assert_equals((CLIENT, 1025, SERVER, 80),
+                      (first["src"], first["sport"], first["dst"], first["dport"]))
+        assert_equals(8, first["packets"])
+        assert_equals(len(request) + 10 + 19, first["bytes"])
+        assert_equals((1001.0, 1008.0), (first["first_seen"], first["last_seen"]))
+        assert_equals(1, results["tcp"][1]["packets"])
+
+        assert_equals(["/a", "/b"], [http["path"] for http in results["http"]])
+        assert_equals("example.com", results["http"][1]["host"])
+
+        assert_equals(1, len(results["udp"]))
+        assert_equals(3, results["udp"][0]["packets"])
+        assert_equals([CLIENT, SERVER], results["hosts"])
+
+    def test_irc(self):
+        self.write(CLIENT, SERVER, segment(1030, 6667, 0, flags=dpkt.tcp.TH_SYN))
+        self.write(CLIENT, SERVER, segment(1030, 6667, 1, "NICK bot\r\nJOIN #c"))
+        self.write(SERVER, CLIENT, segment(6667, 1030, 0, ":irc.test 001 bot :Welcome\r\n"))
+        self.write(CLIENT, SERVER, segment(1030, 6667, 18, "hannel\r\n"))
+        self.fd.close()
+
+        results = Pcap(self.path).run()
+        assert_equals([("client", "NICK"), ("client", "JOIN"), ("server", "001")],
+                      [(irc["type"], irc["command"]) for irc in results["irc"]])
+        assert_equals("#channel", results["irc"][1]["params"])
+
+    def test_server_stream_released(self):
+        request = "GET / HTTP/1.1\r\nHost: example.com\r\n\r\n"
+        self.write(CLIENT, SERVER, segment(1025, 80, 0, flags=dpkt.tcp.TH_SYN))
+        self.write(CLIENT, SERVER, segment(1025, 80, 1, request))
+        self.write(SERVER, CLIENT, segment(80, 1025, 0, "HTTP/1.1 200 OK\r\n\r\n"))
+        self.fd.close()
+
+        pcap = Pcap(self.path)
+        total = pcap.stream_budget.available
+        results = pcap.run()
+        assert_equals(["/"], [http["path"] for http in results["http"]])
+        assert not pcap.tcp_connections[0].irc
+        assert_equals(total, pcap.stream_budget.available)
+
+    def test_irc_detection_incremental(self):
+        fed = []
+        class CountingParser(IRCParser):
+            def feed(self, data):
+                fed.append(len(data))
+                IRCParser.feed(self, data)
+
+        self.write(CLIENT, SERVER, segment(1030, 6667, 0, flags=dpkt.tcp.TH_SYN))
+        for i in range(1000):
+            self.write(CLIENT, SERVER, segment(1030, 6667, 1 + i, "x"))
+        self.fd.close()
+
+        network.IRCParser = CountingParser
+        try:
+            Pcap(self.path).run()
+        finally:
+            network.IRCParser = IRCParser
+        # Every byte is parsed once to detect IRC, and once by _add_irc.
+        assert_equals(2000, sum(fed))
+
+    def test_closed_on_error(self):
+        class FailingPcap(Pcap):
+            def _tcp_packet(self, ts, src, dst, tcp):
+                raise RuntimeError("dissector failure")
+
+        self.write(CLIENT, SERVER, segment(1025, 80, 0, flags=dpkt.tcp.TH_SYN))
+        self.fd.close()
+
+        saved = pcapscan.HAVE_NUMPY
+        for have_numpy in (saved, False):
+            pcapscan.HAVE_NUMPY = have_numpy
+            try:
+                FailingPcap(self.path).run()
+            except RuntimeError:
+                pass
+            else:
+                assert False, "the dissector failure was swallowed"
+            finally:
+                pcapscan.HAVE_NUMPY = saved
+
+            # Neither the file nor its memory map are left open.
+            assert self.path not in open("/proc/self/maps").read()
+            fds = [os.path.join("/proc/self/fd", fd) for fd in os.listdir("/proc/self/fd")]
+            assert self.path not in [os.path.realpath(fd) for fd in fds]
+
+    def test_domains(self):
+        pcap = Pcap(self.path)
+        pcap.whitelist = frozenset(["example.org"])
+        for domain in ("a.test", "b.test", "a.test", "www.example.org",
+                       "update.windows.com", "1.0.0.10.in-addr.arpa"):
+            pcap._add_domain(domain)
+        assert_equals(["a.test", "b.test"], [entry["domain"] for entry in pcap.unique_domains])
+
+        pcap._add_hosts({"src": CLIENT, "dst": SERVER})
+        pcap._add_hosts({"src": SERVER, "dst": CLIENT})
+        assert_equals([CLIENT, SERVER], pcap.unique_hosts)
+
+    def tearDown(self):
+        if not self.fd.closed:
+            self.fd.close()
+        os.remove(self.path)
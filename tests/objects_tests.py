@@ -5,9 +5,12 @@
 import os
 import tempfile
 import copy
+import json
+import pickle
 from nose.tools import assert_equal, raises, assert_not_equal
 
-from lib.dragon.common.objects import Dictionary, File, LocalDict
+from lib.dragon.common.objects import Dictionary, File
+from lib.dragon.common.objects import Argument, Call, StringTable, json_default
 
 class TestDictionary:
     def setUp(self):
@@ -23,6 +26,48 @@ class TestDictionary:
     def test_exception(self):
         self.d.b.a
 
+class TestCall:
+    def setUp(self):
+        self.call = Call("2013-01-01 00:00:00,000", "1", "filesystem", "NtDeleteFile",
+                         True, "0x00000000", [Argument("FileName", "C:\\foo")])
+        self.dict = {"timestamp": "2013-01-01 00:00:00,000",
+                     "thread_id": "1",
+                     "category": "filesystem",
+                     "api": "NtDeleteFile",
+                     "status": True,
+                     "return": "0x00000000",
+                     "arguments": [{"name": "FileName", "value": "C:\\foo"}],
+                     "repeated": 0}
+
+    def test_mapping(self):
+        assert_equal("NtDeleteFile", self.call["api"])
+        assert_equal("0x00000000", self.call["return"])
+        assert_equal("C:\\foo", self.call["arguments"][0]["value"])
+        assert_equal(None, self.call.get("foo"))
+        assert "repeated" in self.call
+        self.call["repeated"] += 1
+        assert_equal(1, self.call["repeated"])
+
+    @raises(KeyError)
+    def test_missing(self):
+        self.call["foo"]
+
+    def test_dict(self):
+        assert_equal(self.dict, self.call.to_dict())
+        assert self.call == self.dict
+        assert_equal(json.dumps(self.dict, sort_keys=True),
+                     json.dumps(self.call, sort_keys=True, default=json_default))
+
+    def test_pickle(self):
+        for protocol in (0, 2):
+            assert_equal(self.call, pickle.loads(pickle.dumps(self.call, protocol)))
+
+    def test_intern(self):
+        strings = StringTable()
+        a = strings.intern("".join(["Han", "dle"]))
+        b = strings.intern("".join(["Hand", "le"]))
+        assert a is b
+
 class TestLocalDict:
     def setUp(self):
         self.orig = {}
@@ -0,0 +1,80 @@
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import os
+import socket
+import tempfile
+import dpkt
+from nose.tools import assert_equals, raises
+
+from lib.dragon.common import pcapscan
+from lib.dragon.common.exceptions import CuckooOperationalError
+from lib.dragon.common.pcapscan import PcapScanner
+from modules.processing.network import Pcap
+from network_tests import ethernet, segment, CLIENT, SERVER
+
+class TestPcapScanner:
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".pcap")
+        with os.fdopen(fd, "wb") as pcap:
+            writer = dpkt.pcap.Writer(pcap)
+            frames = [
+                ethernet(CLIENT, SERVER, segment(1025, 80, 0, flags=dpkt.tcp.TH_SYN)),
+                ethernet(CLIENT, SERVER, segment(1025, 80, 1, "GET / HTTP/1.0\r\n\r\n")),
+                ethernet(CLIENT, SERVER, dpkt.udp.UDP(sport=1026, dport=53, data="query")),
+                # ARP.
+                str(dpkt.ethernet.Ethernet(type=dpkt.ethernet.ETH_TYPE_ARP, data=dpkt.arp.ARP())),
+                # ICMP.
+                str(dpkt.ethernet.Ethernet(data=dpkt.ip.IP(src=socket.inet_aton(CLIENT),
+                                                           dst=socket.inet_aton(SERVER),
+                                                           p=dpkt.ip.IP_PROTO_ICMP,
+                                                           data=dpkt.icmp.ICMP()))),
+                # IPv6, left to dpkt.
+                str(dpkt.ethernet.Ethernet(type=dpkt.ethernet.ETH_TYPE_IP6,
+                                           data=dpkt.ip6.IP6(src="\0" * 15 + "\1",
+                                                             dst="\0" * 15 + "\2",
+                                                             nxt=dpkt.ip.IP_PROTO_UDP,
+                                                             data=dpkt.udp.UDP(sport=1, dport=2, data="v6")))),
+                # Truncated.
+                "\0" * 10,
+            ]
+            for index, frame in enumerate(frames):
+                writer.writepkt(frame, 1000 + index * 0.5)
+
+    def test_packets(self):
+        scanner = PcapScanner(self.path, batch_size=3)
+        packets = list(scanner)
+        scanner.close()
+
+        assert_equals([pcapscan.TCP, pcapscan.TCP, pcapscan.UDP, pcapscan.IP, pcapscan.RAW],
+                      [packet[1] for packet in packets])
+        assert_equals([1000.0, 1000.5, 1001.0, 1002.0, 1002.5], [packet[0] for packet in packets])
+
+        ts, kind, src, dst, tcp = packets[1]
+        assert_equals((CLIENT, SERVER), (src, dst))
+        assert_equals((1025, 80, 1, dpkt.tcp.TH_ACK), (tcp.sport, tcp.dport, tcp.seq, tcp.flags))
+        assert_equals("GET / HTTP/1.0\r\n\r\n", tcp.data)
+        assert_equals("query", packets[2][4].data)
+
+    def test_same_results(self):
+        """The scanner gives the results of dpkt."""
+        scanned = Pcap(self.path).run()
+        pcapscan.HAVE_NUMPY = False
+        try:
+            decoded = Pcap(self.path).run()
+        finally:
+            pcapscan.HAVE_NUMPY = True
+
+        assert_equals(decoded, scanned)
+        assert_equals(["/"], [http["path"] for http in scanned["http"]])
+        assert_equals(2, len(scanned["udp"]))
+
+    @raises(CuckooOperationalError)
+    def test_not_pcap(self):
+        with open(self.path, "wb") as pcap:
+            pcap.write("\0" * 64)
+        PcapScanner(self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
@@ -3,10 +3,12 @@
 # See the file 'docs/LICENSE' for copying permission.
 
 import os
+import time
 import tempfile
 from nose.tools import assert_equals
 
 from lib.dragon.core.processor import Processor
+from lib.dragon.common.config import Config
 from lib.dragon.common.constants import CUCKOO_VERSION
 from lib.dragon.common.abstracts import Processing, Signature
 
@@ -38,6 +40,85 @@ class TestProcessor:
     def tearDown(self):
         os.rmdir(self.tmp)
 
+class ProcessorMock(Processor):
+    def __init__(self):
+        # Skip the task lookup, the mock modules don't need one.
+        self.cfg = Config()
+        self.cfg.processing.module_threads = 4
+        self.task = {}
+        self.analysis_path = tempfile.gettempdir()
+
+class TestRunAllProcessing:
+    def setUp(self):
+        self.p = ProcessorMock()
+
+    def test_requires(self):
+        start = time.time()
+        results, timings = self.p._run_all_processing([SlowMock, OtherSlowMock, RequiringMock])
+        assert time.time() - start < 0.6
+        assert_equals({"slow" : 1, "other" : 2, "sum" : 3}, results)
+        assert_equals("RequiringMock", timings[-1]["name"])
+
+    def test_circular(self):
+        results, timings = self.p._run_all_processing([SlowMock, CircularMock])
+        assert_equals({"slow" : 1}, results)
+
+class TestEventedSignatures:
+    def setUp(self):
+        self.p = ProcessorMock()
+        calls = [{"api" : "NtCreateFile", "category" : "filesystem", "arguments" : []},
+                 {"api" : "RegOpenKeyExA", "category" : "registry", "arguments" : []},
+                 {"api" : "NtCreateFile", "category" : "filesystem", "arguments" : []}]
+        self.results = {"behavior" : {"processes" : [{"process_name" : "foo.exe", "calls" : calls},
+                                                     {"process_name" : "bar.exe", "calls" : calls}]}}
+
+    def _run(self, *signatures):
+        for signature in signatures:
+            signature.calls = 0
+        instances = [self.p._load_signature(signature, self.results) for signature in signatures]
+        return [match["name"] for match in self.p._run_evented_signatures(instances, self.results)]
+
+    def test_filters(self):
+        assert_equals(["api"], self._run(ApiEventedMock))
+        assert_equals(4, ApiEventedMock.calls)
+        assert_equals(["category"], self._run(CategoryEventedMock))
+        assert_equals(1, CategoryEventedMock.calls)
+        assert_equals(["process"], self._run(ProcessEventedMock))
+        assert_equals(3, ProcessEventedMock.calls)
+
+    def test_stop(self):
+        assert_equals(["match"], self._run(MatchEventedMock))
+        assert_equals(1, MatchEventedMock.calls)
+        assert_equals(["api"], self._run(ApiEventedMock, FailingEventedMock))
+
+class SlowMock(Processing):
+    key = "slow"
+
+    def run(self):
+        time.sleep(0.3)
+        return 1
+
+class OtherSlowMock(SlowMock):
+    key = "other"
+
+    def run(self):
+        time.sleep(0.3)
+        return 2
+
+class RequiringMock(Processing):
+    key = "sum"
+    requires = ["slow", "other"]
+
+    def run(self):
+        return self.results["slow"] + self.results["other"]
+
+class CircularMock(Processing):
+    key = "circular"
+    requires = ["circular"]
+
+    def run(self):
+        return True
+
 class ProcessingMock(Processing):
     def run(self):
         self.key = "foo"
@@ -68,3 +149,41 @@ class SignatureWrongVersionMock(SignatureMock):
     minimum = "0.0..-abc"
     maximum = "0.0..-abc"
 
+class EventedMock(SignatureMock):
+    evented = True
+    calls = 0
+
+    def on_call(self, call, process):
+        self.__class__.calls += 1
+
+    def on_complete(self):
+        return True
+
+class ApiEventedMock(EventedMock):
+    name = "api"
+    filter_apinames = set(["NtCreateFile"])
+
+class CategoryEventedMock(EventedMock):
+    name = "category"
+    filter_categories = set(["registry"])
+    filter_processnames = set(["foo.exe"])
+
+class ProcessEventedMock(EventedMock):
+    name = "process"
+    filter_processnames = set(["bar.exe"])
+
+class MatchEventedMock(EventedMock):
+    name = "match"
+
+    def on_call(self, call, process):
+        self.__class__.calls += 1
+        return call["api"] == "NtCreateFile"
+
+    def on_complete(self):
+        return False
+
+class FailingEventedMock(EventedMock):
+    name = "failing"
+
+    def on_call(self, call, process):
+        raise Exception("foo")
@@ -3,6 +3,7 @@
 # See the file 'docs/LICENSE' for copying permission.
 
 import os
+import time
 import tempfile
 from nose.tools import assert_equals
 
@@ -41,6 +42,74 @@ enabled = on
         os.rmdir(self.tmp)
         os.remove(self.cfg)
 
+class ReporterMock(Reporter):
+    def __init__(self, cfg):
+        # Skip the task lookup, the mock modules don't need one.
+        self.task = {}
+        self.analysis_path = tempfile.mkdtemp()
+        self.cfg = Config(cfg)
+
+class TestRunAllReports:
+    CONFIG = """
+[reporter_tests]
+enabled = on
+timeout = 1
+"""
+
+    def setUp(self):
+        self.cfg = tempfile.mkstemp()[1]
+        f = open(self.cfg, "w")
+        f.write(self.CONFIG)
+        f.close()
+        self.r = ReporterMock(self.cfg)
+        ReportSleepMock.completed = []
+
+    def test_order_barrier(self):
+        results = {}
+        timings = []
+        start = time.time()
+        self.r._run_all_reports([ReportSleepMock, OtherReportSleepMock, ReportCheckMock],
+                                results, timings, 4, 10)
+        assert time.time() - start < 0.55
+        assert_equals(["ReportSleepMock", "OtherReportSleepMock", "ReportCheckMock"],
+                      [timing["name"] for timing in timings])
+        assert_equals(2, results["checked"])
+
+    def test_timeout(self):
+        results = {}
+        timings = []
+        self.r._run_all_reports([ReportTimeoutMock, ReportCheckMock], results, timings, 4, 10)
+        assert timings[0]["timeout"]
+        assert_equals(0, results["checked"])
+
+    def test_timeouts_not_added(self):
+        """Modules running together time out together."""
+        timings = []
+        start = time.time()
+        self.r._run_all_reports([ReportTimeoutMock, OtherReportTimeoutMock], {}, timings, 4, 10)
+        assert time.time() - start < 1.4
+        assert_equals([True, True], [timing["timeout"] for timing in timings])
+        assert 1 <= timings[1]["time"] < 1.4
+
+    def test_queued_not_timed_out(self):
+        """Modules waiting for a thread get their time once started, and
+        the following orders still wait for them."""
+        results = {}
+        timings = []
+        self.r._run_all_reports([ReportTimeoutMock, ReportSleepMock, ReportCheckMock],
+                                results, timings, 1, 10)
+        assert_equals(["ReportTimeoutMock", "ReportSleepMock", "ReportCheckMock"],
+                      [timing["name"] for timing in timings])
+        assert timings[0]["timeout"]
+        assert "timeout" not in timings[1]
+        assert timings[1]["time"] < 0.5
+        assert_equals(1, results["checked"])
+
+    def tearDown(self):
+        os.rmdir(os.path.join(self.r.analysis_path, "reports"))
+        os.rmdir(self.r.analysis_path)
+        os.remove(self.cfg)
+
 class ReportMock(Report):
     def run(self, data):
         return
@@ -49,4 +118,26 @@ class ReportAlterMock(Report):
     """Corrupts results dict."""
     def run(self, data):
         data['foo'] = 'notbar'
-        return
\ No newline at end of file
+        return
+class ReportSleepMock(Report):
+    completed = []
+
+    def run(self, data):
+        time.sleep(0.25)
+        ReportSleepMock.completed.append(self.__class__.__name__)
+
+class OtherReportSleepMock(ReportSleepMock):
+    pass
+
+class ReportCheckMock(Report):
+    order = 2
+
+    def run(self, data):
+        data["checked"] = len(ReportSleepMock.completed)
+
+class ReportTimeoutMock(Report):
+    def run(self, data):
+        time.sleep(1.5)
+
+class OtherReportTimeoutMock(ReportTimeoutMock):
+    pass
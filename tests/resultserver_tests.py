@@ -0,0 +1,222 @@
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import os
+import struct
+import socket
+import shutil
+import time
+import tempfile
+from threading import Thread
+from nose.tools import assert_equals
+
+from lib.dragon.common.config import Config
+from lib.dragon.common.utils import Singleton
+from lib.dragon.core.resultserver import ReadBuffer, Resulthandler, BufferedResulthandler
+from lib.dragon.core.resultserver import AsyncResultserver, AsyncResulthandler
+
+
+def netlog_string(s):
+    return struct.pack("II", len(s), len(s)) + s
+
+def netlog_stream():
+    """Builds a netlog stream: a process, a thread and a few API calls."""
+    data = struct.pack("=BBIII", 0, 0, 0, 0, 0)
+    # FILETIME of 2013-01-01.
+    filetime = 130013280000000000
+    data += struct.pack("IIII", filetime & 0xffffffff, filetime >> 32, 1234, 4)
+    data += netlog_string("C:\\sample.exe")
+    data += struct.pack("=BBIII", 1, 0, 0, 1, 0)
+    data += struct.pack("I", 1234)
+    for i in range(100):
+        # NtDeleteFile, 'O' FileName.
+        data += struct.pack("=BBIII", 2, 1, 0, 1, i)
+        data += netlog_string("C:\\file%d.txt" % i)
+    return data
+
+class ServerMock(object):
+    def __init__(self, storagepath):
+        self.cfg = Config()
+        self.storagepath = storagepath
+        self.calls = []
+
+    def register_handler(self, handler):
+        return True
+
+    def build_storage_path(self, ip):
+        return self.storagepath
+
+def record_calls(handler):
+    class RecordingHandler(handler):
+        def log_call(self, context, apiname, modulename, arguments):
+            self.server.calls.append((context, apiname, arguments))
+            handler.log_call(self, context, apiname, modulename, arguments)
+    return RecordingHandler
+
+class TestReadBuffer:
+    def setUp(self):
+        self.a, self.b = socket.socketpair()
+
+    def test_take(self):
+        buf = ReadBuffer(16)
+        self.a.sendall("foo\nbar")
+        buf.recv_from(self.b)
+        assert_equals(4, buf.find("\n"))
+        assert_equals("foo\n", buf.take(4))
+        assert_equals(-1, buf.find("\n"))
+        assert_equals("foo\n", buf.pending().tobytes())
+        buf.release()
+        assert_equals("", buf.pending().tobytes())
+
+    def test_grow(self):
+        buf = ReadBuffer(16)
+        data = "".join(chr(i) for i in range(100))
+        self.a.sendall(data)
+        while len(buf) < 100:
+            buf.recv_from(self.b)
+        assert_equals(data, buf.take(100))
+
+    def test_unpack(self):
+        buf = ReadBuffer(16)
+        self.a.sendall(struct.pack("II", 1, 2))
+        buf.recv_from(self.b)
+        assert_equals((1, 2), buf.unpack(struct.Struct("II")))
+        assert_equals(0, len(buf))
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+
+class TestBufferedResulthandler:
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def _run(self, handler):
+        server = ServerMock(self.tmp)
+        a, b = socket.socketpair()
+        data = netlog_stream()
+
+        def send():
+            a.sendall("NETLOG\n")
+            # Small chunks to exercise messages split across reads.
+            for i in range(0, len(data), 7):
+                a.sendall(data[i:i + 7])
+            a.close()
+
+        sender = Thread(target=send)
+        sender.start()
+        record_calls(handler)(b, ("127.0.0.1", 0), server)
+        sender.join()
+        b.close()
+        return data, server.calls
+
+    def test_same_as_plain(self):
+        data, calls = self._run(Resulthandler)
+        raw = open(os.path.join(self.tmp, "logs", "1234.raw"), "rb").read()
+        buffered_data, buffered_calls = self._run(BufferedResulthandler)
+        buffered_raw = open(os.path.join(self.tmp, "logs", "1234.raw"), "rb").read()
+
+        assert_equals(100, len(calls))
+        assert_equals(calls, buffered_calls)
+        assert_equals(raw, buffered_raw)
+        assert_equals(data, buffered_raw)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+class TestAsyncResulthandler:
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.a, self.b = socket.socketpair()
+
+    def test_large_field(self):
+        class CountingHandler(AsyncResulthandler):
+            attempts = 0
+            def fill(self, length=1):
+                CountingHandler.attempts += 1
+                AsyncResulthandler.fill(self, length)
+
+        data = netlog_stream()
+        data += struct.pack("=BBIII", 2, 1, 0, 1, 100)
+        data += netlog_string("C:\\" + "x" * 200000)
+        stream = "NETLOG\n" + data
+
+        handler = CountingHandler(self.b, ("127.0.0.1", 0), ServerMock(self.tmp))
+        assert handler.start()
+        # The protocol line is split too.
+        pieces = [stream[:3]] + [stream[i:i + 1000] for i in range(3, len(stream), 1000)]
+        for piece in pieces:
+            self.a.sendall(piece)
+            while len(piece):
+                piece = piece[handler.rbuf.recv_from(self.b):]
+            assert handler.feed()
+        handler.close()
+
+        # Not decoded again for every piece of the large field.
+        assert CountingHandler.attempts < 10
+        assert_equals(data, open(os.path.join(self.tmp, "logs", "1234.raw"), "rb").read())
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+        shutil.rmtree(self.tmp)
+
+class AsyncResultserverMock(AsyncResultserver):
+    def __init__(self, storagepath):
+        self.storagepath = storagepath
+        AsyncResultserver.__init__(self, ("127.0.0.1", 0))
+        self.cfg.resultserver.upload_max_size = 1024 * 1024
+        self.handlers = []
+
+    def register_handler(self, handler):
+        self.handlers.append(handler)
+
+    def build_storage_path(self, ip):
+        return self.storagepath
+
+class TestAsyncResultserver:
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.server = AsyncResultserverMock(self.tmp)
+        self.port = self.server.socket.getsockname()[1]
+
+    def _send(self, data):
+        sock = socket.create_connection(("127.0.0.1", self.port))
+        for i in range(0, len(data), 1000):
+            sock.sendall(data[i:i + 1000])
+        sock.close()
+
+    def test_streams(self):
+        data = netlog_stream()
+        upload = "".join(chr(i % 256) for i in range(50000))
+        senders = [Thread(target=self._send, args=("NETLOG\n" + data,)),
+                   Thread(target=self._send, args=("FILE\nfiles/foo.bin\n" + upload,)),
+                   Thread(target=self._send, args=("LOG\nfoo\nbar\n",))]
+        for sender in senders:
+            sender.start()
+        for sender in senders:
+            sender.join()
+
+        for handler in self.server.handlers:
+            assert handler.done_event.wait(5)
+
+        assert_equals(data, open(os.path.join(self.tmp, "logs", "1234.raw"), "rb").read())
+        assert_equals(upload, open(os.path.join(self.tmp, "files", "foo.bin"), "rb").read())
+        assert_equals("foo\nbar\n", open(os.path.join(self.tmp, "analysis.log"), "rb").read())
+
+    def test_end_request(self):
+        sock = socket.create_connection(("127.0.0.1", self.port))
+        sock.sendall("NETLOG\n")
+        while not self.server.handlers:
+            time.sleep(0.1)
+
+        handler = self.server.handlers[0]
+        handler.end_request.set()
+        assert handler.done_event.wait(5)
+        sock.close()
+
+    def tearDown(self):
+        self.server.shutdown()
+        Singleton._instances.pop(AsyncResultserverMock, None)
+        shutil.rmtree(self.tmp)
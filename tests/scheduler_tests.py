@@ -0,0 +1,91 @@
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import time
+import threading
+from nose.tools import assert_equals
+
+from lib.dragon.core import scheduler
+from lib.dragon.core.scheduler import AnalysisManager, Scheduler
+from lib.dragon.common.objects import Dictionary
+
+
+class MachineManagerMock(object):
+    def __init__(self, machines):
+        self.free = list(machines)
+
+    def availables(self):
+        return len(self.free)
+
+    def acquire(self, machine_id=None, platform=None):
+        if self.free:
+            return Dictionary(name=self.free.pop(), label="", ip="")
+        return None
+
+    def release(self, label):
+        self.free.append(label)
+
+class DatabaseMock(object):
+    def __init__(self, tasks):
+        self.tasks = list(tasks)
+
+    def fetch_and_process_batch(self, limit):
+        tasks, self.tasks = self.tasks[:limit], self.tasks[limit:]
+        return tasks
+
+class AnalysisManagerMock(AnalysisManager):
+    started = []
+
+    def run(self):
+        AnalysisManagerMock.started.append(self.task.id)
+        self.stop_waiting_machine()
+
+class SchedulerMock(Scheduler):
+    def __init__(self, tasks):
+        # Skip the configuration and database setup.
+        self.running = True
+        self.db = DatabaseMock(tasks)
+        self.analyses = []
+
+def task(task_id):
+    return Dictionary(id=task_id, machine=None, platform=None)
+
+class TestScheduler:
+    def setUp(self):
+        self.mmanager = scheduler.mmanager
+        self.manager = scheduler.AnalysisManager
+        AnalysisManagerMock.started = []
+
+    def test_acquire_wakes_on_release(self):
+        scheduler.mmanager = MachineManagerMock([])
+        analysis = AnalysisManager(task(1))
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(analysis.acquire_machine()))
+        thread.start()
+
+        time.sleep(0.1)
+        start = time.time()
+        with scheduler.machine_lock:
+            scheduler.mmanager.release("vm1")
+            scheduler.machine_lock.notify_all()
+        thread.join(2)
+
+        assert time.time() - start < 0.5
+        assert_equals("vm1", acquired[0].name)
+        assert_equals(0, scheduler.machine_waiters)
+
+    def test_dispatch_fills_machines(self):
+        scheduler.mmanager = MachineManagerMock(["vm1", "vm2", "vm3"])
+        scheduler.AnalysisManager = AnalysisManagerMock
+        s = SchedulerMock([task(i) for i in range(5)])
+
+        assert_equals(3, s.dispatch())
+        time.sleep(0.1)
+        assert_equals([0, 1, 2], sorted(AnalysisManagerMock.started))
+        assert_equals([0, 1, 2], [analysis.task.id for analysis in s.analyses])
+        assert_equals(0, scheduler.machine_waiters)
+
+    def tearDown(self):
+        scheduler.mmanager = self.mmanager
+        scheduler.AnalysisManager = self.manager
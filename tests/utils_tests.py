@@ -3,6 +3,7 @@
 # See the file 'docs/LICENSE' for copying permission.
 
 import os
+import string
 import tempfile
 from nose.tools import assert_equal, raises, assert_not_equal
 from lib.dragon.common.objects import File
@@ -75,6 +76,15 @@ class TestConvertToPrintable:
     def test_non_printable(self):
         assert_equal("\x0b", utils.convert_to_printable(chr(11)))
 
+    def test_all_bytes(self):
+        data = "".join(chr(i) for i in range(256))
+        expected = "".join(c if c in string.printable else "\\x%02x" % ord(c) for c in data)
+        assert_equal(expected, utils.convert_to_printable(data))
+
+    def test_unchanged(self):
+        data = "C:\\WINDOWS\\system32\\kernel32.dll"
+        assert utils.convert_to_printable(data) is data
+
 class TestDatetimeToIso:
     def test_convert_date(self):
         assert_equal("2000-01-01T11:43:35", utils.datetime_to_iso("2000-01-01 11:43:35"))
@@ -5,8 +5,10 @@
 
 import os
 import sys
+import gzip
 import json
 import argparse
+from datetime import datetime
 
 try:
     from bottle import Bottle, route, run, request, server_names, ServerAdapter, hook, response, HTTPError
@@ -15,6 +17,7 @@ except ImportError:
 
 sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), ".."))
 
+from lib.dragon.common.binreport import BinaryReportReader
 from lib.dragon.common.constants import CUCKOO_ROOT
 from lib.dragon.common.utils import store_temp_file, delete_folder
 from lib.dragon.core.database import Database
@@ -30,6 +33,22 @@ def jsonize(data):
     response.content_type = "application/json; charset=UTF-8"
     return json.dumps(data, sort_keys=False, indent=4)
 
+def parse_date(value):
+    """Parses a date filter.
+    @param value: "YYYY-MM-DD" or "YYYY-MM-DD HH:MM:SS", may be empty.
+    @return: datetime or None.
+    @raise ValueError: if the date is invalid.
+    """
+    if not value:
+        return None
+
+    for date_format in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValueError("Invalid date %s" % value)
+
 @hook("after_request")
 def custom_headers():
     """Set some custom headers across all HTTP responses."""
@@ -41,6 +60,11 @@ def custom_headers():
     response.headers["Cache-Control"] = "no-cache"
     response.headers["Expires"] = "0"
 
+@hook("after_request")
+def end_session():
+    """Return the database connection of the request to the pool."""
+    db.end_session()
+
 @route("/tasks/create/file", method="POST")
 def tasks_create_file():
     response = {}
@@ -113,19 +137,47 @@ def tasks_create_url():
 def tasks_list(limit=None):
     response = {}
 
+    try:
+        if limit:
+            limit = int(limit)
+        before = request.query.get("before")
+        if before:
+            before = int(before)
+        added_after = parse_date(request.query.get("added_after"))
+        added_before = parse_date(request.query.get("added_before"))
+    except ValueError:
+        return HTTPError(400, "Invalid limit, before or date filter")
+
+    rows = db.list_tasks(limit=limit,
+                         before=before or None,
+                         status=request.query.get("status"),
+                         category=request.query.get("category"),
+                         added_after=added_after,
+                         added_before=added_before)
+    if rows is None:
+        return HTTPError(500, "Unable to list the tasks")
+
     response["tasks"] = []
-    for row in db.list_tasks(limit).all():
+    for row in rows:
         task = row.to_dict()
         task["guest"] = {}
         if row.guest:
             task["guest"] = row.guest.to_dict()
 
+        task["sample"] = {}
+        if row.sample:
+            task["sample"] = row.sample.to_dict()
+
         task["errors"] = []
         for error in row.errors:
             task["errors"].append(error.message)
 
         response["tasks"].append(task)
 
+    # The next page is requested with ?before=<next>.
+    if limit and len(rows) == limit:
+        response["next"] = rows[-1].id
+
     return jsonize(response)
 
 @route("/tasks/view/<task_id>", method="GET")
@@ -155,7 +207,7 @@ def tasks_delete(task_id):
 
     task = db.view_task(task_id)
     if task:
-        if task.status == "processing":
+        if task.status in ("processing", "reporting", "failed_reporting"):
             return HTTPError(500, "The task is currently being processed, cannot delete")
 
         if db.delete_task(task_id):
@@ -171,14 +223,13 @@ def tasks_delete(task_id):
 @route("/tasks/report/<task_id>", method="GET")
 @route("/tasks/report/<task_id>/<report_format>", method="GET")
 def tasks_report(task_id, report_format="json"):
-    response = {}
-
     formats = {
         "json" : "report.json",
         "html" : "report.html",
         "maec" : "report.maec-1.1.xml",
         "metadata" : "report.metadata.xml",
-        "pickle" : "report.pickle"
+        "pickle" : "report.pickle",
+        "bin" : "report.bin"
     }
 
     if report_format.lower() in formats:
@@ -191,11 +242,90 @@ def tasks_report(task_id, report_format="json"):
     else:
         return HTTPError(400, "Invalid report format")
 
+    # The JSON report may have been written compressed.
+    if not os.path.exists(report_path) and os.path.exists(report_path + ".gz"):
+        report_path += ".gz"
+        response.content_type = "application/json"
+        response.set_header("Content-Encoding", "gzip")
+
     if os.path.exists(report_path):
         return open(report_path, "rb").read()
     else:
         return HTTPError(404, "Report not found")
 
+@route("/tasks/report/<task_id>/section/<section>", method="GET")
+def tasks_report_section(task_id, section):
+    reports_path = os.path.join(CUCKOO_ROOT, "storage", "analyses", task_id, "reports")
+
+    # The JSON report index gives the section bytes, served as they are.
+    index_path = os.path.join(reports_path, "report.index.json")
+    if os.path.exists(index_path):
+        index = json.load(open(index_path, "rb"))
+        if section not in index["sections"]:
+            return HTTPError(404, "Section not found")
+
+        report_path = os.path.join(reports_path, index["file"])
+        if os.path.exists(report_path):
+            if report_path.endswith(".gz"):
+                report = gzip.open(report_path, "rb")
+            else:
+                report = open(report_path, "rb")
+            report.seek(index["sections"][section]["offset"])
+            data = report.read(index["sections"][section]["length"])
+            report.close()
+
+            response.content_type = "application/json; charset=UTF-8"
+            return data
+
+    report_path = os.path.join(reports_path, "report.bin")
+    if not os.path.exists(report_path):
+        return HTTPError(404, "Report not found")
+
+    report = BinaryReportReader(report_path)
+    try:
+        return jsonize(report.load(section, lazy=False))
+    except KeyError:
+        return HTTPError(404, "Section not found")
+    finally:
+        report.close()
+
+@route("/tasks/report/<task_id>/calls/<pid>", method="GET")
+def tasks_report_calls(task_id, pid):
+    try:
+        pid = int(pid)
+        page = int(request.query.get("page", 1))
+        size = int(request.query.get("size", 100))
+    except ValueError:
+        return HTTPError(400, "Invalid pid, page or size")
+
+    if page < 1 or size < 1 or size > 1000:
+        return HTTPError(400, "Page must be positive and size between 1 and 1000")
+
+    report_path = os.path.join(CUCKOO_ROOT, "storage", "analyses", task_id, "reports", "report.bin")
+    if not os.path.exists(report_path):
+        return HTTPError(404, "Binary report not found")
+
+    report = BinaryReportReader(report_path)
+    try:
+        behavior = report.load("behavior")
+        for process in behavior.get("processes", []):
+            if process["process_id"] == pid:
+                break
+        else:
+            return HTTPError(404, "Process not found")
+
+        response = {}
+        response["process_id"] = pid
+        response["page"] = page
+        response["size"] = size
+        response["total"] = len(process["calls"])
+        response["calls"] = process["calls"].slice((page - 1) * size, size)
+        return jsonize(response)
+    except KeyError:
+        return HTTPError(404, "Behavior section not found")
+    finally:
+        report.close()
+
 @route("/files/view/md5/<md5>", method="GET")
 @route("/files/view/sha256/<sha256>", method="GET")
 @route("/files/view/id/<sample_id>", method="GET")
@@ -251,6 +381,12 @@ def machines_view(name=None):
 
     return jsonize(response)
 
+@route("/database/status", method="GET")
+def database_status():
+    response = {}
+    response["pool"] = db.pool_status()
+    return jsonize(response)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-H", "--host", help="Host to bind the API server on", default="localhost", action="store", required=False)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import os
+import sys
+import time
+import random
+import shutil
+import urllib2
+import argparse
+import tempfile
+import threading
+import logging
+import SocketServer
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+logging.basicConfig()
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), ".."))
+
+from lib.dragon.common.utils import Singleton
+from lib.dragon.core.database import Database
+
+class ThreadingWSGIServer(SocketServer.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def bench(base_url, paths, threads, requests):
+    """Request the API from concurrent clients.
+    @return: list of latencies in seconds and number of failed requests.
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(seed):
+        rand = random.Random(seed)
+        measured = []
+        failed = 0
+        for i in xrange(requests):
+            start = time.time()
+            try:
+                urllib2.urlopen(base_url + rand.choice(paths)).read()
+            except urllib2.URLError:
+                failed += 1
+            measured.append(time.time() - start)
+        with lock:
+            latencies.extend(measured)
+            errors.append(failed)
+
+    workers = [threading.Thread(target=client, args=(i,)) for i in xrange(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies, sum(errors)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dsn", help="Database to benchmark against (default: temporary SQLite database)", required=False)
+    parser.add_argument("-p", "--pool-sizes", default="0,8", help="Comma separated pool sizes to compare, 0 for no pooling", required=False)
+    parser.add_argument("-t", "--tasks", type=int, default=500, help="Number of tasks to add", required=False)
+    parser.add_argument("-c", "--threads", type=int, default=8, help="Number of concurrent clients", required=False)
+    parser.add_argument("-r", "--requests", type=int, default=200, help="Number of requests per client", required=False)
+    args = parser.parse_args()
+
+    tmp = None
+    dsn = args.dsn
+    if not dsn:
+        tmp = tempfile.mkdtemp(prefix="bench_")
+        dsn = "sqlite:///%s" % os.path.join(tmp, "cuckoo.db")
+
+    db = Database(dsn=dsn, pool_size=0)
+    task_ids = [db.add_url("http://example.com/%d" % i) for i in xrange(args.tasks)]
+
+    import api
+    from bottle import default_app
+
+    server = make_server("127.0.0.1", 0, default_app(),
+                         server_class=ThreadingWSGIServer,
+                         handler_class=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    base_url = "http://127.0.0.1:%d" % server.server_port
+
+    paths = ["/tasks/list/50"] + ["/tasks/view/%d" % task_id for task_id in task_ids[:50]]
+    try:
+        for pool_size in [int(size) for size in args.pool_sizes.split(",")]:
+            Singleton._instances.pop(Database, None)
+            api.db = Database(dsn=dsn, pool_size=pool_size)
+
+            start = time.time()
+            latencies, errors = bench(base_url, paths, args.threads, args.requests)
+            elapsed = time.time() - start
+
+            print "pool_size=%-3d %6.0f req/s  mean %6.2fms  p50 %6.2fms  p95 %6.2fms  %d errors" % (
+                pool_size, len(latencies) / elapsed,
+                sum(latencies) / len(latencies) * 1000,
+                percentile(latencies, 0.5) * 1000,
+                percentile(latencies, 0.95) * 1000,
+                errors)
+            if pool_size:
+                print "              %s" % api.db.pool_status()
+    finally:
+        server.shutdown()
+        if tmp:
+            shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    main()
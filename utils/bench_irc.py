@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import os
+import sys
+import time
+import random
+import socket
+import tempfile
+import argparse
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), ".."))
+
+import dpkt
+from lib.dragon.common.irc import IRCParser
+from modules.processing.network import Pcap
+from bench_pcap import frame
+
+CLIENT = socket.inet_aton("192.168.56.101")
+SERVER = socket.inet_aton("10.0.0.1")
+
+def conversation(lines):
+    """Generate the streams of a bot talking to its server.
+    @param lines: number of lines per side.
+    @return: client and server streams.
+    """
+    client = ["NICK bot%d\r\n" % i if i % 10 == 0 else
+              "PRIVMSG #botnet :report %d scanning 10.0.%d.0/24\r\n" % (i, i % 256)
+              for i in xrange(lines)]
+    server = [":irc.botnet.test 266 bot :Current global users %d\r\n" % i if i % 10 == 0 else
+              ":master!m@c2.test PRIVMSG #botnet :.ddos 10.1.%d.1 80 %d\r\n" % (i % 256, i)
+              for i in xrange(lines)]
+    return "".join(client), "".join(server)
+
+def segments(data, size):
+    """Split a stream in segments of random sizes.
+    @param data: stream.
+    @param size: maximum segment size.
+    @return: list of segments.
+    """
+    result = []
+    offset = 0
+    while offset < len(data):
+        length = random.randint(1, size)
+        result.append(data[offset:offset + length])
+        offset += length
+    return result
+
+def write_capture(path, client, server, size):
+    """Write a capture of the conversation, the sides taking turns.
+    @param path: PCAP file path.
+    """
+    with open(path, "wb") as fd:
+        writer = dpkt.pcap.Writer(fd)
+        ts = 1e9
+        seqs = [1, 1]
+        streams = [segments(client, size), segments(server, size)]
+        for index in xrange(max(len(streams[0]), len(streams[1]))):
+            for side in (0, 1):
+                if index >= len(streams[side]):
+                    continue
+                data = streams[side][index]
+                if side == 0:
+                    tcp = dpkt.tcp.TCP(sport=1025, dport=6667, seq=seqs[0], flags=dpkt.tcp.TH_ACK, data=data)
+                    buf = frame(CLIENT, SERVER, tcp)
+                else:
+                    tcp = dpkt.tcp.TCP(sport=6667, dport=1025, seq=seqs[1], flags=dpkt.tcp.TH_ACK, data=data)
+                    buf = frame(SERVER, CLIENT, tcp)
+                seqs[side] += len(data)
+                ts += 0.0001
+                writer.writepkt(buf, ts)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-l", "--lines", type=int, default=100000, help="Number of lines per side", required=False)
+    parser.add_argument("-s", "--segment-size", type=int, default=512, help="Maximum segment size", required=False)
+    args = parser.parse_args()
+
+    random.seed(0)
+    client, server = conversation(args.lines)
+    size = (len(client) + len(server)) / (1024.0 * 1024.0)
+
+    sides = [(segments(client, args.segment_size), False),
+             (segments(server, args.segment_size), True)]
+
+    start = time.time()
+    messages = 0
+    for data, is_server in sides:
+        irc = IRCParser(server=is_server, filters=["266"])
+        for segment in data:
+            irc.feed(segment)
+        messages += len(irc.close())
+    elapsed = time.time() - start
+    print "%-8s %8.3fs %8.1f MB/s %10.0f lines/s %8d messages" % ("parser", elapsed, size / elapsed,
+                                                               2 * args.lines / elapsed, messages)
+
+    fd, path = tempfile.mkstemp(suffix=".pcap")
+    os.close(fd)
+    try:
+        write_capture(path, client, server, args.segment_size)
+        start = time.time()
+        pcap = Pcap(path)
+        # Reassemble the whole conversation, whatever the configured limit.
+        pcap.stream_size = max(len(client), len(server))
+        results = pcap.run()
+        elapsed = time.time() - start
+        print "%-8s %8.3fs %8.1f MB/s %10.0f lines/s %8d messages" % ("pcap", elapsed, size / elapsed,
+                                                                   2 * args.lines / elapsed, len(results["irc"]))
+    finally:
+        os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), ".."))
+
+from bson import BSON
+from lib.dragon.common.objects import Argument, Call, Record
+from modules.reporting.mongodb import MongoDB, get_client
+
+class StandInCollection(object):
+    """Stand-in for a local mongod collection: every request costs a round
+    trip and the documents are BSON encoded."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.documents = 0
+
+    def _request(self, documents):
+        for document in documents:
+            BSON.encode(document)
+        self.documents += len(documents)
+        time.sleep(self.latency)
+
+    def insert_one(self, document):
+        self._request([document])
+
+    def insert_many(self, documents, ordered=True):
+        self._request(documents)
+
+class StandInDatabase(object):
+    def __init__(self, latency):
+        self.calls = StandInCollection(latency)
+
+def synthetic_processes(processes, calls):
+    """Generate processes with their calls.
+    @param processes: number of processes.
+    @param calls: number of calls per process.
+    @return: behavior processes list.
+    """
+    results = []
+    for pid in xrange(processes):
+        results.append({"process_id": pid, "calls": [
+            Call("2013-01-01 00:00:00,000", "1", "filesystem", "NtCreateFile",
+                 True, "0x00000000",
+                 [Argument("FileName", "C:\\file%d.txt" % i),
+                  Argument("DesiredAccess", "0x80100080")])
+            for i in xrange(calls)]})
+    return results
+
+def legacy_store_calls(db, processes):
+    """One insert per chunk of 100 calls, as before the bulk mode."""
+    for process in processes:
+        chunk = []
+        for call in process["calls"]:
+            if len(chunk) == 100:
+                db.calls.insert_one({"pid": process["process_id"], "calls": chunk})
+                chunk = []
+            if isinstance(call, Record):
+                call = call.to_dict()
+            chunk.append(call)
+        if chunk:
+            db.calls.insert_one({"pid": process["process_id"], "calls": chunk})
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", help="Benchmark against a real MongoDB server, on its bench database", required=False)
+    parser.add_argument("--port", type=int, default=27017, help="MongoDB server port", required=False)
+    parser.add_argument("-l", "--latency", type=float, default=0.5, help="Stand-in round trip in milliseconds", required=False)
+    parser.add_argument("-p", "--processes", type=int, default=4, help="Number of processes", required=False)
+    parser.add_argument("-c", "--calls", type=int, default=50000, help="Number of calls per process", required=False)
+    parser.add_argument("--calls-per-chunk", type=int, default=100, required=False)
+    parser.add_argument("--chunks-per-insert", type=int, default=50, required=False)
+    args = parser.parse_args()
+
+    processes = synthetic_processes(args.processes, args.calls)
+    total = args.processes * args.calls
+
+    def database():
+        if args.host:
+            db = get_client(args.host, args.port).bench
+            db.calls.drop()
+            return db
+        return StandInDatabase(args.latency / 1000.0)
+
+    report = MongoDB()
+    report.set_options({"calls_per_chunk": args.calls_per_chunk,
+                        "chunks_per_insert": args.chunks_per_insert})
+
+    for name in ("legacy", "bulk"):
+        db = database()
+        start = time.time()
+        if name == "legacy":
+            legacy_store_calls(db, processes)
+        else:
+            report.db = db
+            report.store_calls(processes)
+        elapsed = time.time() - start
+        print "%-8s %8.3fs %10.0f calls/s" % (name, elapsed, total / elapsed)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import os
+import sys
+import time
+import socket
+import tempfile
+import argparse
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), ".."))
+
+import dpkt
+from lib.dragon.common import pcapscan
+from modules.processing.network import Pcap
+
+CLIENT = socket.inet_aton("192.168.56.101")
+RESPONSE_SEGMENTS = 8
+
+def frame(src, dst, transport):
+    proto = dpkt.ip.IP_PROTO_TCP if isinstance(transport, dpkt.tcp.TCP) else dpkt.ip.IP_PROTO_UDP
+    ip = dpkt.ip.IP(src=src, dst=dst, p=proto, data=transport)
+    ip.len = len(ip)
+    return str(dpkt.ethernet.Ethernet(data=ip))
+
+def connection(index):
+    """Frames of an HTTP connection: handshake, request, a response of
+    full sized segments each acknowledged, and teardown."""
+    server = socket.inet_aton("10.%d.%d.%d" % ((index >> 16) & 0xff, (index >> 8) & 0xff, index & 0xff))
+    sport = 1024 + index % 60000
+    request = "GET /%d HTTP/1.1\r\nHost: example%d.test\r\nUser-Agent: bench\r\n\r\n" % (index, index)
+    ACK, SYN, FIN = dpkt.tcp.TH_ACK, dpkt.tcp.TH_SYN, dpkt.tcp.TH_FIN
+
+    def tcp(seq, flags, data=""):
+        return dpkt.tcp.TCP(sport=sport, dport=80, seq=seq, flags=flags, data=data)
+
+    def reply(seq, flags, data=""):
+        return dpkt.tcp.TCP(sport=80, dport=sport, seq=seq, flags=flags, data=data)
+
+    frames = [frame(CLIENT, server, dpkt.udp.UDP(sport=sport, dport=53, data="\0" * 40)),
+              frame(CLIENT, server, tcp(0, SYN)),
+              frame(server, CLIENT, reply(0, SYN | ACK)),
+              frame(CLIENT, server, tcp(1, ACK)),
+              frame(CLIENT, server, tcp(1, ACK, request))]
+    seq = 1
+    for i in xrange(RESPONSE_SEGMENTS):
+        frames.append(frame(server, CLIENT, reply(seq, ACK, "x" * 1460)))
+        frames.append(frame(CLIENT, server, tcp(1 + len(request), ACK)))
+        seq += 1460
+    frames.append(frame(CLIENT, server, tcp(1 + len(request), FIN | ACK)))
+    frames.append(frame(server, CLIENT, reply(seq, FIN | ACK)))
+    frames.append(frame(CLIENT, server, tcp(2 + len(request), ACK)))
+    return frames
+
+def generate(path, size):
+    """Write a synthetic capture.
+    @param path: PCAP file path.
+    @param size: approximate size in bytes.
+    """
+    with open(path, "wb") as fd:
+        writer = dpkt.pcap.Writer(fd)
+        index = 0
+        ts = 1e9
+        while fd.tell() < size:
+            for buf in connection(index):
+                ts += 0.0001
+                writer.writepkt(buf, ts)
+            index += 1
+
+def scan_only(path):
+    scanner = pcapscan.PcapScanner(path)
+    packets = 0
+    for packet in scanner:
+        packets += 1
+    scanner.close()
+    return packets
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("pcap", nargs="?", help="Capture to benchmark on, a synthetic one is generated otherwise")
+    parser.add_argument("-s", "--size", type=int, default=256, help="Size of the synthetic capture in MB", required=False)
+    args = parser.parse_args()
+
+    path = args.pcap
+    if not path:
+        fd, path = tempfile.mkstemp(suffix=".pcap")
+        os.close(fd)
+        print "Generating %dMB capture in %s" % (args.size, path)
+        generate(path, args.size * 1024 * 1024)
+
+    size = os.path.getsize(path) / (1024.0 * 1024.0)
+    try:
+        for name in ("scan only", "scanner", "dpkt"):
+            pcapscan.HAVE_NUMPY = name != "dpkt"
+            start = time.time()
+            if name == "scan only":
+                packets = scan_only(path)
+            else:
+                Pcap(path).run()
+            elapsed = time.time() - start
+            print "%-10s %8.2fs %8.1f MB/s %10.0f packets/s" % (name, elapsed, size / elapsed, packets / elapsed)
+    finally:
+        if not args.pcap:
+            os.remove(path)
+
+if __name__ == "__main__":
+    main()
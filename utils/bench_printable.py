@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import os
+import sys
+import random
+import string
+import timeit
+import argparse
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), ".."))
+
+from lib.dragon.common.utils import convert_to_printable
+from lib.dragon.common.netlog import NetlogParser
+
+def legacy_convert_to_printable(s):
+    """Character by character implementation, the reference output."""
+    def convert_char(c):
+        if c in string.printable:
+            return c
+        else:
+            return r'\x%02x' % ord(c)
+    return ''.join(convert_char(c) for c in s)
+
+def synthetic_corpus(count):
+    """Generate argument values looking like the logged ones.
+    @param count: number of values.
+    @return: list of strings.
+    """
+    rand = random.Random(0)
+    values = []
+    for i in xrange(count):
+        kind = rand.randint(0, 9)
+        if kind < 3:
+            values.append("0x%08x" % rand.getrandbits(32))
+        elif kind < 5:
+            values.append("C:\\Documents and Settings\\User\\Local Settings\\Temp\\file%d.tmp" % i)
+        elif kind < 7:
+            values.append("HKEY_LOCAL_MACHINE\\SOFTWARE\\Microsoft\\Windows\\CurrentVersion\\Run\\%d" % i)
+        elif kind < 8:
+            values.append(str(rand.getrandbits(16)))
+        else:
+            # Raw buffers, mostly binary.
+            values.append("".join(chr(rand.getrandbits(8)) for x in xrange(rand.randint(16, 512))))
+    return values
+
+class RawLog(object):
+    """Netlog handler collecting the argument values of a raw log."""
+
+    def __init__(self, path):
+        self.fd = open(path, "rb")
+        self.values = []
+
+    def read(self, length):
+        buf = self.fd.read(length)
+        if len(buf) != length: raise EOFError()
+        return buf
+
+    def read_struct(self, st):
+        return st.unpack(self.read(st.size))
+
+    def log_process(self, *args):
+        pass
+
+    def log_thread(self, *args):
+        pass
+
+    def log_call(self, context, apiname, modulename, arguments):
+        self.values.extend(str(value) for argname, value in arguments)
+
+def raw_corpus(paths):
+    """Collect the argument values from recorded raw logs.
+    @param paths: raw log paths.
+    @return: list of strings.
+    """
+    values = []
+    for path in paths:
+        handler = RawLog(path)
+        parser = NetlogParser(handler)
+        try:
+            while parser.read_next_message():
+                pass
+        except EOFError:
+            pass
+        values.extend(handler.values)
+    return values
+
+def bench(fn, values, repeat):
+    """Time a conversion over a corpus.
+    @return: best time in seconds.
+    """
+    return min(timeit.repeat(lambda: [fn(value) for value in values], number=1, repeat=repeat))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("logs", nargs="*", help="Recorded .raw netlog files to take the values from (default: synthetic values)")
+    parser.add_argument("-c", "--count", type=int, default=100000, help="Number of synthetic values", required=False)
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Number of timed runs", required=False)
+    args = parser.parse_args()
+
+    if args.logs:
+        values = raw_corpus(args.logs)
+    else:
+        values = synthetic_corpus(args.count)
+
+    for value in values:
+        if convert_to_printable(value) != legacy_convert_to_printable(value):
+            print "Output mismatch for %r" % value
+            sys.exit(1)
+
+    size = sum(len(value) for value in values)
+    legacy = bench(legacy_convert_to_printable, values, args.repeat)
+    table = bench(convert_to_printable, values, args.repeat)
+    print "%d values, %d bytes" % (len(values), size)
+    print "%-8s %8.3fs %10.1f MB/s" % ("legacy", legacy, size / legacy / 1024 / 1024)
+    print "%-8s %8.3fs %10.1f MB/s" % ("table", table, size / table / 1024 / 1024)
+
+if __name__ == "__main__":
+    main()
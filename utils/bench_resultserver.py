@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# Copyright (C) 2010-2013 Cuckoo Sandbox Developers.
+# This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
+# See the file 'docs/LICENSE' for copying permission.
+
+import os
+import sys
+import time
+import shutil
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import SocketServer
+from threading import Thread, Lock
+
+logging.basicConfig()
+
+sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), ".."))
+
+from lib.dragon.common.config import Config
+from lib.dragon.common.utils import Singleton
+from lib.dragon.core.resultserver import Resulthandler, BufferedResulthandler
+from lib.dragon.core.resultserver import AsyncResultserver, AsyncResulthandler
+
+class BenchMixin(object):
+    """Stand-in for the result server bookkeeping, storing everything in a
+    temporary folder and counting the decoded messages."""
+
+    def init_bench(self):
+        self.storagepath = tempfile.mkdtemp(prefix="bench_")
+        # All the guests share the storage, avoid racing on its creation.
+        for folder in ("shots", "files", "logs"):
+            os.mkdir(os.path.join(self.storagepath, folder))
+        self.messages = 0
+        self.finished = None
+        self.lock = Lock()
+
+    def register_handler(self, handler):
+        return True
+
+    def build_storage_path(self, ip):
+        return self.storagepath
+
+    def count(self):
+        with self.lock:
+            self.messages += 1
+            self.finished = time.time()
+
+class ThreadedBenchServer(BenchMixin, SocketServer.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, handler):
+        self.cfg = Config()
+        self.init_bench()
+        SocketServer.ThreadingTCPServer.__init__(self, ("127.0.0.1", 0), counting(handler))
+        self.port = self.server_address[1]
+        self.servethread = Thread(target=self.serve_forever)
+        self.servethread.daemon = True
+        self.servethread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class AsyncBenchServer(BenchMixin, AsyncResultserver):
+    def __init__(self):
+        self.init_bench()
+        AsyncResultserver.__init__(self, ("127.0.0.1", 0))
+        self.handler_class = counting(AsyncResulthandler)
+        self.port = self.socket.getsockname()[1]
+
+    def stop(self):
+        self.shutdown()
+        # Singleton, allow a fresh instance for the next round.
+        Singleton._instances.pop(self.__class__, None)
+
+SERVERS = {
+    "plain" : lambda: ThreadedBenchServer(Resulthandler),
+    "buffered" : lambda: ThreadedBenchServer(BufferedResulthandler),
+    "async" : AsyncBenchServer,
+}
+
+def counting(handler):
+    """Subclass a result handler to count the decoded messages."""
+    class CountingHandler(handler):
+        def log_process(self, *args):
+            self.server.count()
+            handler.log_process(self, *args)
+
+        def log_thread(self, *args):
+            self.server.count()
+            handler.log_thread(self, *args)
+
+        def log_call(self, *args):
+            self.server.count()
+            handler.log_call(self, *args)
+
+    return CountingHandler
+
+def guest(port, logs, rounds, errors):
+    """Send netlog streams as the analyzer of a guest would.
+    @param port: result server port.
+    @param logs: list of raw netlog data.
+    @param rounds: number of times each log is sent.
+    @param errors: list collecting the failed connections.
+    """
+    for i in xrange(rounds):
+        for data in logs:
+            try:
+                sock = socket.create_connection(("127.0.0.1", port))
+                sock.sendall("NETLOG\n")
+                sock.sendall(data)
+                sock.close()
+            except socket.error as e:
+                errors.append(e)
+
+def bench(name, logs, guests, rounds):
+    """Replay logs from concurrent guests against a server.
+    @param name: server name.
+    @param logs: list of raw netlog data.
+    @param guests: number of concurrent guests.
+    @param rounds: number of times each guest sends each log.
+    @return: messages count, elapsed seconds, peak threads count and
+             failed connections count.
+    """
+    server = SERVERS[name]()
+    errors = []
+    threads = [Thread(target=guest, args=(server.port, logs, rounds, errors)) for i in xrange(guests)]
+
+    start = time.time()
+    for thread in threads:
+        thread.start()
+
+    # Connections are handled asynchronously, wait for them to drain.
+    peak = 0
+    last = -1
+    while last != server.messages or any(t.is_alive() for t in threads):
+        last = server.messages
+        # Don't count the simulated guests.
+        peak = max(peak, threading.active_count() - sum(1 for t in threads if t.is_alive()))
+        time.sleep(0.5)
+    elapsed = server.finished - start
+
+    server.stop()
+    shutil.rmtree(server.storagepath)
+    return server.messages, elapsed, peak, len(errors)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("logs", nargs="+", help="Recorded .raw netlog files to replay")
+    parser.add_argument("-g", "--guests", type=int, default=1, help="Number of concurrent guests", required=False)
+    parser.add_argument("-n", "--rounds", type=int, default=10, help="Number of times each guest replays each log", required=False)
+    parser.add_argument("--server", choices=sorted(SERVERS.keys()), action="append", help="Server to benchmark (default: all)", required=False)
+    args = parser.parse_args()
+
+    logs = [open(path, "rb").read() for path in args.logs]
+    for name in args.server or sorted(SERVERS.keys()):
+        messages, elapsed, peak, failed = bench(name, logs, args.guests, args.rounds)
+        print "%-10s %10d messages %8.2fs %12.0f messages/s %6d threads %6d failed connections" % (name, messages, elapsed, messages / elapsed, peak, failed)
+
+if __name__ == "__main__":
+    main()
@@ -5,35 +5,116 @@
 
 import os
 import sys
+import time
+import signal
 import logging
 import argparse
+import multiprocessing
 
 logging.basicConfig(level=logging.DEBUG)
+log = logging.getLogger()
 
 sys.path.append(os.path.join(os.path.abspath(os.path.dirname(__file__)), ".."))
 
 from lib.dragon.common.constants import CUCKOO_ROOT
+from lib.dragon.common.config import Config
+from lib.dragon.core.database import Database
 from lib.dragon.core.startup import init_modules
 from lib.dragon.core.processor import Processor
 from lib.dragon.core.reporter import Reporter
 
+# Seconds between two lookups for the tasks left by dead workers.
+RECLAIM_INTERVAL = 60
+
+def process(task_id, report=False, failed=False):
+    """Process the results of a task.
+    @param task_id: task id.
+    @param report: generate the reports.
+    @param failed: mark the analysis as failed.
+    """
+    if failed:
+        results = {"success" : False}
+    else:
+        results = Processor(task_id).run()
+        results["success"] = True
+
+    if report:
+        Reporter(task_id).run(results)
+
+def init_worker():
+    # Interruptions are handled by the parent, which terminates the pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def process_completed(task_id, success=True):
+    """Process and report a completed task, in a worker process.
+    @param task_id: task id.
+    @param success: whether the analysis succeeded, the failed ones are
+                    processed as well and then marked as failure.
+    """
+    try:
+        process(task_id, report=True)
+    except Exception:
+        log.exception("Failed to process task #%d", task_id)
+        Database().report(task_id, success=False)
+    else:
+        Database().report(task_id, success)
+        log.info("Task #%d: reports generation completed", task_id)
+    finally:
+        Database().end_session()
+
+def autoprocess(parallel):
+    """Keep processing the completed and failed analysis tasks.
+    @param parallel: number of worker processes.
+    """
+    cfg = Config()
+    db = Database()
+    pool = multiprocessing.Pool(parallel, init_worker)
+    pending = {}
+    reclaimed_on = 0
+
+    try:
+        while True:
+            # Tasks left by dead schedulers or workers, of this pool or not.
+            if cfg.timeouts.reclaim and time.time() - reclaimed_on > RECLAIM_INTERVAL:
+                db.touch_tasks(pending.keys())
+                reclaimed = db.reclaim_stale_tasks(int(cfg.timeouts.reclaim))
+                if reclaimed:
+                    log.warning("Reclaimed %d tasks left by a dead scheduler or processing worker", reclaimed)
+                reclaimed_on = time.time()
+
+            for task_id, result in pending.items():
+                if result.ready():
+                    del pending[task_id]
+
+            # Fetch as many completed tasks as there are idle workers.
+            task = None
+            if len(pending) < parallel:
+                task = db.fetch_and_report()
+                db.end_session()
+
+            if task:
+                log.info("Task #%d: processing results", task.id)
+                pending[task.id] = pool.apply_async(process_completed, (task.id, task.status == "reporting"))
+            else:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pool.terminate()
+        pool.join()
+
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("id", type=str, help="ID of the analysis to process")
+    parser.add_argument("id", type=str, help="ID of the analysis to process, or \"auto\" to keep processing the completed and failed analyses")
     parser.add_argument("-r", "--report", help="Re-generate report", action="store_true", required=False)
     parser.add_argument("-f", "--failed", help="Mark the analysis as failed", action="store_true", required=False)
+    parser.add_argument("-p", "--parallel", type=int, default=multiprocessing.cpu_count(), help="Number of worker processes in auto mode", required=False)
     args = parser.parse_args()
 
     init_modules()
 
-    if args.failed:
-        results = {"success" : False}
+    if args.id == "auto":
+        autoprocess(args.parallel)
     else:
-        results = Processor(args.id).run()
-        results["success"] = True
-
-    if args.report:
-        Reporter(args.id).run(results)
+        process(args.id, report=args.report, failed=args.failed)
 
 if __name__ == "__main__":
     main()
@@ -5,6 +5,7 @@
 
 import os
 import sys
+import urllib
 import logging
 import argparse
 try:
@@ -31,6 +32,8 @@ env = Environment()
 env.loader = FileSystemLoader(os.path.join(CUCKOO_ROOT, "data", "html"))
 # Global db pointer.
 db = Database()
+# Tasks listed per page.
+BROWSE_PAGE_SIZE = 100
 
 @hook("after_request")
 def custom_headers():
@@ -43,6 +46,11 @@ def custom_headers():
     response.headers["Cache-Control"] = "no-cache"
     response.headers["Expires"] = "0"
 
+@hook("after_request")
+def end_session():
+    """Return the database connection of the request to the pool."""
+    db.end_session()
+
 @route("/")
 def index():
     context = {}
@@ -51,7 +59,18 @@ def index():
 
 @route("/browse")
 def browse():
-    rows = db.list_tasks()
+    before = request.query.get("before", "")
+    if before and not before.isdigit():
+        return HTTPError(code=400, output="The specified ID is invalid")
+
+    status = request.query.get("status") or None
+    category = request.query.get("category") or None
+
+    # The samples are loaded along with the tasks.
+    rows = db.list_tasks(limit=BROWSE_PAGE_SIZE,
+                         before=int(before) if before else None,
+                         status=status,
+                         category=category) or []
 
     tasks = []
     for row in rows:
@@ -63,15 +82,24 @@ def browse():
             "added_on" : row.added_on
         }
 
-        if row.category == "file":
-            sample = db.view_sample(row.sample_id)
-            task["md5"] = sample.md5
+        if row.category == "file" and row.sample:
+            task["md5"] = row.sample.md5
 
         tasks.append(task)
 
+    # Query string of the next page, if any.
+    next_page = None
+    if len(rows) == BROWSE_PAGE_SIZE:
+        query = {"before" : rows[-1].id}
+        if status:
+            query["status"] = status
+        if category:
+            query["category"] = category
+        next_page = urllib.urlencode(query)
+
     template = env.get_template("browse.html")
 
-    return template.render({"rows" : tasks, "os" : os})
+    return template.render({"rows" : tasks, "os" : os, "next_page" : next_page})
 
 @route("/static/<filename:path>")
 def server_static(filename):